@@ -0,0 +1,69 @@
+"""
+Бенчмарк отрисовки текстов заказа.
+
+  header      — шапка категории (каждое нажатие на блюдо);
+  user        — текст заказа для клиента;
+  admin       — карточка заказа в админ-группе;
+  user_cold   — то же, что user, но с пустым кэшем строк блюд.
+
+Запуск: python bench_render.py [кол-во итераций]
+"""
+import statistics
+import sys
+import timeit
+
+import render
+
+_CART = [
+    {"name": f"Блюдо <{i}> & соус", "price": 100 + i * 10, "qty": 1 + i % 3}
+    for i in range(8)
+]
+_ORDER = {
+    "id": 123456,
+    "items": _CART,
+    "total": 9999,
+    "user_id": 42,
+    "user_name": "Иван <Test>",
+    "user_username": "ivan",
+    "phone": "+79990000000",
+    "address": "ул. Ленина, 1 & 2",
+    "courier": "Али",
+    "status": "onway",
+    "zone": "center",
+    "comment": "Позвонить <за 5 минут>",
+    "comment_topic": "delivery",
+}
+
+
+def _user() -> str:
+    return render.user_order_text(
+        "Иван", "+79990000000", "ул. Ленина, 1", _CART, "preparing", "Али",
+        comment_text="без лука", comment_topic="food", eta_text="~25 мин",
+    )
+
+
+def _user_cold() -> str:
+    render._items.cache_clear()
+    return _user()
+
+
+_CASES = {
+    "header": lambda: render.category_header("first", _CART),
+    "user": _user,
+    "admin": lambda: render.admin_order_text(_ORDER),
+    "user_cold": _user_cold,
+}
+
+
+def main() -> None:
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, fn in _CASES.items():
+        timings = [t / number * 1e6 for t in timeit.repeat(fn, number=number, repeat=5)]
+        print(
+            f"{name:<10} median {statistics.median(timings):6.2f} µs   "
+            f"min {min(timings):6.2f} µs   (n={number}×5)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Бенчмарк холодного старта.
+
+Каждый замер — отдельный процесс с чистым интерпретатором:
+  import    — импорт main (все модули бота, без сети);
+  client    — импорт + ленивое создание клиента Supabase (без сети).
+
+Запуск: python bench_startup.py [кол-во повторов]
+"""
+import statistics
+import subprocess
+import sys
+
+_SNIPPETS = {
+    "import": "import main",
+    "client": "import main, db; db._client()",
+}
+
+_TIMER = (
+    "import time; _t = time.perf_counter(); {code}; "
+    "print(time.perf_counter() - _t)"
+)
+
+
+def _measure(code: str, runs: int) -> list:
+    results = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _TIMER.format(code=code)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results.append(float(out.stdout.strip().splitlines()[-1]) * 1000)
+    return results
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, code in _SNIPPETS.items():
+        timings = _measure(code, runs)
+        print(
+            f"{name:<8} median {statistics.median(timings):7.1f} ms   "
+            f"min {min(timings):7.1f} ms   max {max(timings):7.1f} ms   (n={runs})"
+        )
+
+
+if __name__ == "__main__":
+    main()
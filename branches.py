@@ -0,0 +1,245 @@
+import json
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import ADMIN_GROUP_ID, BRANCH_ADMIN_GROUPS, BRANCHES_FILE
+from data import BRANCHES, CATEGORY_TITLES, DEFAULT_BRANCH
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Ключ в таблице settings с правками меню:
+# {"main": {"first:2": {"available": false}, "drinks:1": {"price": 100}}}
+MENU_OVERRIDES_KEY = "menu_overrides"
+
+Menus = Dict[str, Dict[str, List[Dict[str, Any]]]]
+
+_registry: Optional[Dict[str, Dict[str, Any]]] = None
+_registry_lock = threading.Lock()
+
+# Текущий снимок каталога: (версия, правки, меню филиалов с учётом правок).
+# Меняется только целиком одним присваиванием — читатели видят либо старый,
+# либо новый снимок, но никогда не смесь.
+_snapshot: Optional[Tuple[int, Dict[str, Dict[str, Dict[str, Any]]], Menus]] = None
+
+
+def _load_registry() -> Dict[str, Dict[str, Any]]:
+    """
+    Собирает реестр филиалов: встроенные из data.py + BRANCHES_FILE.
+    Вызывается один раз, при первом обращении.
+    """
+    registry = {key: dict(branch) for key, branch in BRANCHES.items()}
+    if BRANCHES_FILE:
+        try:
+            with open(BRANCHES_FILE, encoding="utf-8") as f:
+                extra = json.load(f)
+            for key, branch in extra.items():
+                registry[key] = {"title": key, "menu": {}, "zones": [], **branch}
+        except (OSError, ValueError):
+            logger.exception("Не удалось загрузить филиалы из %s", BRANCHES_FILE)
+    return registry
+
+
+def _branches() -> Dict[str, Dict[str, Any]]:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = _load_registry()
+    return _registry
+
+
+def branch_keys() -> List[str]:
+    return list(_branches())
+
+
+def get_branch(key: Optional[str]) -> Dict[str, Any]:
+    """
+    Филиал по ключу; неизвестный или пустой ключ — основной филиал.
+    """
+    branches = _branches()
+    return branches.get(key or DEFAULT_BRANCH) or branches[DEFAULT_BRANCH]
+
+
+def resolve_key(key: Optional[str]) -> str:
+    return key if key in _branches() else DEFAULT_BRANCH
+
+
+def dish_key(category_key: str, dish_id: int) -> str:
+    return f"{category_key}:{dish_id}"
+
+
+def _build_menus(overrides: Dict[str, Dict[str, Dict[str, Any]]]) -> Menus:
+    menus: Menus = {}
+    for key, branch in _branches().items():
+        branch_overrides = overrides.get(key, {})
+        menu = {}
+        for cat, dishes in branch["menu"].items():
+            visible = []
+            for dish in dishes:
+                override = branch_overrides.get(dish_key(cat, dish["id"]), {})
+                if override.get("available") is False:
+                    continue
+                if "price" in override:
+                    dish = {**dish, "price": int(override["price"])}
+                visible.append(dish)
+            menu[cat] = visible
+        menus[key] = menu
+    return menus
+
+
+def _current():
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = (0, {}, _build_menus({}))
+    return _snapshot
+
+
+def catalog_version() -> int:
+    return _current()[0]
+
+
+def get_overrides() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    return _current()[1]
+
+
+def set_overrides(overrides: Dict[str, Dict[str, Dict[str, Any]]]) -> int:
+    """
+    Собирает новый снимок каталога с правками и атомарно подменяет текущий.
+    Кэши индексов и клавиатур привязаны к версии, так что старые просто перестают читаться.
+    """
+    global _snapshot
+    version = _current()[0] + 1
+    _snapshot = (version, overrides, _build_menus(overrides))
+    _dish_index.cache_clear()
+    _dish_names.cache_clear()
+    _dishes_by_name.cache_clear()
+    logger.info("Каталог обновлён до версии %s", version)
+    return version
+
+
+def load_overrides(raw: Optional[str]) -> None:
+    """
+    Применяет правки меню из значения настройки menu_overrides (JSON).
+    Подписан на изменение настройки в кэше settings.
+    """
+    try:
+        overrides = json.loads(raw) if raw else {}
+    except ValueError:
+        logger.exception("Некорректные правки меню в settings, игнорируем")
+        return
+    if overrides != get_overrides():
+        set_overrides(overrides)
+
+
+def get_menu(key: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Меню филиала с учётом правок: без скрытых блюд и с актуальными ценами.
+    """
+    return _current()[2][resolve_key(key)]
+
+
+def find_base_dish(key: Optional[str], category_key: str, dish_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Блюдо из исходного меню, включая скрытые (для админских команд).
+    """
+    dishes = get_branch(key)["menu"].get(category_key, [])
+    return next((d for d in dishes if d["id"] == dish_id), None)
+
+
+def branch_categories(key: Optional[str]) -> Dict[str, str]:
+    """
+    Категории, в которых у филиала есть блюда (в порядке CATEGORY_TITLES).
+    """
+    menu = get_menu(key)
+    return {cat: title for cat, title in CATEGORY_TITLES.items() if menu.get(cat)}
+
+
+@lru_cache(maxsize=None)
+def _dish_index(key: str, version: int) -> Dict[tuple, Dict[str, Any]]:
+    return {
+        (cat, dish["id"]): dish
+        for cat, dishes in get_menu(key).items()
+        for dish in dishes
+    }
+
+
+def find_dish(key: Optional[str], category_key: str, dish_id: int) -> Optional[Dict[str, Any]]:
+    return _dish_index(resolve_key(key), catalog_version()).get((category_key, dish_id))
+
+
+@lru_cache(maxsize=None)
+def _dish_names(key: str, version: int) -> frozenset:
+    return frozenset(d["name"] for d in _dish_index(key, version).values())
+
+
+def serves_cart(key: str, cart: Iterable[Dict[str, Any]]) -> bool:
+    names = _dish_names(resolve_key(key), catalog_version())
+    return all(item.get("name") in names for item in cart)
+
+
+@lru_cache(maxsize=None)
+def _dishes_by_name(key: str, version: int) -> Dict[str, Dict[str, Any]]:
+    return {d["name"]: d for d in _dish_index(key, version).values()}
+
+
+CartChange = Tuple[str, int, Optional[int]]
+
+
+def revalidate_cart(
+    key: Optional[str], cart: Iterable[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[CartChange]]:
+    """
+    Сверяет корзину с текущим меню филиала: блюда из стоп-листа убирает,
+    цены берёт актуальные. Возвращает новую корзину и изменения
+    (название, старая цена, новая цена или None — блюдо убрано).
+    """
+    dishes = _dishes_by_name(resolve_key(key), catalog_version())
+    fresh: List[Dict[str, Any]] = []
+    changes: List[CartChange] = []
+    for item in cart:
+        dish = dishes.get(item.get("name"))
+        if dish is None:
+            changes.append((item.get("name", "—"), int(item.get("price", 0)), None))
+            continue
+        if dish["price"] != item.get("price"):
+            changes.append((dish["name"], int(item.get("price", 0)), dish["price"]))
+            item = {**item, "price": dish["price"]}
+        fresh.append(item)
+    return fresh, changes
+
+
+def admin_group_for(key: Optional[str]) -> Optional[int]:
+    branch = get_branch(key)
+    return (
+        branch.get("admin_group_id")
+        or BRANCH_ADMIN_GROUPS.get(resolve_key(key))
+        or ADMIN_GROUP_ID
+    )
+
+
+@lru_cache(maxsize=None)
+def _zone_index() -> Dict[str, str]:
+    return {
+        zone: key
+        for key, branch in _branches().items()
+        for zone in branch.get("zones", [])
+    }
+
+
+def branch_for_zone(zone: Optional[str]) -> Optional[str]:
+    return _zone_index().get(zone) if zone else None
+
+
+def route_order(chosen: Optional[str], zone: Optional[str], cart: Iterable[Dict[str, Any]]) -> str:
+    """
+    Какой кухне отдать заказ.
+    Если зона доставки закреплена за филиалом и там готовят все блюда из корзины —
+    отдаём ему; иначе заказ остаётся у филиала, из меню которого его собирали.
+    """
+    chosen = resolve_key(chosen)
+    by_zone = branch_for_zone(zone)
+    if by_zone and by_zone != chosen and serves_cart(by_zone, cart):
+        return by_zone
+    return chosen
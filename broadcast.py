@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+import metrics
+from config import BROADCAST_PAGE_SIZE, BROADCAST_RATE
+from db import DBError, delete_broadcasts, delete_client, get_clients_page, get_pending_broadcast, save_broadcast
+from lifecycle import lifecycle
+from logger import get_logger
+from outbound import OutboundLane
+from tenants import bot_for, tenant_keys
+
+logger = get_logger(__name__)
+
+_lane = OutboundLane("broadcast", BROADCAST_RATE, low_priority=True)
+
+
+def _groups() -> List[Optional[str]]:
+    """
+    Группы получателей по ботам. Один бот — все клиенты разом ([None]).
+    Несколько — клиенты каждого филиала от его бота, затем клиенты без
+    филиала (сохранённые до появления clients.tenant) от основного бота.
+    """
+    keys = tenant_keys()
+    return [*keys, None] if keys else [None]
+
+
+def _never_started(error: TelegramForbiddenError) -> bool:
+    # "bot can't initiate conversation with a user": клиент не запускал этого бота,
+    # но может пользоваться другим — это не повод удалять его из clients
+    return "initiate conversation" in error.message
+
+
+class Broadcast:
+    """
+    Рассылка по всей таблице clients, каждому клиенту — от бота, через
+    который он заказывал (clients.tenant).
+
+    Получатели читаются страницами (keyset по user_id, по группе на бота), отправка — через
+    отдельную низкоприоритетную полосу с ограничением скорости.
+    После каждой страницы прогресс (курсор и счётчики) сохраняется в таблицу
+    broadcasts, поэтому после перезапуска рассылка продолжается с того же места;
+    завершённая рассылка оттуда удаляется.
+    Заблокировавшие своего бота клиенты удаляются из clients, прочие ошибки
+    отправки (в том числе сетевые) считаются неудачными и рассылку не прерывают.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+        self.state: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot, text: str) -> str:
+        job_id = str(int(time.time()))
+        self.state = {
+            "id": job_id, "text": text, "groups": _groups(), "group": 0, "cursor": 0,
+            "sent": 0, "failed": 0, "pruned": 0, "done": False,
+        }
+        # новая рассылка заменяет приостановленную
+        await asyncio.to_thread(delete_broadcasts)
+        await self._checkpoint()
+        self._launch(bot)
+        return job_id
+
+    async def resume(self, bot: Bot) -> bool:
+        """
+        Продолжает незавершённую рассылку из broadcasts (при старте или по команде).
+        """
+        raw = await asyncio.to_thread(get_pending_broadcast)
+        if not raw:
+            return False
+        state = json.loads(raw)
+        if state.get("done"):
+            return False
+        # рассылка, сохранённая до разбивки по ботам, — одной группой
+        state.setdefault("groups", [None])
+        state.setdefault("group", 0)
+        self.state = state
+        self._launch(bot)
+        logger.info("Продолжаем рассылку %s с user_id > %s", state["id"], state["cursor"])
+        return True
+
+    def _launch(self, bot: Bot) -> None:
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        """
+        Останавливает рассылку после текущего сообщения и сохраняет прогресс.
+        """
+        if not self.running:
+            return
+        self._stop.set()
+        await asyncio.wait({self._task}, timeout=5)
+
+    async def _checkpoint(self) -> None:
+        if self.state["done"]:
+            await asyncio.to_thread(delete_broadcasts)
+        else:
+            await asyncio.to_thread(save_broadcast, self.state["id"], json.dumps(self.state, ensure_ascii=False))
+
+    async def _run(self, fallback: Bot) -> None:
+        state = self.state
+        groups = state["groups"]
+        by_tenant = groups != [None]
+        try:
+            while not self._stop.is_set():
+                if state["group"] >= len(groups):
+                    state["done"] = True
+                    break
+                tenant = groups[state["group"]]
+                page = await asyncio.to_thread(
+                    get_clients_page, state["cursor"], BROADCAST_PAGE_SIZE, tenant, by_tenant
+                )
+                if not page:
+                    state["group"] += 1
+                    state["cursor"] = 0
+                    continue
+                bot = bot_for(tenant, fallback)
+                # у клиента без филиала при нескольких ботах неизвестно, чей он:
+                # отказ основного бота ещё не значит, что клиент заблокировал свой
+                prune = tenant is not None or not by_tenant
+                for user_id in page:
+                    if self._stop.is_set():
+                        break
+                    await self._deliver(bot, user_id, prune)
+                    state["cursor"] = user_id
+                await self._checkpoint()
+        except DBError:
+            logger.exception("Рассылка %s прервана ошибкой БД", state["id"])
+        finally:
+            try:
+                await self._checkpoint()
+            except DBError:
+                logger.warning("Не удалось сохранить прогресс рассылки %s", state["id"])
+            logger.info(
+                "Рассылка %s: отправлено %s, ошибок %s, удалено %s%s",
+                state["id"], state["sent"], state["failed"], state["pruned"],
+                "" if state["done"] else " (не завершена)",
+            )
+
+    async def _deliver(self, bot: Bot, user_id: int, prune: bool) -> None:
+        state = self.state
+        try:
+            await _lane.send(lambda: bot.send_message(user_id, state["text"]))
+            state["sent"] += 1
+        except TelegramForbiddenError as e:
+            if not prune or _never_started(e):
+                state["failed"] += 1
+                metrics.inc("broadcast.failed")
+                return
+            # бот заблокирован или пользователь удалён — больше не пишем
+            state["pruned"] += 1
+            metrics.inc("broadcast.pruned")
+            try:
+                await asyncio.to_thread(delete_client, user_id)
+            except DBError:
+                logger.warning("Не удалось удалить клиента %s из рассылки", user_id)
+        except TelegramAPIError as e:
+            # неверный запрос, ошибка сервера, сеть, исчерпанные повторы RetryAfter
+            state["failed"] += 1
+            metrics.inc("broadcast.failed")
+            logger.warning("Рассылка: не удалось отправить клиенту %s: %s", user_id, e)
+
+    def progress(self) -> str:
+        if not self.state:
+            return "Рассылок не было."
+        s = self.state
+        status = "завершена" if s["done"] else ("идёт" if self.running else "приостановлена")
+        return (
+            f"Рассылка {s['id']}: {status}\n"
+            f"Отправлено: {s['sent']}, ошибок: {s['failed']}, удалено: {s['pruned']}"
+        )
+
+
+# Общая на процесс рассылка (одновременно — одна)
+broadcast = Broadcast()
+lifecycle.on_drain(broadcast.stop)
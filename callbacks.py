@@ -0,0 +1,100 @@
+"""
+Схема callback_data.
+
+Все кнопки кодируются через фабрики aiogram CallbackData с короткими
+префиксами. Цифра в префиксе — версия схемы: при несовместимом изменении
+полей заводится новый префикс, а старые кнопки можно разобрать отдельно
+(как legacy «order:...» ниже). Статусы кодируются одной буквой, чтобы
+даже для больших id данные оставались далеко от лимита Telegram в 64 байта.
+"""
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+STATUS_CODES = {
+    "new": "n",
+    "preparing": "p",
+    "ready": "r",
+    "handoff": "h",
+    "onway": "w",
+    "delivered": "d",
+    "canceled": "x",
+}
+STATUS_BY_CODE = {code: status for status, code in STATUS_CODES.items()}
+
+# Действия с заказом в админ-группе
+ORDER_SET = "s"         # arg — код статуса
+ORDER_COURIER = "c"     # ввести курьера вручную
+ORDER_ASSIGN = "a"      # arg — id предложенного курьера
+ORDER_REFRESH = "r"
+
+# Массовые действия в списке /active
+BULK_TOGGLE = "t"       # order — отметить/снять заказ
+BULK_PICK = "p"         # arg — код статуса: отметить все заказы в нём
+BULK_APPLY = "a"        # arg — код нового статуса для отмеченных
+BULK_CLEAR = "c"
+BULK_REFRESH = "r"
+
+
+class BranchCb(CallbackData, prefix="b1"):
+    branch: str
+
+
+class CategoryCb(CallbackData, prefix="c1"):
+    cat: str
+
+
+class DishCb(CallbackData, prefix="d1"):
+    cat: str
+    dish: int
+    page: int
+
+
+class PageCb(CallbackData, prefix="p1"):
+    cat: str
+    page: int
+
+
+class CommentCb(CallbackData, prefix="m1"):
+    topic: str
+
+
+class OrderCb(CallbackData, prefix="o1"):
+    action: str
+    order: int
+    arg: str = ""
+
+
+class BulkCb(CallbackData, prefix="k1"):
+    action: str
+    order: int = 0
+    arg: str = ""
+
+
+def order_set(order_id: int, status: str) -> str:
+    return OrderCb(action=ORDER_SET, order=order_id, arg=STATUS_CODES[status]).pack()
+
+
+def order_action(action: str, order_id: int, arg: str = "") -> str:
+    return OrderCb(action=action, order=order_id, arg=arg).pack()
+
+
+_LEGACY_ACTIONS = {"set": ORDER_SET, "setcourier": ORDER_COURIER, "assign": ORDER_ASSIGN, "refresh": ORDER_REFRESH}
+
+
+def parse_legacy_order(data: str) -> Optional[OrderCb]:
+    """
+    Кнопки карточек, отправленных до перехода на OrderCb: order:<action>:<id>[:<arg>].
+    """
+    parts = (data or "").split(":")
+    if len(parts) < 3 or parts[0] != "order" or not parts[2].isdigit():
+        return None
+    action = _LEGACY_ACTIONS.get(parts[1])
+    if action is None:
+        return None
+    arg = parts[3] if len(parts) > 3 else ""
+    if action == ORDER_SET:
+        arg = STATUS_CODES.get(arg, "")
+        if not arg:
+            return None
+    return OrderCb(action=action, order=int(parts[2]), arg=arg)
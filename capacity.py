@@ -0,0 +1,149 @@
+import math
+from collections import Counter
+from datetime import datetime, time as dtime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import metrics
+from config import AVG_PREP_MINUTES, BOT_TIMEZONE, CAPACITY_MAX_ORDERS, OPENING_HOURS
+from data import DEFAULT_BRANCH
+from eta import estimator
+from logger import get_logger
+from settings import settings
+
+logger = get_logger(__name__)
+
+ACTIVE_STATUSES = ("new", "preparing", "ready", "handoff", "onway")
+# Статусы, в которых заказ занимает кухню
+KITCHEN_STATUSES = ("new", "preparing")
+
+
+def _tz():
+    if not BOT_TIMEZONE:
+        return None
+    from zoneinfo import ZoneInfo
+
+    return ZoneInfo(BOT_TIMEZONE)
+
+
+def parse_hours(value: str) -> Optional[Tuple[dtime, dtime]]:
+    """
+    "10:00-22:00" -> (10:00, 22:00). Пустая или кривая строка — круглосуточно.
+    """
+    try:
+        start, end = (part.strip() for part in value.split("-", 1))
+        return dtime.fromisoformat(start), dtime.fromisoformat(end)
+    except ValueError:
+        return None
+
+
+def is_open(hours: Optional[Tuple[dtime, dtime]], now: dtime) -> bool:
+    if hours is None:
+        return True
+    start, end = hours
+    if start <= end:
+        return start <= now < end
+    # через полночь: "18:00-02:00"
+    return now >= start or now < end
+
+
+class CapacityController:
+    """
+    Контроль допуска к оформлению заказа.
+
+    Держит в памяти статусы активных заказов по филиалам (заполняется из
+    create_order/update_status через on_created/on_status, при старте — seed()).
+    Если кухня филиала загружена выше max_kitchen_orders или сейчас нерабочее
+    время — новое оформление не начинается, клиент получает ETA.
+    """
+
+    def __init__(self):
+        self._orders: Dict[int, Tuple[str, str]] = {}
+        self._counts: Dict[str, Counter] = {}
+
+    # ----- учёт -----
+    def _set(self, order_id: int, branch: str, status: Optional[str]) -> None:
+        old = self._orders.pop(order_id, None)
+        if old:
+            self._counts[old[0]][old[1]] -= 1
+        if status in ACTIVE_STATUSES:
+            self._orders[order_id] = (branch, status)
+            self._counts.setdefault(branch, Counter())[status] += 1
+        metrics.set_gauge("orders.active", len(self._orders))
+
+    def seed(self, active_orders: Iterable[Dict[str, Any]]) -> None:
+        self._orders.clear()
+        self._counts.clear()
+        for order in active_orders:
+            self._set(order["id"], order.get("branch") or DEFAULT_BRANCH, order.get("status"))
+
+    def on_created(self, order_id: int, branch: Optional[str]) -> None:
+        self._set(order_id, branch or DEFAULT_BRANCH, "new")
+
+    def on_status(self, order_id: int, status: str) -> None:
+        known = self._orders.get(order_id)
+        branch = known[0] if known else DEFAULT_BRANCH
+        self._set(order_id, branch, status)
+
+    def counts(self, branch: Optional[str] = None) -> Counter:
+        return Counter(self._counts.get(branch or DEFAULT_BRANCH, Counter()))
+
+    def kitchen_load(self, branch: Optional[str] = None) -> int:
+        counts = self._counts.get(branch or DEFAULT_BRANCH, Counter())
+        return sum(counts[s] for s in KITCHEN_STATUSES)
+
+    # ----- допуск -----
+    def _limit(self) -> int:
+        raw = settings.get("max_kitchen_orders")
+        return int(raw) if raw and raw.isdigit() else CAPACITY_MAX_ORDERS
+
+    def _avg_prep_minutes(self) -> float:
+        # живая статистика важнее ручной настройки
+        measured = estimator.kitchen_minutes()
+        if measured:
+            return measured
+        raw = settings.get("avg_prep_minutes")
+        try:
+            return float(raw) if raw else AVG_PREP_MINUTES
+        except ValueError:
+            return AVG_PREP_MINUTES
+
+    def wait_minutes(self, branch: Optional[str] = None) -> int:
+        """
+        Через сколько минут освободится место: кухня выпускает примерно
+        `limit` заказов за среднее время приготовления.
+        """
+        limit = self._limit()
+        if not limit:
+            return 0
+        overflow = self.kitchen_load(branch) - limit + 1
+        if overflow <= 0:
+            return 0
+        return max(1, math.ceil(self._avg_prep_minutes() * overflow / limit))
+
+    def admit(self, branch: Optional[str] = None, now: Optional[datetime] = None) -> Tuple[bool, str]:
+        """
+        (можно ли начинать оформление, текст для клиента при отказе).
+        """
+        hours_raw = settings.get("opening_hours", OPENING_HOURS) or ""
+        hours = parse_hours(hours_raw) if hours_raw else None
+        now = now or datetime.now(_tz())
+        if not is_open(hours, now.time()):
+            metrics.inc("capacity.closed")
+            start, end = hours
+            return False, (
+                f"Сейчас мы закрыты 😴\n"
+                f"Принимаем заказы с {start:%H:%M} до {end:%H:%M}."
+            )
+
+        wait = self.wait_minutes(branch)
+        if wait:
+            metrics.inc("capacity.rejected")
+            return False, (
+                f"Кухня сейчас перегружена 🔥\n"
+                f"Попробуйте оформить заказ примерно через {wait} мин."
+            )
+        return True, ""
+
+
+# Общий на процесс контроллер
+capacity = CapacityController()
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+import metrics
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+Render = Callable[[], Awaitable[None]]
+
+
+class _Pending:
+    __slots__ = ("render", "first", "due", "task")
+
+    def __init__(self, render: Render, now: float, due: float):
+        self.render = render
+        self.first = now
+        self.due = due
+        self.task: Optional[asyncio.Task] = None
+
+
+class EditCoalescer:
+    """
+    Склеивает частые правки одного и того же сообщения в одну.
+
+    schedule() запоминает последнюю функцию отрисовки для ключа
+    (обычно (chat_id, message_id)) и откладывает её вызов, пока не наступит
+    `quiet` секунд тишины — но не дольше `max_delay` от первой правки в серии.
+    Выполняется только последняя отрисовка, промежуточные теряются намеренно.
+    """
+
+    def __init__(self, quiet: float, max_delay: float):
+        self.quiet = quiet
+        self.max_delay = max(max_delay, quiet)
+        self._pending: Dict[Hashable, _Pending] = {}
+
+    def schedule(self, key: Hashable, render: Render) -> None:
+        now = time.monotonic()
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = _Pending(render, now, now + self.quiet)
+            # через lifecycle: остановка дождётся и правки, которая уже отправляется
+            entry.task = lifecycle.spawn(self._run(key, entry))
+            return
+
+        metrics.inc("edits.coalesced")
+        entry.render = render
+        entry.due = min(now + self.quiet, entry.first + self.max_delay)
+
+    async def _run(self, key: Hashable, entry: _Pending) -> None:
+        # due может сдвинуться, пока спим — досыпаем до актуального срока
+        while True:
+            delay = entry.due - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        if self._pending.get(key) is entry:
+            del self._pending[key]
+        await self._render(key, entry.render)
+
+    async def _render(self, key: Hashable, render: Render) -> None:
+        metrics.inc("edits.flushed")
+        try:
+            await render()
+        except Exception:
+            logger.exception("Не удалось применить отложенную правку %r", key)
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Отменяет отложенную правку: сообщение уже перерисовано другим экраном,
+        и запоздалая отрисовка затёрла бы его. True — если было что отменять.
+        """
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return False
+        entry.task.cancel()
+        metrics.inc("edits.canceled")
+        return True
+
+    async def flush_all(self) -> None:
+        """
+        Немедленно выполняет все отложенные правки (например, при остановке бота).
+        """
+        entries: List = list(self._pending.items())
+        self._pending.clear()
+        for key, entry in entries:
+            entry.task.cancel()
+        for key, entry in entries:
+            await self._render(key, entry.render)
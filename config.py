@@ -3,14 +3,28 @@ import os
 
 load_dotenv()
 
+# Обязательные переменные проверяются в check_required(), а не при импорте:
+# так модули можно импортировать (бенчмарки, утилиты) без полного .env.
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError("Не найден BOT_TOKEN в .env")
-
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Нужно указать SUPABASE_URL и SUPABASE_KEY в .env")
+
+
+# Несколько ботов в одном процессе: "brand=123:AAA,north=456:BBB".
+# Ключ — филиал, меню и админ-группу которого обслуживает бот. Пусто — один бот BOT_TOKEN.
+_bot_tokens_str = os.getenv("BOT_TOKENS", "")
+BOT_TOKENS = {
+    key.strip(): token.strip()
+    for key, _, token in (pair.partition("=") for pair in _bot_tokens_str.split(","))
+    if key.strip() and token.strip()
+}
+
+
+def check_required() -> None:
+    if not BOT_TOKEN and not BOT_TOKENS:
+        raise ValueError("Не найден BOT_TOKEN (или BOT_TOKENS) в .env")
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("Нужно указать SUPABASE_URL и SUPABASE_KEY в .env")
 
 _admin_group_env = os.getenv("ADMIN_GROUP_ID", "").strip()
 ADMIN_GROUP_ID = int(_admin_group_env) if _admin_group_env.lstrip("-").isdigit() else None
@@ -20,3 +34,128 @@ ADMIN_IDS = {
     int(x) for x in _admin_ids_str.split(",")
     if x.strip().lstrip("+").isdigit()
 }
+
+# ----- Политика запросов к БД -----
+# Таймаут одного HTTP-запроса к Supabase (сек.)
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "5"))
+# Общий дедлайн операции с учётом повторов (сек.)
+DB_READ_DEADLINE = float(os.getenv("DB_READ_DEADLINE", "8"))
+DB_WRITE_DEADLINE = float(os.getenv("DB_WRITE_DEADLINE", "5"))
+# Сколько раз повторять идемпотентное чтение
+DB_READ_RETRIES = int(os.getenv("DB_READ_RETRIES", "2"))
+# Предохранитель: сколько сбоев подряд размыкают цепь и на сколько секунд
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", "5"))
+DB_BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", "15"))
+
+# ----- Антифлуд -----
+# Сколько апдейтов в секунду в среднем разрешено одному пользователю и какой запас на всплеск
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+
+# ----- Склейка правок сообщений -----
+# Сколько ждать тишины после последнего нажатия и максимум задержки правки (сек.)
+EDIT_QUIET_PERIOD = float(os.getenv("EDIT_QUIET_PERIOD", "0.7"))
+EDIT_MAX_DELAY = float(os.getenv("EDIT_MAX_DELAY", "2"))
+
+# ----- Остановка -----
+# Сколько секунд ждать завершения начатых обработчиков и отложенных отправок при SIGTERM
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
+# ----- Филиалы -----
+# Админ-группа каждого филиала: "main:-100123,north:-100456".
+# Для филиала без своей группы используется ADMIN_GROUP_ID.
+_branch_groups_str = os.getenv("BRANCH_ADMIN_GROUPS", "")
+BRANCH_ADMIN_GROUPS = {
+    key.strip(): int(value)
+    for key, _, value in (pair.partition(":") for pair in _branch_groups_str.split(","))
+    if key.strip() and value.strip().lstrip("-").isdigit()
+}
+# JSON с дополнительными филиалами: {"north": {"title": ..., "menu": {...}, "zones": [...]}}
+BRANCHES_FILE = os.getenv("BRANCHES_FILE", "").strip() or None
+
+# ----- Зоны доставки -----
+# CSV со справочником улиц и геохеш-ячеек: kind,key,zone (образец — zones.example.csv).
+# Не задан — зоны не проверяются, принимается любой адрес
+ZONES_FILE = os.getenv("ZONES_FILE", "").strip() or None
+
+# ----- Курьеры -----
+# Назначать курьера автоматически, когда заказ готов (иначе — только предлагать кнопкой)
+COURIER_AUTO_ASSIGN = os.getenv("COURIER_AUTO_ASSIGN", "").strip().lower() in ("1", "true", "yes")
+# Сколько заказов одновременно может везти один курьер
+COURIER_MAX_LOAD = int(os.getenv("COURIER_MAX_LOAD", "3"))
+
+# ----- Журнал событий заказов -----
+# Как часто сбрасывать накопленные события в order_events (сек.) и максимум в одной пачке
+EVENTS_FLUSH_INTERVAL = float(os.getenv("EVENTS_FLUSH_INTERVAL", "2"))
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", "100"))
+
+# ----- Настройки -----
+# Как часто проверять, не поменялись ли настройки в БД (сек.)
+SETTINGS_REFRESH_INTERVAL = float(os.getenv("SETTINGS_REFRESH_INTERVAL", "30"))
+
+# ----- Загрузка кухни -----
+# Значения по умолчанию; в работе переопределяются ключами таблицы settings:
+# max_kitchen_orders (0 — без ограничения), opening_hours ("10:00-22:00"), avg_prep_minutes
+CAPACITY_MAX_ORDERS = int(os.getenv("CAPACITY_MAX_ORDERS", "0"))
+OPENING_HOURS = os.getenv("OPENING_HOURS", "").strip()
+AVG_PREP_MINUTES = float(os.getenv("AVG_PREP_MINUTES", "15"))
+# Сколько заказов кухня готовит одновременно — стартовая оценка темпа очереди,
+# пока нет замеров, как часто заказы уходят с кухни
+KITCHEN_PARALLEL = max(1, int(os.getenv("KITCHEN_PARALLEL", "3")))
+# Часовой пояс кухни для часов работы (по умолчанию — время сервера)
+BOT_TIMEZONE = os.getenv("BOT_TIMEZONE", "").strip() or None
+
+# ----- Рассылки -----
+# Сообщений в секунду для рассылок (лимит Telegram ~30/с на бота — оставляем запас заказам)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "15"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "100"))
+
+# ----- Массовые действия (/active) -----
+# Уведомлений клиентам в секунду при массовой смене статуса (лимит Telegram ~30/с на бота)
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "20"))
+# Правок карточек в админ-группе в секунду (у групп свой, более жёсткий лимит)
+CARD_EDIT_RATE = float(os.getenv("CARD_EDIT_RATE", "3"))
+# Сколько заказов показывать кнопками в списке (кнопок в сообщении не больше 100)
+BULK_LIST_LIMIT = int(os.getenv("BULK_LIST_LIMIT", "40"))
+
+# ----- Оплата -----
+# Токен платёжного провайдера из BotFather; пусто — оплата только наличными курьеру
+PAYMENTS_PROVIDER_TOKEN = os.getenv("PAYMENTS_PROVIDER_TOKEN", "").strip() or None
+# Токен провайдера привязан к боту: для ботов из BOT_TOKENS — "brand=123:LIVE:AAA,north=...".
+# Бот без своего токена берёт PAYMENTS_PROVIDER_TOKEN (подходит только для бота BOT_TOKEN)
+_provider_tokens_str = os.getenv("PAYMENTS_PROVIDER_TOKENS", "")
+PAYMENTS_PROVIDER_TOKENS = {
+    key.strip(): token.strip()
+    for key, _, token in (pair.partition("=") for pair in _provider_tokens_str.split(","))
+    if key.strip() and token.strip()
+}
+PAYMENTS_CURRENCY = os.getenv("PAYMENTS_CURRENCY", "RUB").strip().upper()
+# Как часто отмечать полученные оплаты в orders (сек.)
+PAYMENTS_FLUSH_INTERVAL = float(os.getenv("PAYMENTS_FLUSH_INTERVAL", "3"))
+
+# ----- Сторож цикла событий -----
+# С какой задержки цикла (сек.) считать его заблокированным и снимать стек; 0 — выключить
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+# Как часто меряется задержка (сек.)
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1"))
+
+# ----- Трассировка -----
+# Включить трассы апдейтов постоянно (иначе — только на время /profile on)
+TRACING = os.getenv("TRACING", "").strip().lower() in ("1", "true", "yes")
+# Доля «обычных» апдейтов, которые сохраняются; медленные и упавшие сохраняются всегда
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# С какой длительности апдейт (мс) считается медленным
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "300"))
+# Куда выгружать: OTLP/HTTP коллектор (например, http://localhost:4318/v1/traces) или файл JSON Lines
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "").strip() or None
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Как часто выгружать накопленные трассы (сек.)
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2"))
+
+# ----- Логи -----
+# Файл лога (вне каталога с кодом); пусто — только консоль
+LOG_FILE = os.getenv("LOG_FILE", "logs/bot.log").strip() or None
+# Сколько суточных архивов (.gz) хранить
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "14"))
+# Ключ для хэширования id пользователей в логах (по умолчанию выводится из BOT_TOKEN)
+LOG_HASH_KEY = os.getenv("LOG_HASH_KEY", "").strip() or None
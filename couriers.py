@@ -0,0 +1,199 @@
+import heapq
+import itertools
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from config import COURIER_MAX_LOAD
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Статусы, в которых курьер уже закреплён за заказом
+BUSY_STATUSES = ("ready", "handoff", "onway")
+FINAL_STATUSES = ("delivered", "canceled")
+
+_ANY_ZONE = None
+
+
+class CourierPool:
+    """
+    Доступные курьеры в памяти: очередь с приоритетом по загрузке.
+
+    На каждую зону (и общую) — своя куча (загрузка, порядковый номер, id, версия).
+    При изменении загрузки в кучи кладётся новая запись, а старая помечается
+    устаревшей по версии и выбрасывается, когда окажется наверху.
+    Так выбор, назначение и освобождение — O(log n) амортизированно.
+
+    Заказы, готовые раньше, чем появился свободный курьер, ждут в очереди
+    и получают курьера в match_waiting() — при освобождении или появлении курьера.
+    Очередь устроена так же, как кучи: заказ, получивший курьера или закрытый,
+    только снимается со счёта в _waiting (O(1)), а его запись в деке
+    выбрасывается, когда дойдёт до начала.
+    """
+
+    def __init__(self, max_load: int = COURIER_MAX_LOAD):
+        self.max_load = max(1, max_load)
+        self._couriers: Dict[int, Dict[str, Any]] = {}
+        self._heaps: Dict[Optional[str], List[Tuple[int, int, int, int]]] = {_ANY_ZONE: []}
+        self._seq = itertools.count()
+        self._order_courier: Dict[int, int] = {}
+        # order_id -> номер актуальной записи в _queue
+        self._waiting: Dict[int, int] = {}
+        self._queue: Deque[Tuple[int, Optional[str], int]] = deque()
+
+    # ----- реестр -----
+    def load(self, couriers: Iterable[Dict[str, Any]], active_orders: Iterable[Dict[str, Any]] = ()) -> None:
+        """
+        Полная перезагрузка: курьеры из таблицы couriers + их текущие заказы.
+        """
+        self._couriers.clear()
+        self._heaps = {_ANY_ZONE: []}
+        self._order_courier.clear()
+        self._waiting.clear()
+        self._queue.clear()
+
+        for c in couriers:
+            self.add_courier(c["id"], c["name"], c.get("zone"), push=False)
+        for order in active_orders:
+            cid = order.get("courier_id")
+            if cid in self._couriers and order.get("status") not in FINAL_STATUSES:
+                self._order_courier[order["id"]] = cid
+                self._couriers[cid]["load"] += 1
+            elif order.get("status") == "ready" and not order.get("courier"):
+                self.wait(order["id"], order.get("zone"))
+        for cid in self._couriers:
+            self._push(cid)
+
+    def add_courier(self, courier_id: int, name: str, zone: Optional[str] = None, *, push: bool = True) -> None:
+        self._couriers[courier_id] = {
+            "id": courier_id, "name": name, "zone": zone,
+            "load": 0, "version": 0, "available": True,
+        }
+        if push:
+            self._push(courier_id)
+
+    def set_available(self, courier_id: int, available: bool) -> None:
+        courier = self._couriers.get(courier_id)
+        if courier is None:
+            return
+        courier["available"] = available
+        self._push(courier_id)
+
+    def get(self, courier_id: int) -> Optional[Dict[str, Any]]:
+        return self._couriers.get(courier_id)
+
+    def find_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        name = (name or "").strip().lower()
+        return next((c for c in self._couriers.values() if c["name"].lower() == name), None)
+
+    def couriers(self) -> List[Dict[str, Any]]:
+        return sorted(self._couriers.values(), key=lambda c: (c["load"], c["name"]))
+
+    # ----- кучи -----
+    def _push(self, courier_id: int) -> None:
+        courier = self._couriers[courier_id]
+        courier["version"] += 1
+        if not courier["available"] or courier["load"] >= self.max_load:
+            return
+        entry = (courier["load"], next(self._seq), courier_id, courier["version"])
+        heapq.heappush(self._heaps[_ANY_ZONE], entry)
+        if courier["zone"]:
+            heapq.heappush(self._heaps.setdefault(courier["zone"], []), entry)
+
+    def _top(self, zone: Optional[str]) -> Optional[Dict[str, Any]]:
+        heap = self._heaps.get(zone)
+        while heap:
+            _, _, cid, version = heap[0]
+            courier = self._couriers.get(cid)
+            if courier is not None and courier["version"] == version:
+                return courier
+            heapq.heappop(heap)
+        return None
+
+    def best(self, zone: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Наименее загруженный свободный курьер: сначала из зоны заказа, затем любой.
+        """
+        if zone:
+            courier = self._top(zone)
+            if courier is not None:
+                return courier
+        return self._top(_ANY_ZONE)
+
+    # ----- события заказов -----
+    def assign(self, order_id: int, courier_id: int) -> None:
+        if courier_id not in self._couriers:
+            return
+        if self._order_courier.get(order_id) == courier_id:
+            return
+        self.release(order_id)
+        self._order_courier[order_id] = courier_id
+        self._couriers[courier_id]["load"] += 1
+        self._push(courier_id)
+        self._waiting.pop(order_id, None)
+
+    def release(self, order_id: int) -> None:
+        cid = self._order_courier.pop(order_id, None)
+        if cid is None or cid not in self._couriers:
+            return
+        courier = self._couriers[cid]
+        courier["load"] = max(0, courier["load"] - 1)
+        self._push(cid)
+
+    def wait(self, order_id: int, zone: Optional[str], *, front: bool = False) -> None:
+        """
+        Ставит заказ в очередь на курьера; front=True — в начало
+        (назначение сорвалось, заказ готов раньше остальных).
+        """
+        if order_id in self._waiting:
+            return
+        ticket = next(self._seq)
+        self._waiting[order_id] = ticket
+        if front:
+            self._queue.appendleft((order_id, zone, ticket))
+        else:
+            self._queue.append((order_id, zone, ticket))
+
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def on_status(self, order_id: int, status: str) -> None:
+        if status in FINAL_STATUSES:
+            self.release(order_id)
+            self._waiting.pop(order_id, None)
+
+    def match_waiting(self) -> List[Tuple[int, Optional[str], Dict[str, Any]]]:
+        """
+        Раздаёт ожидающие заказы свободным курьерам (в порядке готовности).
+        Возвращает тройки (order_id, зона, курьер) — их нужно сохранить в БД.
+        """
+        matched = []
+        while self._queue:
+            order_id, zone, ticket = self._queue[0]
+            if self._waiting.get(order_id) != ticket:
+                self._queue.popleft()
+                continue
+            courier = self.best(zone)
+            if courier is None:
+                break
+            self._queue.popleft()
+            self.assign(order_id, courier["id"])
+            matched.append((order_id, zone, courier))
+        return matched
+
+
+# Общий на процесс пул; заполняется в main() через reload_pool()
+pool = CourierPool()
+
+
+def reload_pool(active_orders: Optional[List[Dict[str, Any]]] = None) -> None:
+    """
+    Загружает курьеров и (если не переданы) активные заказы из БД.
+    Синхронно — вызывать в потоке.
+    """
+    from db import get_active_orders, get_couriers
+
+    if active_orders is None:
+        active_orders = get_active_orders()
+    pool.load(get_couriers(), active_orders)
+    logger.info("Загружено курьеров: %s", len(pool.couriers()))
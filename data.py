@@ -23,3 +23,17 @@ MENU = {
         {"id": 2, "name": "Чай", "price": 60},
     ],
 }
+
+# Филиалы (кухни). У каждого своё меню, своя админ-группа и свои зоны доставки.
+# Админ-группы задаются в .env (BRANCH_ADMIN_GROUPS), дополнительные филиалы
+# можно описать в JSON-файле BRANCHES_FILE — он подгружается при первом обращении.
+DEFAULT_BRANCH = "main"
+
+BRANCHES = {
+    "main": {
+        "title": "Основная кухня",
+        "menu": MENU,
+        # зоны из справочника ZONES_FILE, закреплённые за кухней
+        "zones": [],
+    },
+}
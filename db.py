@@ -1,12 +1,63 @@
-from supabase import create_client, Client
+import asyncio
 from datetime import datetime
 import json
-from typing import Optional, Dict, Any, List
-
-from config import SUPABASE_URL, SUPABASE_KEY
-
-# Инициализация клиента Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+import random
+import threading
+import time
+from typing import Optional, Dict, Any, List, TYPE_CHECKING
+
+import metrics
+from config import (
+    DB_BREAKER_COOLDOWN,
+    DB_BREAKER_THRESHOLD,
+    DB_READ_DEADLINE,
+    DB_READ_RETRIES,
+    DB_TIMEOUT,
+    DB_WRITE_DEADLINE,
+    SUPABASE_KEY,
+    SUPABASE_URL,
+)
+from logger import get_logger
+from tracing import span
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = get_logger(__name__)
+
+# Клиент Supabase создаётся лениво при первом запросе (или в warm_up()):
+# импорт supabase/postgrest/realtime/storage — самая дорогая часть старта.
+_supabase: Optional["Client"] = None
+_client_lock = threading.Lock()
+
+
+def _client() -> "Client":
+    global _supabase
+    if _supabase is not None:
+        return _supabase
+    with _client_lock:
+        if _supabase is None:
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise ValueError("Нужно указать SUPABASE_URL и SUPABASE_KEY в .env")
+            from supabase import ClientOptions, create_client
+
+            # Таймаут HTTP ограничивает одну попытку, иначе по умолчанию ждём до 120 с.
+            _supabase = create_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT),
+            )
+    return _supabase
+
+
+def set_client(client: Optional["Client"]) -> None:
+    """
+    Подменяет клиент Supabase — например, на fake_supabase.FakeSupabase
+    для прогонов без сети. None — вернуться к ленивому созданию настоящего.
+    """
+    global _supabase
+    with _client_lock:
+        _supabase = client
 
 
 class DBError(Exception):
@@ -14,25 +65,215 @@ class DBError(Exception):
     pass
 
 
-def _execute(action: str, query_callable):
+class DBUnavailableError(DBError):
+    """БД считается недоступной: предохранитель разомкнут, запрос не отправлялся."""
+    pass
+
+
+class _CircuitBreaker:
+    """
+    Предохранитель вокруг Supabase.
+
+    closed    — запросы идут как обычно;
+    open      — после `threshold` сбоев подряд сразу отказываем, не ходя в сеть;
+    half_open — после `cooldown` секунд пропускаем один пробный запрос:
+                успех замыкает цепь, сбой снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self) -> None:
+        metrics.set_gauge(
+            "db.breaker.open", {self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[self.state]
+        )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self._publish()
+            # half_open: только один пробный запрос одновременно
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                logger.info("Supabase снова доступен, предохранитель замкнут")
+                self.state = self.CLOSED
+                self._publish()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "Supabase недоступен (%s сбоев подряд), предохранитель разомкнут на %s с",
+                        self._failures,
+                        self.cooldown,
+                    )
+                    metrics.inc("db.breaker.trips")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._publish()
+
+
+_breaker = _CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_COOLDOWN)
+
+
+# Классы SQLSTATE, при которых запрос стоит повторить: соединение (08),
+# нехватка ресурсов (53), остановка/перезапуск сервера (57P), конфликты
+# сериализации и взаимоблокировки (40001, 40P01)
+_TRANSIENT_SQLSTATE_PREFIXES = ("08", "53", "57P")
+_TRANSIENT_SQLSTATES = frozenset({"40001", "40P01"})
+
+
+def _is_transient(exc: Exception) -> bool:
+    """
+    Сетевые сбои, таймауты, 5xx без JSON-ответа и SQLSTATE из классов
+    «соединение/ресурсы/перезапуск» считаем временными: их есть смысл
+    повторять и они размыкают предохранитель.
+    Остальное — ошибки самого запроса (нарушения ограничений, права, RLS).
+
+    APIError.code — это SQLSTATE ("23505") или код PostgREST ("PGRST116");
+    HTTP-статус (int) там только когда ответ не JSON, например 502 от прокси.
+    """
+    # Импортируем здесь: к этому моменту модули уже загружены клиентом
+    import httpx
+    from postgrest.exceptions import APIError
+
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, APIError):
+        code = exc.code
+        if isinstance(code, int):
+            return code >= 500
+        code = str(code or "")
+        return code in _TRANSIENT_SQLSTATES or code.startswith(_TRANSIENT_SQLSTATE_PREFIXES)
+    return False
+
+
+def _backoff(attempt: int) -> float:
+    # «Full jitter»: случайная пауза до 0.1, 0.2, 0.4… с, но не больше 1 с
+    return random.uniform(0, min(1.0, 0.1 * (2 ** attempt)))
+
+
+def _execute(
+    action: str,
+    query_callable,
+    *,
+    idempotent: bool = False,
+    deadline: Optional[float] = None,
+):
     """
     Универсальная обёртка для всех запросов к БД.
     Ловит любые исключения и превращает их в DBError с понятным текстом.
+
+    - каждая попытка ограничена DB_TIMEOUT (таймаут HTTP-клиента);
+    - вся операция укладывается в `deadline` секунд (по умолчанию
+      DB_READ_DEADLINE для чтения и DB_WRITE_DEADLINE для записи);
+    - идемпотентные чтения повторяются до DB_READ_RETRIES раз с джиттером —
+      только в рабочем потоке: из асинхронного кода функции db вызываются
+      через asyncio.to_thread, а вызов прямо на цикле событий идёт без повторов
+      (пауза time.sleep там остановила бы бота для всех пользователей);
+    - при разомкнутом предохранителе сразу кидаем DBUnavailableError.
     """
+    if deadline is None:
+        deadline = DB_READ_DEADLINE if idempotent else DB_WRITE_DEADLINE
+    with span(f"db {action}"):
+        return _execute_with_retries(action, query_callable, idempotent, deadline)
+
+
+def _on_event_loop() -> bool:
     try:
-        res = query_callable()
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _execute_with_retries(action: str, query_callable, idempotent: bool, deadline: float):
+    retries = DB_READ_RETRIES if idempotent and not _on_event_loop() else 0
+    started = time.monotonic()
+    attempt = 0
+
+    while True:
+        if not _breaker.allow():
+            metrics.inc("db.rejected")
+            raise DBUnavailableError(f"{action} failed: database unavailable")
+
+        try:
+            res = query_callable()
+        except Exception as exc:
+            transient = _is_transient(exc)
+            if transient:
+                _breaker.record_failure()
+            else:
+                # сервер ответил — значит, он жив
+                _breaker.record_success()
+            metrics.inc("db.errors")
+
+            pause = _backoff(attempt)
+            elapsed = time.monotonic() - started
+            if not transient or attempt >= retries or elapsed + pause >= deadline:
+                logger.warning("%s failed after %s attempt(s): %r", action, attempt + 1, exc)
+                raise DBError(f"{action} failed") from exc
+
+            attempt += 1
+            metrics.inc("db.retries")
+            time.sleep(pause)
+            continue
+
+        _breaker.record_success()
+        metrics.inc("db.requests")
         return res
-    except Exception as exc:
-        # Здесь можно добавить логирование, если нужно
-        # logger.exception("%s failed", action)
-        raise DBError(f"{action} failed") from exc
+
+
+def warm_up() -> None:
+    """
+    Создаёт клиент и делает один лёгкий запрос, чтобы заранее
+    открыть HTTP/2-соединение с Supabase до прихода первого апдейта.
+    """
+    started = time.monotonic()
+    _execute(
+        "warm up",
+        lambda: _client()
+        .table("settings")
+        .select("key")
+        .limit(1)
+        .execute(),
+        idempotent=True,
+    )
+    logger.info("Соединение с Supabase прогрето за %.0f мс", (time.monotonic() - started) * 1000)
 
 
 # ----- Settings -----
 def set_setting(key: str, value: str) -> None:
     _execute(
         "set setting",
-        lambda: supabase
+        lambda: _client()
         .table("settings")
         .upsert({"key": key, "value": value})
         .execute()
@@ -42,17 +283,50 @@ def set_setting(key: str, value: str) -> None:
 def get_setting(key: str) -> Optional[str]:
     res = _execute(
         "get setting",
-        lambda: supabase
+        lambda: _client()
         .table("settings")
         .select("value")
         .eq("key", key)
-        .execute()
+        .execute(),
+        idempotent=True,
     )
     if res and res.data:
         return res.data[0].get("value")
     return None
 
 
+def get_all_settings() -> Dict[str, str]:
+    res = _execute(
+        "get all settings",
+        lambda: _client()
+        .table("settings")
+        .select("key,value")
+        .execute(),
+        idempotent=True,
+    )
+    return {row["key"]: row.get("value") for row in res.data or []}
+
+
+def set_menu_override(branch: str, dish: str, changes: Dict[str, Any], version: str) -> Optional[str]:
+    """
+    Правка одного блюда в menu_overrides на стороне БД (функция set_menu_override):
+    изменения сливаются с текущим значением под блокировкой строки, так что
+    одновременные правки разных блюд не затирают друг друга.
+    Возвращает новое значение menu_overrides.
+    """
+    res = _execute(
+        "set menu override",
+        lambda: _client()
+        .rpc(
+            "set_menu_override",
+            {"p_branch": branch, "p_dish": dish, "p_changes": changes, "p_version": version},
+        )
+        .execute(),
+        idempotent=True,
+    )
+    return res.data if isinstance(res.data, str) else None
+
+
 # ----- Orders -----
 def create_order(
     *,
@@ -66,12 +340,14 @@ def create_order(
     status: str = "new",
     user_message_id: Optional[int] = None,
     group_message_id: Optional[int] = None,
+    branch: Optional[str] = None,
+    zone: Optional[str] = None,
 ) -> int:
     now = datetime.utcnow().isoformat()
 
     res = _execute(
         "create order",
-        lambda: supabase
+        lambda: _client()
         .table("orders")
         .insert(
             {
@@ -86,6 +362,8 @@ def create_order(
                 "courier": None,
                 "user_message_id": user_message_id,
                 "group_message_id": group_message_id,
+                "branch": branch,
+                "zone": zone,
                 "created_at": now,
                 "updated_at": now,
             }
@@ -112,57 +390,124 @@ def _hydrate_order(row: Dict[str, Any]) -> Dict[str, Any]:
 def get_order(order_id: int) -> Optional[Dict[str, Any]]:
     res = _execute(
         "get order",
-        lambda: supabase
+        lambda: _client()
         .table("orders")
         .select("*")
         .eq("id", order_id)
-        .execute()
+        .execute(),
+        idempotent=True,
     )
     if not res.data:
         return None
     return _hydrate_order(res.data[0])
 
 
+def get_orders(order_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Несколько заказов одним запросом (in_ по id), по возрастанию id.
+    """
+    if not order_ids:
+        return []
+    res = _execute(
+        "get orders",
+        lambda: _client()
+        .table("orders")
+        .select("*")
+        .in_("id", list(order_ids))
+        .order("id")
+        .execute(),
+        idempotent=True,
+    )
+    return [_hydrate_order(row) for row in res.data or []]
+
+
 def get_last_order(user_id: int) -> Optional[Dict[str, Any]]:
     res = _execute(
         "get last order",
-        lambda: supabase
+        lambda: _client()
         .table("orders")
         .select("*")
         .eq("user_id", user_id)
         .order("id", desc=True)
         .limit(1)
-        .execute()
+        .execute(),
+        idempotent=True,
     )
     if not res.data:
         return None
     return _hydrate_order(res.data[0])
 
 
-def update_status(order_id: int, status: str) -> None:
+def update_status(order_id: int, status: str, actor_id: Optional[int] = None) -> None:
+    """
+    Меняет статус и пишет событие в order_events одним запросом:
+    функция set_order_status делает оба действия в одной транзакции.
+    """
     _execute(
         "update status",
-        lambda: supabase
-        .table("orders")
-        .update(
+        lambda: _client()
+        .rpc(
+            "set_order_status",
+            {"p_order_id": order_id, "p_status": status, "p_actor_id": actor_id},
+        )
+        .execute()
+    )
+
+
+def set_orders_status(
+    order_ids: List[int], status: str, from_statuses: List[str], actor_id: Optional[int] = None
+) -> List[int]:
+    """
+    Массовая смена статуса одним запросом: функция set_orders_status меняет
+    статус тех заказов из order_ids, что сейчас в одном из from_statuses,
+    и пишет события в той же транзакции. Возвращает id изменённых заказов —
+    заказ, который другой админ успел провести дальше, не откатится назад.
+    """
+    if not order_ids:
+        return []
+    res = _execute(
+        "update statuses",
+        lambda: _client()
+        .rpc(
+            "set_orders_status",
             {
-                "status": status,
-                "updated_at": datetime.utcnow().isoformat(),
-            }
+                "p_order_ids": list(order_ids),
+                "p_status": status,
+                "p_from": list(from_statuses),
+                "p_actor_id": actor_id,
+            },
         )
-        .eq("id", order_id)
         .execute()
     )
+    return [int(order_id) for order_id in res.data or []]
 
 
-def set_courier(order_id: int, courier: str) -> None:
+def get_active_orders() -> List[Dict[str, Any]]:
+    """
+    Незавершённые заказы (без items) — для восстановления состояния в памяти при старте.
+    """
+    res = _execute(
+        "get active orders",
+        lambda: _client()
+        .table("orders")
+        .select("id,status,courier,courier_id,zone,branch,user_id,total,paid_at,created_at,updated_at")
+        .not_.in_("status", ["delivered", "canceled"])
+        .order("id")
+        .execute(),
+        idempotent=True,
+    )
+    return res.data or []
+
+
+def set_courier(order_id: int, courier: str, courier_id: Optional[int] = None) -> None:
     _execute(
         "set courier",
-        lambda: supabase
+        lambda: _client()
         .table("orders")
         .update(
             {
                 "courier": courier,
+                "courier_id": courier_id,
                 "updated_at": datetime.utcnow().isoformat(),
             }
         )
@@ -174,7 +519,7 @@ def set_courier(order_id: int, courier: str) -> None:
 def set_group_message_id(order_id: int, group_message_id: int) -> None:
     _execute(
         "set group_message_id",
-        lambda: supabase
+        lambda: _client()
         .table("orders")
         .update(
             {
@@ -190,7 +535,7 @@ def set_group_message_id(order_id: int, group_message_id: int) -> None:
 def set_user_message_id(order_id: int, user_message_id: int) -> None:
     _execute(
         "set user_message_id",
-        lambda: supabase
+        lambda: _client()
         .table("orders")
         .update(
             {
@@ -204,10 +549,28 @@ def set_user_message_id(order_id: int, user_message_id: int) -> None:
 
 
 # ----- Clients -----
-def save_client(user_id: int, name: str, phone: str, address: str) -> None:
+def set_user_message_ids(rows: List[Dict[str, Any]]) -> None:
+    """
+    Последние сообщения клиентам для пачки заказов одним запросом:
+    rows — [{"order_id": ..., "user_message_id": ...}].
+    """
+    if not rows:
+        return
+    _execute(
+        "set user_message_ids",
+        lambda: _client().rpc("set_user_message_ids", {"p_rows": rows}).execute(),
+        idempotent=True,
+    )
+
+
+def save_client(user_id: int, name: str, phone: str, address: str, tenant: Optional[str] = None) -> None:
+    """
+    tenant — филиал бота, через который клиент заказал (None — бот BOT_TOKEN):
+    писать клиенту может только бот, которого он сам запустил.
+    """
     _execute(
         "save client",
-        lambda: supabase
+        lambda: _client()
         .table("clients")
         .upsert(
             {
@@ -215,6 +578,7 @@ def save_client(user_id: int, name: str, phone: str, address: str) -> None:
                 "name": name,
                 "phone": phone,
                 "address": address,
+                "tenant": tenant,
             }
         )
         .execute()
@@ -224,12 +588,180 @@ def save_client(user_id: int, name: str, phone: str, address: str) -> None:
 def get_client(user_id: int) -> Optional[Dict[str, Any]]:
     res = _execute(
         "get client",
-        lambda: supabase
+        lambda: _client()
         .table("clients")
         .select("*")
         .eq("user_id", user_id)
-        .execute()
+        .execute(),
+        idempotent=True,
     )
     if not res.data:
         return None
     return res.data[0]
+
+
+# ----- Order events -----
+def insert_order_events(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    _execute(
+        "insert order events",
+        lambda: _client()
+        .table("order_events")
+        .insert(rows)
+        .execute()
+    )
+
+
+def mark_orders_paid(rows: List[Dict[str, Any]]) -> None:
+    """
+    Отмечает оплату пачки заказов одним запросом (функция mark_orders_paid).
+    Повтор с теми же строками ничего не портит, поэтому вызов идемпотентный.
+    """
+    if not rows:
+        return
+    _execute(
+        "mark orders paid",
+        lambda: _client().rpc("mark_orders_paid", {"p_rows": rows}).execute(),
+        idempotent=True,
+    )
+
+
+def get_order_events(order_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    События нескольких заказов одним запросом, по порядку.
+    """
+    if not order_ids:
+        return []
+    res = _execute(
+        "get order events",
+        lambda: _client()
+        .table("order_events")
+        .select("order_id,kind,value,actor_id,created_at")
+        .in_("order_id", order_ids)
+        .order("id")
+        .execute(),
+        idempotent=True,
+    )
+    return res.data or []
+
+
+# ----- Couriers -----
+def get_couriers() -> List[Dict[str, Any]]:
+    res = _execute(
+        "get couriers",
+        lambda: _client()
+        .table("couriers")
+        .select("*")
+        .eq("active", True)
+        .execute(),
+        idempotent=True,
+    )
+    return res.data or []
+
+
+# ----- Export -----
+def get_orders_page(after_id: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+    """
+    Страница заказов с id > after_id (keyset-пагинация, без OFFSET).
+    """
+    res = _execute(
+        "get orders page",
+        lambda: _client()
+        .table("orders")
+        .select("*")
+        .gt("id", after_id)
+        .order("id")
+        .limit(limit)
+        .execute(),
+        idempotent=True,
+    )
+    return [_hydrate_order(row) for row in res.data or []]
+
+
+def iter_orders(batch_size: int = 500, after_id: int = 0):
+    """
+    Потоково отдаёт все заказы пачками по batch_size, не держа в памяти больше одной пачки.
+    """
+    while True:
+        page = get_orders_page(after_id, batch_size)
+        if not page:
+            return
+        yield page
+        after_id = page[-1]["id"]
+        if len(page) < batch_size:
+            return
+
+
+def get_clients_page(
+    after_user_id: int = 0, limit: int = 100, tenant: Optional[str] = None, by_tenant: bool = False
+) -> List[int]:
+    """
+    Следующая страница user_id клиентов (keyset по user_id).
+    by_tenant=True — только клиенты бота филиала tenant (tenant=None — клиенты без филиала).
+    """
+
+    def query():
+        q = _client().table("clients").select("user_id").gt("user_id", after_user_id)
+        if by_tenant:
+            q = q.eq("tenant", tenant) if tenant else q.is_("tenant", "null")
+        return q.order("user_id").limit(limit).execute()
+
+    res = _execute("get clients page", query, idempotent=True)
+    return [row["user_id"] for row in res.data or []]
+
+
+def delete_client(user_id: int) -> None:
+    _execute(
+        "delete client",
+        lambda: _client()
+        .table("clients")
+        .delete()
+        .eq("user_id", user_id)
+        .execute()
+    )
+
+
+# ----- Broadcasts -----
+def save_broadcast(job_id: str, state: str) -> None:
+    """
+    Прогресс незавершённой рассылки (JSON). Отдельная таблица, а не settings:
+    запись раз в страницу не должна заставлять все процессы перечитывать настройки.
+    """
+    _execute(
+        "save broadcast",
+        lambda: _client()
+        .table("broadcasts")
+        .upsert({"id": job_id, "state": state})
+        .execute(),
+        idempotent=True,
+    )
+
+
+def get_pending_broadcast() -> Optional[str]:
+    res = _execute(
+        "get pending broadcast",
+        lambda: _client()
+        .table("broadcasts")
+        .select("state")
+        .order("id", desc=True)
+        .limit(1)
+        .execute(),
+        idempotent=True,
+    )
+    if res and res.data:
+        return res.data[0].get("state")
+    return None
+
+
+def delete_broadcasts() -> None:
+    """Удаляет прогресс рассылок: завершённая или заменённая новой больше не нужна."""
+    _execute(
+        "delete broadcasts",
+        lambda: _client()
+        .table("broadcasts")
+        .delete()
+        .not_.eq("id", "")
+        .execute(),
+        idempotent=True,
+    )
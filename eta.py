@@ -0,0 +1,237 @@
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import AVG_PREP_MINUTES, KITCHEN_PARALLEL
+from data import DEFAULT_BRANCH
+
+# Путь заказа; для каждого этапа копим среднее время
+STAGES = ("new", "preparing", "ready", "handoff", "onway")
+KITCHEN_STAGES = ("new", "preparing")
+FINAL_STATUSES = ("delivered", "canceled")
+
+# Стартовые оценки (сек.), пока нет реальных замеров
+_DEFAULTS = {
+    "new": 3 * 60,
+    "preparing": AVG_PREP_MINUTES * 60,
+    "ready": 5 * 60,
+    "handoff": 5 * 60,
+    "onway": 25 * 60,
+}
+
+
+def _ts(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class _KitchenQueue:
+    """
+    Очередь кухни филиала в порядке входа.
+
+    Заказу при входе выдаётся следующий номер, в дереве Фенвика по номерам
+    отмечено, кто ещё в очереди; место в очереди — сумма отметок до своего
+    номера, O(log n). Уйти с кухни можно не по порядку — на ответ это не влияет.
+    Номера перевыдаются, когда очередь пустеет или дерево сильно больше очереди,
+    так что память — O(длины очереди).
+    """
+
+    __slots__ = ("_seq", "_tree")
+
+    def __init__(self):
+        self._seq: Dict[int, int] = {}
+        self._tree: List[int] = [0]  # индексы с 1
+
+    def _add(self, i: int, delta: int) -> None:
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i: int) -> int:
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def push(self, order_id: int) -> None:
+        if order_id in self._seq:
+            return
+        i = len(self._tree)
+        # новый узел отвечает за номера (i - lowbit(i), i]: уже занятые там плюс сам заказ
+        self._tree.append(self._prefix(i - 1) - self._prefix(i - (i & -i)) + 1)
+        self._seq[order_id] = i
+
+    def remove(self, order_id: int) -> None:
+        i = self._seq.pop(order_id, None)
+        if i is None:
+            return
+        if not self._seq:
+            self._tree = [0]
+        elif len(self._tree) > 4 * len(self._seq) + 1024:
+            self._renumber()
+        else:
+            self._add(i, -1)
+
+    def _renumber(self) -> None:
+        ordered = sorted(self._seq, key=self._seq.__getitem__)
+        self._seq, self._tree = {}, [0]
+        for order_id in ordered:
+            self.push(order_id)
+
+    def position(self, order_id: int) -> Optional[int]:
+        i = self._seq.get(order_id)
+        return None if i is None else self._prefix(i)
+
+
+class Estimator:
+    """
+    Оценка очереди и времени доставки по живой статистике.
+
+    - на каждый этап — EWMA длительности (alpha — вес последнего замера);
+    - на филиал — EWMA интервала между заказами, уходящими с кухни (темп очереди);
+    - для каждого активного заказа помним текущий этап и время входа в него;
+    - очередь кухни — _KitchenQueue на филиал, в порядке создания.
+
+    В БД не ходим. Событие (создание, смена статуса) и номер в очереди
+    (position, а с ним eta_minutes и describe) — O(log длины очереди):
+    очередь кухни ничем не ограничена (CAPACITY_MAX_ORDERS=0 — без лимита),
+    поэтому по ней не проходим.
+    Заказ #N уходит с кухни не раньше, чем через N интервалов темпа,
+    и не раньше, чем приготовится сам.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._avg: Dict[str, float] = dict(_DEFAULTS)
+        self._samples: Dict[str, int] = {s: 0 for s in STAGES}
+        self._orders: Dict[int, Tuple[str, str, float]] = {}
+        self._queues: Dict[str, _KitchenQueue] = {}
+        # филиал -> (EWMA интервала ухода с кухни, сек.; время последнего ухода)
+        self._pace: Dict[str, float] = {}
+        self._last_exit: Dict[str, float] = {}
+
+    # ----- события -----
+    def seed(self, active_orders: Iterable[Dict[str, Any]]) -> None:
+        self._orders.clear()
+        self._queues.clear()
+        now = time.time()
+        for order in active_orders:
+            branch = order.get("branch") or DEFAULT_BRANCH
+            entered = _ts(order.get("updated_at")) or _ts(order.get("created_at")) or now
+            self._enter(order["id"], branch, order.get("status"), entered)
+
+    def _enter(self, order_id: int, branch: str, status: Optional[str], at: float) -> None:
+        queue = self._queues.get(branch)
+        if queue is None:
+            queue = self._queues[branch] = _KitchenQueue()
+        if status in STAGES:
+            self._orders[order_id] = (branch, status, at)
+        else:
+            self._orders.pop(order_id, None)
+        if status in KITCHEN_STAGES:
+            queue.push(order_id)
+        else:
+            queue.remove(order_id)
+
+    def on_created(self, order_id: int, branch: Optional[str], at: Optional[float] = None) -> None:
+        self._enter(order_id, branch or DEFAULT_BRANCH, "new", at or time.time())
+
+    def on_status(self, order_id: int, status: str, at: Optional[float] = None) -> None:
+        at = at or time.time()
+        known = self._orders.get(order_id)
+        branch = known[0] if known else DEFAULT_BRANCH
+        if known and status != known[1] and status != "canceled":
+            # отмена — не «нормальное» завершение этапа, в статистику не берём
+            self._observe(known[1], at - known[2])
+            if known[1] in KITCHEN_STAGES and status not in KITCHEN_STAGES:
+                self._observe_exit(branch, at)
+        self._enter(order_id, branch, status, at)
+
+    def _observe_exit(self, branch: str, at: float) -> None:
+        last = self._last_exit.get(branch)
+        self._last_exit[branch] = at
+        if last is None or at <= last:
+            return
+        # простой кухни (ночью, в тихий час) — не темп: интервал не дольше самой готовки
+        gap = min(at - last, self._kitchen_seconds())
+        pace = self._pace.get(branch)
+        self._pace[branch] = gap if pace is None else pace + self.alpha * (gap - pace)
+
+    def _observe(self, stage: str, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        if self._samples[stage] == 0:
+            self._avg[stage] = seconds
+        else:
+            self._avg[stage] += self.alpha * (seconds - self._avg[stage])
+        self._samples[stage] += 1
+
+    # ----- оценки -----
+    def stage_minutes(self, stage: str) -> int:
+        return max(1, round(self._avg[stage] / 60))
+
+    def _kitchen_seconds(self) -> float:
+        return sum(self._avg[s] for s in KITCHEN_STAGES)
+
+    def pace_seconds(self, branch: Optional[str]) -> float:
+        """Через сколько секунд в среднем с кухни уходит следующий заказ."""
+        pace = self._pace.get(branch or DEFAULT_BRANCH)
+        return pace if pace is not None else self._kitchen_seconds() / KITCHEN_PARALLEL
+
+    def kitchen_minutes(self) -> Optional[float]:
+        """
+        Среднее время на кухне (new + preparing) в минутах, если уже есть замеры.
+        """
+        if not any(self._samples[s] for s in KITCHEN_STAGES):
+            return None
+        return sum(self._avg[s] for s in KITCHEN_STAGES) / 60
+
+    def position(self, order_id: int) -> Optional[int]:
+        known = self._orders.get(order_id)
+        if not known or known[1] not in KITCHEN_STAGES:
+            return None
+        queue = self._queues.get(known[0])
+        return queue.position(order_id) if queue else None
+
+    def eta_minutes(self, order_id: int, now: Optional[float] = None) -> Optional[int]:
+        known = self._orders.get(order_id)
+        if not known:
+            return None
+        branch, status, entered = known
+        now = now or time.time()
+        left = max(0.0, self._avg[status] - (now - entered))
+        for stage in STAGES[STAGES.index(status) + 1:]:
+            if stage in KITCHEN_STAGES:
+                left += self._avg[stage]
+        if status in KITCHEN_STAGES:
+            # своя готовка или очередь перед нами — что дольше
+            left = max(left, (self.position(order_id) or 1) * self.pace_seconds(branch))
+        for stage in STAGES[STAGES.index(status) + 1:]:
+            if stage not in KITCHEN_STAGES:
+                left += self._avg[stage]
+        return max(1, math.ceil(left / 60))
+
+    def describe(self, order_id: int) -> str:
+        """
+        "Вы #3 в очереди, доставим примерно через 47 мин" — или пусто, если заказ не активен.
+        """
+        eta = self.eta_minutes(order_id)
+        if eta is None:
+            return ""
+        position = self.position(order_id)
+        if position:
+            return f"Вы #{position} в очереди, доставим примерно через {eta} мин"
+        return f"Доставим примерно через {eta} мин"
+
+
+# Общий на процесс оценщик
+estimator = Estimator()
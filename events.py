@@ -0,0 +1,107 @@
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import metrics
+from config import EVENTS_BATCH_SIZE, EVENTS_FLUSH_INTERVAL
+from db import DBError, insert_order_events
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# (kind, value, время, actor_id)
+Event = Tuple[str, str, datetime, Optional[int]]
+
+
+class EventLog:
+    """
+    Журнал событий заказов (append-only таблица order_events).
+
+    - смена статуса пишется в БД вместе с самим статусом (db.update_status),
+      здесь её только запоминаем — remember();
+    - остальные события (создание, назначение курьера) копятся в буфере
+      и уходят в БД одной вставкой раз в EVENTS_FLUSH_INTERVAL — record();
+      сброс не прерывается остановкой и не идёт в два потока: отменённая
+      посреди вставки пачка иначе записалась бы ещё раз;
+    - последние события каждого заказа лежат в кольцевом буфере,
+      чтобы карточка рисовалась без запроса к БД — recent().
+    """
+
+    def __init__(self, per_order: int = 8, max_orders: int = 2000):
+        self.per_order = per_order
+        self.max_orders = max_orders
+        self._recent: "OrderedDict[int, Deque[Event]]" = OrderedDict()
+        self._buffer: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    # ----- кольцевой буфер -----
+    def remember(self, order_id: int, kind: str, value: str, actor_id: Optional[int] = None,
+                 at: Optional[datetime] = None) -> None:
+        ring = self._recent.get(order_id)
+        if ring is None:
+            ring = self._recent[order_id] = deque(maxlen=self.per_order)
+            if len(self._recent) > self.max_orders:
+                self._recent.popitem(last=False)
+        else:
+            self._recent.move_to_end(order_id)
+        ring.append((kind, value, at or datetime.utcnow(), actor_id))
+
+    def recent(self, order_id: int) -> List[Event]:
+        return list(self._recent.get(order_id, ()))
+
+    # ----- буферизованная запись -----
+    def record(self, order_id: int, kind: str, value: str, actor_id: Optional[int] = None) -> None:
+        now = datetime.utcnow()
+        self.remember(order_id, kind, value, actor_id, now)
+        self._buffer.append(
+            {
+                "order_id": order_id,
+                "kind": kind,
+                "value": value,
+                "actor_id": actor_id,
+                "created_at": now.isoformat(),
+            }
+        )
+        metrics.set_gauge("events.buffered", len(self._buffer))
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        while self._buffer:
+            batch = self._buffer[:EVENTS_BATCH_SIZE]
+            try:
+                await asyncio.to_thread(insert_order_events, batch)
+            except DBError:
+                # оставляем в буфере, попробуем в следующий раз
+                logger.warning("Не удалось записать %s событий заказов, повторим позже", len(batch))
+                break
+            del self._buffer[:len(batch)]
+            metrics.inc("events.flushed", len(batch))
+        metrics.set_gauge("events.buffered", len(self._buffer))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(EVENTS_FLUSH_INTERVAL)
+            # отмена (stop) не обрывает начатую вставку: она доработает,
+            # а stop() дождётся её на блокировке
+            await asyncio.shield(self.flush())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            lifecycle.on_drain(self.stop)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+# Общий на процесс журнал
+event_log = EventLog()
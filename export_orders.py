@@ -0,0 +1,263 @@
+"""
+Выгрузка заказов для анализа загрузки кухни.
+
+    python -m export_orders --out orders.parquet
+    python -m export_orders --out orders.csv --batch 1000
+
+Заказы читаются пачками (keyset по id) вместе с их журналом order_events,
+каждая пачка сразу пишется в файл:
+Parquet, если установлен pyarrow, иначе CSV. После выгрузки печатается
+отчёт: p50/p95 времени приготовления по часам и по блюдам.
+"""
+import argparse
+import csv
+import math
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from db import get_order_events, iter_orders
+
+STATUSES = ("new", "preparing", "ready", "handoff", "onway", "delivered", "canceled")
+FINAL_STATUSES = ("delivered", "canceled")
+
+COLUMNS = (
+    ["id", "branch", "zone", "status", "total", "items_count", "created_at", "hour",
+     "prep_seconds", "total_seconds"]
+    + [f"dwell_{s}" for s in STATUSES if s not in FINAL_STATUSES]
+)
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def status_history(
+    order: Dict[str, Any], events: Optional[List[Dict[str, Any]]] = None
+) -> List[Tuple[str, datetime]]:
+    """
+    История статусов заказа: [(статус, время входа в статус), ...] по времени.
+    Берётся из order_events; для старых заказов без журнала известны
+    только создание и последнее изменение.
+    """
+    history = [
+        (e["value"], ts)
+        for e in events or []
+        if e.get("kind") == "status" and (ts := _parse_ts(e.get("created_at")))
+    ]
+    if history:
+        # события создания пишутся пачками и могут лечь в таблицу позже смен статуса
+        history.sort(key=lambda h: h[1])
+        created = _parse_ts(order.get("created_at"))
+        if history[0][0] != "new" and created:
+            history.insert(0, ("new", created))
+        return history
+
+    created = _parse_ts(order.get("created_at"))
+    updated = _parse_ts(order.get("updated_at"))
+    history = []
+    if created:
+        history.append(("new", created))
+    if updated and order.get("status") != "new":
+        history.append((order.get("status"), updated))
+    return history
+
+
+def status_durations(history: List[Tuple[str, datetime]]) -> Dict[str, float]:
+    """
+    Сколько секунд заказ провёл в каждом статусе (последний, незавершённый, не считается).
+    """
+    durations: Dict[str, float] = {}
+    for (status, started), (_, ended) in zip(history, history[1:]):
+        durations[status] = durations.get(status, 0.0) + (ended - started).total_seconds()
+    return durations
+
+
+def order_row(order: Dict[str, Any], events: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    history = status_history(order, events)
+    durations = status_durations(history)
+    entered = {status: ts for status, ts in reversed(history)}  # первое вхождение
+
+    created = entered.get("new")
+    ready = entered.get("ready")
+    final = next((ts for status, ts in history if status in FINAL_STATUSES), None)
+
+    row = {
+        "id": order["id"],
+        "branch": order.get("branch"),
+        "zone": order.get("zone"),
+        "status": order.get("status"),
+        "total": order.get("total"),
+        "items_count": sum(int(i.get("qty", 1) or 1) for i in order.get("items", [])),
+        "created_at": created.isoformat() if created else None,
+        "hour": created.hour if created else None,
+        "prep_seconds": (ready - created).total_seconds() if created and ready else None,
+        "total_seconds": (final - created).total_seconds() if created and final else None,
+    }
+    for status in STATUSES:
+        if status not in FINAL_STATUSES:
+            row[f"dwell_{status}"] = durations.get(status)
+    return row
+
+
+# ----- Запись -----
+class _CsvSink:
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path: str, pa, pq):
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("id", pa.int64()), ("branch", pa.string()), ("zone", pa.string()),
+                ("status", pa.string()), ("total", pa.int64()), ("items_count", pa.int64()),
+                ("created_at", pa.string()), ("hour", pa.int8()),
+                ("prep_seconds", pa.float64()), ("total_seconds", pa.float64()),
+            ]
+            + [(c, pa.float64()) for c in COLUMNS if c.startswith("dwell_")]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        # колонками, одна row group на пачку
+        columns = {name: [r[name] for r in rows] for name in self._schema.names}
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def _open_sink(path: str):
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            path = path[: -len(".parquet")] + ".csv"
+            print(f"pyarrow не установлен, пишем CSV: {path}", file=sys.stderr)
+        else:
+            return _ParquetSink(path, pa, pq), path
+    return _CsvSink(path), path
+
+
+# ----- Отчёт -----
+class _Histogram:
+    """
+    Распределение времён в логарифмических корзинах шириной 2%:
+    корзина i — [RATIO**(i-1), RATIO**i) секунд, нулевая — меньше секунды.
+    Память — число занятых корзин (до ~700 на сутки), а не число заказов;
+    перцентиль — середина корзины, ошибка не больше 1%.
+    """
+
+    RATIO = 1.02
+    _LOG_RATIO = math.log(RATIO)
+
+    __slots__ = ("count", "low", "high", "_buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.low = math.inf
+        self.high = -math.inf
+        self._buckets: Dict[int, int] = defaultdict(int)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.low = min(self.low, seconds)
+        self.high = max(self.high, seconds)
+        index = 0 if seconds < 1 else int(math.log(seconds) / self._LOG_RATIO) + 1
+        self._buckets[index] += 1
+
+    def percentile(self, q: float) -> float:
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                break
+        value = 0.0 if index == 0 else self.RATIO ** (index - 0.5)
+        # края известны точно
+        return min(max(value, self.low), self.high)
+
+
+class Summary:
+    """
+    Копит времена приготовления по часам и по блюдам в гистограммах
+    фиксированного размера — память не растёт с числом выгруженных заказов.
+    """
+
+    def __init__(self):
+        self.by_hour: Dict[int, _Histogram] = defaultdict(_Histogram)
+        self.by_dish: Dict[str, _Histogram] = defaultdict(_Histogram)
+        self.orders = 0
+
+    def add(self, order: Dict[str, Any], row: Dict[str, Any]) -> None:
+        self.orders += 1
+        prep = row["prep_seconds"]
+        if prep is None:
+            return
+        self.by_hour[row["hour"]].add(prep)
+        for name in {i.get("name") for i in order.get("items", [])}:
+            self.by_dish[name].add(prep)
+
+    def lines(self) -> Iterable[str]:
+        yield f"Заказов выгружено: {self.orders}"
+        for title, groups in (("час", self.by_hour), ("блюдо", self.by_dish)):
+            yield ""
+            yield f"{title:<20} {'заказов':>8} {'p50, мин':>9} {'p95, мин':>9}"
+            for key in sorted(groups, key=str):
+                hist = groups[key]
+                p50, p95 = hist.percentile(0.5), hist.percentile(0.95)
+                yield f"{str(key):<20} {hist.count:>8} {p50 / 60:>9.1f} {p95 / 60:>9.1f}"
+
+
+def export(path: str, batch_size: int = 500) -> Summary:
+    sink, path = _open_sink(path)
+    summary = Summary()
+    try:
+        for page in iter_orders(batch_size):
+            # журнал событий — одним запросом на пачку
+            events_by_order: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+            for event in get_order_events([o["id"] for o in page]):
+                events_by_order[event["order_id"]].append(event)
+
+            rows = []
+            for order in page:
+                row = order_row(order, events_by_order.get(order["id"]))
+                summary.add(order, row)
+                rows.append(row)
+            sink.write(rows)
+    finally:
+        sink.close()
+    print(f"Записано в {path}", file=sys.stderr)
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка заказов и отчёт по времени приготовления")
+    parser.add_argument("--out", default="orders.parquet", help="файл .parquet или .csv")
+    parser.add_argument("--batch", type=int, default=500, help="размер пачки при чтении из БД")
+    args = parser.parse_args(argv)
+
+    summary = export(args.out, args.batch)
+    for line in summary.lines():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
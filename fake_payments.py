@@ -0,0 +1,108 @@
+"""
+Фейковые платёжные колбэки Telegram — для load_test.py.
+
+Работает поверх fake_telegram.FakeTelegram: берёт счёт, который бот
+отправил (sendInvoice), и проигрывает то, что сделал бы Telegram после
+нажатия «Оплатить»: pre_checkout_query -> ответ бота answerPreCheckoutQuery ->
+сообщение с successful_payment (только если бот подтвердил).
+Шаги можно вызывать по отдельности: например, списание, пришедшее
+во время остановки бота.
+Сумму, валюту и плательщика можно подменить, чтобы проверить отказы.
+"""
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from fake_telegram import FakeTelegram
+
+_ids = itertools.count(5_000_000)
+
+
+class FakePayments:
+    def __init__(self, bot: Bot, dp: Dispatcher):
+        if not isinstance(bot.session, FakeTelegram):
+            raise TypeError("FakePayments работает только с FakeTelegram")
+        self.bot = bot
+        self.dp = dp
+        self.session: FakeTelegram = bot.session
+
+    def invoices(self, chat_id: int) -> List[Dict[str, Any]]:
+        """Счета, отправленные ботом в чат, по порядку."""
+        return [p for name, p in self.session.calls if name == "sendInvoice" and str(p.get("chat_id")) == str(chat_id)]
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"Payer{user_id}"}
+
+    async def _feed(self, kind: str, payload: Dict[str, Any]) -> None:
+        update = Update.model_validate({"update_id": next(_ids), kind: payload}, context={"bot": self.bot})
+        await self.dp.feed_update(self.bot, update)
+
+    def _pre_checkout_answer(self, query_id: str) -> Optional[Dict[str, Any]]:
+        for name, params in reversed(self.session.calls):
+            if name == "answerPreCheckoutQuery" and params.get("pre_checkout_query_id") == query_id:
+                return params
+        return None
+
+    @staticmethod
+    def _amount(invoice: Dict[str, Any]) -> int:
+        return sum(p["amount"] for p in invoice["prices"])
+
+    async def pre_checkout(
+        self,
+        invoice: Dict[str, Any],
+        user_id: Optional[int] = None,
+        amount: Optional[int] = None,
+        currency: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Клиент нажал «Оплатить». None — бот подтвердил списание,
+        иначе текст отказа (или «нет ответа», если бот не ответил).
+        По умолчанию платит получатель счёта ровно выставленную сумму.
+        """
+        query_id = str(next(_ids))
+        await self._feed(
+            "pre_checkout_query",
+            {
+                "id": query_id,
+                "from": self._user(user_id or int(invoice["chat_id"])),
+                "currency": currency or invoice["currency"],
+                "total_amount": self._amount(invoice) if amount is None else amount,
+                "invoice_payload": invoice["payload"],
+            },
+        )
+        answer = self._pre_checkout_answer(query_id)
+        if answer is None:
+            return "нет ответа на pre_checkout_query"
+        return None if answer.get("ok") else answer.get("error_message", "")
+
+    async def successful_payment(self, invoice: Dict[str, Any], user_id: Optional[int] = None) -> None:
+        """Деньги списаны — Telegram присылает сообщение с successful_payment."""
+        user_id = user_id or int(invoice["chat_id"])
+        charge = next(_ids)
+        await self._feed(
+            "message",
+            {
+                "message_id": next(_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "successful_payment": {
+                    "currency": invoice["currency"],
+                    "total_amount": self._amount(invoice),
+                    "invoice_payload": invoice["payload"],
+                    "telegram_payment_charge_id": f"tg-{charge}",
+                    "provider_payment_charge_id": f"prov-{charge}",
+                },
+            },
+        )
+
+    async def pay(self, invoice: Dict[str, Any], user_id: Optional[int] = None) -> Optional[str]:
+        """Полный путь оплаты; None — оплачено, иначе текст отказа."""
+        error = await self.pre_checkout(invoice, user_id)
+        if error is None:
+            await self.successful_payment(invoice, user_id)
+        return error
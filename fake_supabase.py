@@ -0,0 +1,290 @@
+"""
+Фейковый PostgREST поверх SQLite — для прогонов без сети (load_test.py).
+
+Поддерживает ровно то подмножество supabase-py, которым пользуется db.py:
+table().select/insert/upsert/update/delete, фильтры eq/gt/is_/in_/not_,
+order/limit, execute() и rpc() для функций из migrations.sql.
+Задержку и ошибки можно подмешивать: транзиентные ошибки — это
+httpx.ConnectError, как при обрыве сети, их ловит повтор в db._execute.
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+_SCHEMA = """
+create table if not exists settings (key text primary key, value text);
+create table if not exists clients (user_id integer primary key, name text, phone text, address text, tenant text);
+create table if not exists broadcasts (id text primary key, state text not null);
+create table if not exists couriers (
+    id integer primary key autoincrement, name text not null, zone text, active integer not null default 1
+);
+create table if not exists orders (
+    id integer primary key autoincrement,
+    user_id integer, user_name text, user_username text, phone text, address text,
+    items_json text, total integer, status text, courier text, courier_id integer,
+    user_message_id integer, group_message_id integer, branch text, zone text,
+    comment text, comment_topic text,
+    paid_at text, paid_amount integer, telegram_charge_id text, provider_charge_id text,
+    created_at text, updated_at text
+);
+create table if not exists order_events (
+    id integer primary key autoincrement,
+    order_id integer not null, kind text not null, value text, actor_id integer,
+    created_at text not null default current_timestamp
+);
+"""
+
+
+class _Response:
+    def __init__(self, data: List[Dict[str, Any]]):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._columns = "*"
+        self._payload: Any = None
+        self._where: List[Tuple[str, List[Any]]] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._negate = False
+        self._on_conflict: List[str] = []
+
+    # ----- операции -----
+    def select(self, columns: str = "*") -> "_Query":
+        self._op, self._columns = "select", columns
+        return self
+
+    def insert(self, rows) -> "_Query":
+        self._op, self._payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = "") -> "_Query":
+        self._op, self._payload = "upsert", rows
+        self._on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        return self
+
+    def update(self, values: Dict[str, Any]) -> "_Query":
+        self._op, self._payload = "update", values
+        return self
+
+    def delete(self) -> "_Query":
+        self._op = "delete"
+        return self
+
+    # ----- фильтры -----
+    @property
+    def not_(self) -> "_Query":
+        self._negate = True
+        return self
+
+    def _filter(self, sql: str, params: List[Any]) -> "_Query":
+        if self._negate:
+            sql, self._negate = f"not ({sql})", False
+        self._where.append((sql, params))
+        return self
+
+    def eq(self, column: str, value: Any) -> "_Query":
+        return self._filter(f"{column} = ?", [value])
+
+    def gt(self, column: str, value: Any) -> "_Query":
+        return self._filter(f"{column} > ?", [value])
+
+    def is_(self, column: str, value: str) -> "_Query":
+        # как в PostgREST: is.null / is.true / is.false
+        return self._filter(f"{column} is {value}", [])
+
+    def in_(self, column: str, values) -> "_Query":
+        values = list(values)
+        if not values:
+            return self._filter("0", [])
+        return self._filter(f"{column} in ({', '.join('?' * len(values))})", values)
+
+    def order(self, column: str, desc: bool = False) -> "_Query":
+        self._order.append(f"{column} {'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, count: int) -> "_Query":
+        self._limit = count
+        return self
+
+    # ----- выполнение -----
+    def _where_sql(self) -> Tuple[str, List[Any]]:
+        if not self._where:
+            return "", []
+        params: List[Any] = []
+        for _, p in self._where:
+            params.extend(p)
+        return " where " + " and ".join(sql for sql, _ in self._where), params
+
+    def execute(self) -> _Response:
+        self._db._simulate()
+        with self._db._lock:
+            return _Response(getattr(self, f"_{self._op}")())
+
+    def _select(self) -> List[Dict[str, Any]]:
+        where, params = self._where_sql()
+        sql = f"select {self._columns} from {self._table}{where}"
+        if self._order:
+            sql += " order by " + ", ".join(self._order)
+        if self._limit is not None:
+            sql += f" limit {int(self._limit)}"
+        return self._db._rows(sql, params)
+
+    def _write(self, upsert: bool = False) -> List[Dict[str, Any]]:
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        conflict = self._on_conflict or self._db._primary_key(self._table)
+        result = []
+        for row in rows:
+            cols = list(row)
+            sql = f"insert into {self._table} ({', '.join(cols)}) values ({', '.join('?' * len(cols))})"
+            if upsert:
+                # как в PostgREST: при конфликте меняются только переданные колонки,
+                # остальные остаются как были (insert or replace обнулил бы их)
+                changed = [c for c in cols if c not in conflict] or conflict
+                sql += f" on conflict ({', '.join(conflict)}) do update set " + ", ".join(
+                    f"{c} = excluded.{c}" for c in changed
+                )
+            result.extend(self._db._rows(sql + " returning *", [row[c] for c in cols]))
+        self._db._conn.commit()
+        return result
+
+    def _insert(self) -> List[Dict[str, Any]]:
+        return self._write()
+
+    def _upsert(self) -> List[Dict[str, Any]]:
+        return self._write(upsert=True)
+
+    def _update(self) -> List[Dict[str, Any]]:
+        where, params = self._where_sql()
+        cols = list(self._payload)
+        self._db._conn.execute(
+            f"update {self._table} set {', '.join(f'{c} = ?' for c in cols)}{where}",
+            [self._payload[c] for c in cols] + params,
+        )
+        self._db._conn.commit()
+        return self._db._rows(f"select * from {self._table}{where}", params)
+
+    def _delete(self) -> List[Dict[str, Any]]:
+        where, params = self._where_sql()
+        rows = self._db._rows(f"select * from {self._table}{where}", params)
+        self._db._conn.execute(f"delete from {self._table}{where}", params)
+        self._db._conn.commit()
+        return rows
+
+
+class _Rpc:
+    def __init__(self, db: "FakeSupabase", name: str, params: Dict[str, Any]):
+        self._db = db
+        self._name = name
+        self._params = params
+
+    def execute(self) -> _Response:
+        self._db._simulate()
+        handler = getattr(self._db, f"_rpc_{self._name}", None)
+        if handler is None:
+            raise RuntimeError(f"fake PostgREST: unknown function {self._name}")
+        with self._db._lock:
+            result = handler(**self._params)
+            self._db._conn.commit()
+        return _Response(result or [])
+
+
+class FakeSupabase:
+    """
+    latency    — (мин, макс) задержка одного запроса в секундах;
+    error_rate — доля запросов, падающих с транзиентной сетевой ошибкой.
+    """
+
+    def __init__(self, path: str = ":memory:", latency: Tuple[float, float] = (0.0, 0.0),
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.injected_errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(_SCHEMA)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> _Rpc:
+        return _Rpc(self, name, params)
+
+    def _primary_key(self, table: str) -> List[str]:
+        info = self._conn.execute(f"pragma table_info({table})").fetchall()
+        return [row["name"] for row in sorted(info, key=lambda r: r["pk"]) if row["pk"]]
+
+    def _rows(self, sql: str, params: List[Any]) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def _simulate(self) -> None:
+        with self._lock:
+            self.requests += 1
+            fail = self.error_rate and self._random.random() < self.error_rate
+            delay = self._random.uniform(*self.latency) if self.latency[1] else 0.0
+        if delay:
+            time.sleep(delay)
+        if fail:
+            import httpx
+
+            with self._lock:
+                self.injected_errors += 1
+            raise httpx.ConnectError("fake PostgREST: injected failure")
+
+    # ----- функции из migrations.sql -----
+    def _rpc_set_order_status(self, p_order_id: int, p_status: str, p_actor_id: Optional[int] = None) -> None:
+        now = datetime.utcnow().isoformat()
+        self._conn.execute("update orders set status = ?, updated_at = ? where id = ?", [p_status, now, p_order_id])
+        self._conn.execute(
+            "insert into order_events (order_id, kind, value, actor_id, created_at) values (?, 'status', ?, ?, ?)",
+            [p_order_id, p_status, p_actor_id, now],
+        )
+
+    def _rpc_mark_orders_paid(self, p_rows: List[Dict[str, Any]]) -> None:
+        now = datetime.utcnow().isoformat()
+        for r in p_rows:
+            self._conn.execute(
+                "update orders set paid_at = ?, paid_amount = ?, telegram_charge_id = ?,"
+                " provider_charge_id = ?, updated_at = ? where id = ?",
+                [r["paid_at"], r["amount"], r["telegram_charge_id"], r["provider_charge_id"], now, r["order_id"]],
+            )
+
+    def _rpc_set_orders_status(self, p_order_ids: List[int], p_status: str, p_from: List[str],
+                               p_actor_id: Optional[int] = None) -> List[int]:
+        ids = [r["id"] for r in self._rows(
+            f"select id from orders where id in ({','.join('?' * len(p_order_ids))})"
+            f" and status in ({','.join('?' * len(p_from))}) order by id",
+            [*p_order_ids, *p_from],
+        )]
+        for order_id in ids:
+            self._rpc_set_order_status(order_id, p_status, p_actor_id)
+        return ids
+
+    def _rpc_set_user_message_ids(self, p_rows: List[Dict[str, Any]]) -> None:
+        for r in p_rows:
+            self._conn.execute("update orders set user_message_id = ? where id = ?", [r["user_message_id"], r["order_id"]])
+
+    def _rpc_set_menu_override(self, p_branch: str, p_dish: str, p_changes: Dict[str, Any], p_version: str) -> str:
+        rows = self._rows("select value from settings where key = 'menu_overrides'", [])
+        value = json.loads(rows[0]["value"] or "{}") if rows else {}
+        value.setdefault(p_branch, {}).setdefault(p_dish, {}).update(p_changes)
+        raw = json.dumps(value, ensure_ascii=False)
+        self._conn.execute("insert or replace into settings (key, value) values ('menu_overrides', ?)", [raw])
+        self._conn.execute("insert or replace into settings (key, value) values ('settings_version', ?)", [p_version])
+        return raw
+
+    # ----- для проверок в прогонах -----
+    def query(self, sql: str, *params: Any) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._rows(sql, list(params))
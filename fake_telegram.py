@@ -0,0 +1,124 @@
+"""
+Фейковый Bot API — сессия aiogram без сети (для load_test.py).
+
+Bot(token=..., session=FakeTelegram()) работает как обычно: запросы
+не уходят в api.telegram.org, а записываются в `calls`, ответы собираются
+на месте и проходят обычную проверку aiogram (check_response), поэтому
+хендлеры получают настоящие объекты Message и настоящие исключения.
+Задержку и ошибки можно подмешивать: ошибка — это ответ 500 от сервера
+или, с flood=True, 429 Too Many Requests. На методы, которых фейк
+не умеет, «сервер» отвечает 400 — хендлер получает TelegramBadRequest.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, get_args
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import GetFile, TelegramMethod
+from aiogram.types import Message, User
+
+_UNSUPPORTED = {"ok": False, "error_code": 400, "description": "Bad Request: method not supported by fake"}
+
+
+class FakeTelegram(BaseSession):
+    """
+    latency    — (мин, макс) задержка одного вызова в секундах;
+    error_rate — доля вызовов, на которые «сервер» отвечает ошибкой;
+    flood      — ошибка в виде 429 с retry_after=1 вместо 500.
+    """
+
+    def __init__(self, latency: Tuple[float, float] = (0.0, 0.0), error_rate: float = 0.0,
+                 flood: bool = False, seed: Optional[int] = None):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.flood = flood
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.counts: Counter = Counter()
+        self.injected_errors = 0
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1_000_000)
+        self._last_message: Dict[int, int] = {}
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        name = method.__api_method__
+        params = method.model_dump(exclude_none=True)
+        self.calls.append((name, params))
+        self.counts[name] += 1
+
+        if self.latency[1]:
+            await asyncio.sleep(self._random.uniform(*self.latency))
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.injected_errors += 1
+            if self.flood:
+                status, payload = 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }
+            else:
+                status, payload = 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+        else:
+            result = self._result(bot, method, params)
+            if result is _UNSUPPORTED:
+                status, payload = 400, _UNSUPPORTED
+            else:
+                status, payload = 200, {"ok": True, "result": result}
+
+        response = self.check_response(bot=bot, method=method, status_code=status, content=json.dumps(payload))
+        return response.result
+
+    def _result(self, bot: Bot, method: TelegramMethod, params: Dict[str, Any]) -> Any:
+        returning = method.__returning__
+        if returning is bool:
+            return True
+        if returning is User:
+            return self._bot_user(bot)
+        # edit* возвращают Union[Message, bool]: True — для inline-сообщений
+        if returning is Message or Message in get_args(returning):
+            if "inline_message_id" in params:
+                return True
+            return self._message(bot, params)
+        return _UNSUPPORTED
+
+    @staticmethod
+    def _bot_user(bot: Bot) -> Dict[str, Any]:
+        return {"id": bot.id, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+    def _message(self, bot: Bot, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id", 0))
+        if not params.get("message_id"):
+            self._last_message[chat_id] = next(self._message_ids)
+        message = {
+            "message_id": params.get("message_id") or self._last_message[chat_id],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": self._bot_user(bot),
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def last_message_id(self, chat_id: int) -> Optional[int]:
+        """id последнего нового (не отредактированного) сообщения в чате."""
+        return self._last_message.get(chat_id)
+
+    def sent_to(self, chat_id: int) -> List[Dict[str, Any]]:
+        """Всё, что отправлено или отредактировано в чате."""
+        return [p for _, p in self.calls if str(p.get("chat_id")) == str(chat_id)]
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        # файлов у фейка нет — как ответ 400 на getFile
+        raise TelegramBadRequest(method=GetFile(file_id=str(url)), message=_UNSUPPORTED["description"])
+        yield b""  # pragma: no cover
+
+    async def close(self) -> None:
+        pass
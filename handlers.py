@@ -1,140 +1,332 @@
 import asyncio
 from datetime import datetime, timedelta
+from html import escape
+from typing import Collection
 
 from aiogram import F, Router
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
-from aiogram.exceptions import TelegramForbiddenError  # <--- добавили
-
-from config import ADMIN_GROUP_ID, ADMIN_IDS
-from data import CATEGORY_TITLES, MENU
+from aiogram.types import (
+    CallbackQuery,
+    ChosenInlineResult,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+    PreCheckoutQuery,
+    User,
+)
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import metrics
+from branches import (
+    MENU_OVERRIDES_KEY,
+    admin_group_for,
+    branch_keys,
+    dish_key,
+    find_base_dish,
+    find_dish,
+    get_overrides,
+    resolve_key,
+    revalidate_cart,
+    route_order,
+)
+from broadcast import broadcast
+from callbacks import (
+    BULK_APPLY,
+    BULK_CLEAR,
+    BULK_PICK,
+    BULK_REFRESH,
+    BULK_TOGGLE,
+    ORDER_ASSIGN,
+    ORDER_COURIER,
+    ORDER_REFRESH,
+    ORDER_SET,
+    STATUS_BY_CODE,
+    BranchCb,
+    BulkCb,
+    CategoryCb,
+    CommentCb,
+    DishCb,
+    OrderCb,
+    PageCb,
+    parse_legacy_order,
+)
+from capacity import capacity
+from coalescer import EditCoalescer
+from couriers import pool as courier_pool, reload_pool
+from config import (
+    ADMIN_IDS,
+    BULK_LIST_LIMIT,
+    CARD_EDIT_RATE,
+    COURIER_AUTO_ASSIGN,
+    EDIT_MAX_DELAY,
+    EDIT_QUIET_PERIOD,
+    NOTIFY_RATE,
+    PAYMENTS_CURRENCY,
+    THROTTLE_BURST,
+    THROTTLE_RATE,
+)
+from data import CATEGORY_TITLES, DEFAULT_BRANCH
 from db import (
     DBError,
     create_order,
+    get_active_orders,
     get_order,
+    get_orders,
     save_client,
     set_courier,
     set_group_message_id,
+    set_menu_override,
+    set_orders_status,
     set_user_message_id,
+    set_user_message_ids,
     update_status,
 )
 from keyboards import (
     admin_order_kb,
+    branches_kb,
+    bulk_kb,
     cart_kb,
     categories_kb,
     list_dishes_kb,
     post_order_kb,
     start_kb,
+    statuses_before,
 )
+from eta import estimator
+from events import event_log
+from lifecycle import lifecycle
 from logger import get_logger
-from utils import _safe_split, cart_total, format_cart, progress_text
+from middlewares import ThrottlingMiddleware
+from outbound import OutboundLane
+from payments import payments
+from render import (
+    active_list_text,
+    admin_order_text,
+    cart_changes_text,
+    cart_text,
+    category_header,
+    user_order_text,
+)
+from search import search_dishes
+from tenants import bot_for
+from tracing import tracer
+from settings import settings
+from utils import cart_total
+from zones import find_zone, find_zone_by_location
 
 # ----------------- Router -----------------
 router = Router()
 logger = get_logger(__name__)
 
-# ----------------- Утилиты -----------------
-STATUS_ICONS = {
-    "new": "🆕", "preparing": "🧑‍🍳", "ready": "✅",
-    "handoff": "📦", "onway": "🚚", "delivered": "🏁", "canceled": "❌",
-}
-STATUS_TITLES_RU = {
-    "new": "Заказ принят",
-    "preparing": "Ваш заказ готовят",
-    "ready": "Ваш заказ готов",
-    "handoff": "Передаём курьеру",
-    "onway": "Курьер везёт ваш заказ",
-    "delivered": "Заказ доставлен",
-    "canceled": "Заказ отменён",
-}
-
+# Один экземпляр на оба типа событий: лимит общий для сообщений и нажатий
+_throttling = ThrottlingMiddleware(rate=THROTTLE_RATE, burst=THROTTLE_BURST)
+router.message.outer_middleware(_throttling)
+router.callback_query.outer_middleware(_throttling)
+
+# Спан «handler <имя>» в трассе апдейта — только вокруг самого хендлера
+_handler_span = tracer.handler_middleware()
+for _observer in (
+    router.message,
+    router.callback_query,
+    router.inline_query,
+    router.chosen_inline_result,
+    router.pre_checkout_query,
+):
+    _observer.middleware(_handler_span)
+
+# Отложенные правки карточек с блюдами: одна правка на серию нажатий
+_edits = EditCoalescer(quiet=EDIT_QUIET_PERIOD, max_delay=EDIT_MAX_DELAY)
+lifecycle.on_drain(_edits.flush_all)
+
+# Массовые действия: клиенты и карточки обновляются через полосы со своим лимитом
+_notify_lane = OutboundLane("notify", NOTIFY_RATE)
+_card_lane = OutboundLane("cards", CARD_EDIT_RATE)
 
+# ----------------- Утилиты -----------------
 def order_status_legend() -> str:
     """
     Текст с этапами заказа, чтобы клиент понимал, что означает каждый статус.
+    Время этапов — текущие средние по живой статистике.
     """
+    m = estimator.stage_minutes
+    total = sum(m(s) for s in ("new", "preparing", "ready", "handoff", "onway"))
     return (
         "Этапы заказа:\n"
-        "• 👨‍🍳 Готовим — ⏳\n"
-        "• ✅ Готов — ⏳\n"
-        "• 📦 Передаём курьеру — ⏳\n"
-        "• 🚚 В пути — ⏳\n"
-        "• 🏁 Доставлен — ⏳"
+        f"• 👨‍🍳 Готовим — ~{m('new') + m('preparing')} мин\n"
+        f"• ✅ Готов — ~{m('ready')} мин\n"
+        f"• 📦 Передаём курьеру — ~{m('handoff')} мин\n"
+        f"• 🚚 В пути — ~{m('onway')} мин\n"
+        f"• 🏁 Доставлен — в среднем через ~{total} мин"
     )
 
 
-def _user_order_text(
-    name: str,
-    phone: str,
-    address: str,
-    cart: list,
-    status: str,
-    courier: str | None,
-    comment_text: str | None = None,
-    comment_topic: str | None = None,
-) -> str:
-    items_text = "\n".join(
-        f"• {i['name']} ×{i.get('qty', 1)} — {i['price'] * i.get('qty', 1)}₽"
-        for i in cart
-    )
-    total = cart_total(cart)
-    courier_line = f"\n<b>Курьер:</b> {courier}" if courier else ""
-
-    comment_line = ""
-    if comment_text:
-        topic_label = "заказу"
-        if comment_topic == "food":
-            topic_label = "еде"
-        elif comment_topic == "delivery":
-            topic_label = "доставке"
-        comment_line = f"\n<b>Комментарий к {topic_label}:</b> {comment_text}"
+def is_admin_user(user_id: int) -> bool:
+    return True if not ADMIN_IDS else (user_id in ADMIN_IDS)
 
-    return (
-        f"✅ <b>Заказ оформлен!</b>\n\n"
-        f"<b>Имя:</b> {name}\n"
-        f"<b>Телефон:</b> {phone}\n"
-        f"<b>Адрес:</b> {address}{courier_line}{comment_line}\n\n"
-        f"<b>Ваши блюда:</b>\n{items_text}\n\n"
-        f"<b>Итого:</b> {total}₽\n\n"
-        f"<b>Статус:</b> {STATUS_TITLES_RU.get(status, status)} {STATUS_ICONS.get(status, '')}\n\n"
-        f"{progress_text(status)}"
+
+def _admin_kb(order) -> InlineKeyboardMarkup:
+    """
+    Клавиатура карточки заказа с подсказкой наименее загруженного курьера из зоны.
+    """
+    has_courier = bool(order.get("courier"))
+    suggested = None if has_courier else courier_pool.best(order.get("zone"))
+    return admin_order_kb(
+        order["id"], order["status"], has_courier=has_courier, suggested_courier=suggested
     )
 
 
-def _admin_order_text(order) -> str:
-    items_text = "\n".join(
-        f"• {i['name']} ×{i.get('qty', 1)} — {i['price'] * i.get('qty', 1)}₽"
-        for i in order["items"]
+async def _assign_courier(
+    bot,
+    order_id: int,
+    courier: str,
+    courier_id: int | None = None,
+    *,
+    card_chat_id: int | None = None,
+    notify: bool = True,
+    actor_id: int | None = None,
+):
+    """
+    Сохраняет курьера, учитывает его загрузку и (если notify) обновляет
+    карточку в админ-группе и сообщение клиента. Кидает DBError.
+    """
+    await asyncio.to_thread(set_courier, order_id, courier, courier_id)
+    event_log.record(order_id, "courier", courier, actor_id)
+    if courier_id is not None:
+        courier_pool.assign(order_id, courier_id)
+    order = await asyncio.to_thread(get_order, order_id)
+    if not order or not notify:
+        return order
+
+    bot = bot_for(order.get("branch"), bot)
+    card_chat_id = card_chat_id or admin_group_for(order.get("branch"))
+    # отложенная правка карточки (после /active) знает заказ ещё без курьера
+    _edits.cancel((card_chat_id, order["group_message_id"]))
+    try:
+        await bot.edit_message_text(
+            chat_id=card_chat_id,
+            message_id=order["group_message_id"],
+            text=admin_order_text(order),
+            reply_markup=_admin_kb(order),
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning("Не удалось обновить карточку заказа %s после назначения курьера: %s", order_id, e)
+    except Exception as e:
+        logger.warning("Не удалось обновить карточку заказа %s после назначения курьера: %s", order_id, e)
+
+    try:
+        await bot.edit_message_text(
+            chat_id=order["user_id"],
+            message_id=order["user_message_id"],
+            text=user_order_text(
+                order["user_name"],
+                order["phone"],
+                order["address"],
+                order["items"],
+                status=order["status"],
+                courier=order.get("courier"),
+                eta_text=estimator.describe(order_id),
+            ),
+        )
+        await bot.send_message(
+            order["user_id"], f"Назначен курьер: {courier} 🚚"
+        )
+    except Exception as e:
+        logger.warning("Не удалось сообщить клиенту о курьере заказа %s: %s", order_id, e)
+    return order
+
+
+async def _notify_customer(bot, order: dict, lane: OutboundLane | None = None) -> int | None:
+    """
+    Сообщает клиенту новый статус заказа (через полосу `lane`, если задана).
+    Возвращает id отправленного сообщения или None, если отправить
+    не удалось (ошибка уже в логе).
+    """
+    order_id = order["id"]
+    user_markup = (
+        post_order_kb(order_id)
+        if order["status"] in ("delivered", "canceled")
+        else None
     )
-    user_link = f"<a href='tg://user?id={order['user_id']}'>{order['user_name'] or 'user'}</a>"
-    courier_line = f"\n<b>Курьер:</b> {order['courier']}" if order.get("courier") else ""
-
-    comment = order.get("comment")
-    comment_topic = order.get("comment_topic")
-    comment_line = ""
-    if comment:
-        topic_label = "заказу"
-        if comment_topic == "food":
-            topic_label = "еде"
-        elif comment_topic == "delivery":
-            topic_label = "доставке"
-        comment_line = f"\n<b>Комментарий клиента к {topic_label}:</b> {comment}"
 
-    return (
-        f"{STATUS_ICONS.get(order['status'], '')} <b>Заказ #{order['id']}</b>\n"
-        f"{items_text}\n\n"
-        f"<b>Сумма:</b> {order['total']}₽\n"
-        f"<b>Клиент:</b> {user_link} @{order.get('user_username') or '-'}\n"
-        f"<b>Телефон:</b> {order.get('phone')}\n"
-        f"<b>Адрес:</b> {order.get('address')}{courier_line}{comment_line}\n"
-        f"<b>Статус:</b> {STATUS_TITLES_RU.get(order['status'], order['status'])}"
+    user_text = user_order_text(
+        order["user_name"],
+        order["phone"],
+        order["address"],
+        order["items"],
+        status=order["status"],
+        courier=order.get("courier"),
+        eta_text=estimator.describe(order_id),
     )
 
+    try:
+        send = lambda: bot.send_message(  # noqa: E731
+            chat_id=order["user_id"],
+            text=user_text,
+            reply_markup=user_markup,
+        )
+        msg = await (lane.send(send) if lane else send())
+    except TelegramForbiddenError as e:
+        if "bots can't send messages to bots" in str(e):
+            logger.info(
+                "Клиент %s является ботом, Telegram не разрешает отправлять ему сообщения",
+                order["user_id"],
+            )
+        else:
+            logger.warning(
+                "Не удалось отправить сообщение клиенту для заказа %s: %s",
+                order_id,
+                e,
+            )
+        return None
+    except Exception as e:
+        logger.warning(
+            "Не удалось отправить сообщение клиенту для заказа %s: %s",
+            order_id,
+            e,
+        )
+        return None
+    return msg.message_id
+
 
-def is_admin_user(user_id: int) -> bool:
-    return True if not ADMIN_IDS else (user_id in ADMIN_IDS)
+def _on_status_changed(order: dict, new_status: str, actor_id: int | None) -> None:
+    """Состояние в памяти после смены статуса в БД (заказ — до смены)."""
+    order_id = order["id"]
+    event_log.remember(order_id, "status", new_status, actor_id)
+    courier_pool.on_status(order_id, new_status)
+    capacity.on_status(order_id, new_status)
+    estimator.on_status(order_id, new_status)
+    payments.on_status(order_id, new_status)
+    if new_status == "ready" and not order.get("courier"):
+        courier_pool.wait(order_id, order.get("zone"))
+
+
+async def _dispatch_couriers(bot, current_order_ids: Collection[int] = ()) -> None:
+    """
+    Автоназначение: раздаёт ожидающие готовые заказы освободившимся курьерам.
+    Для текущих заказов карточку и клиента обновит вызывающий код.
+    """
+    if not COURIER_AUTO_ASSIGN:
+        return
+    for order_id, zone, courier in courier_pool.match_waiting():
+        try:
+            await _assign_courier(
+                bot,
+                order_id,
+                courier["name"],
+                courier["id"],
+                notify=order_id not in current_order_ids,
+            )
+        except DBError:
+            logger.exception("Не удалось автоматически назначить курьера заказу %s", order_id)
+            # заказ уже снят с очереди — возвращаем его первым, курьера освобождаем
+            courier_pool.release(order_id)
+            courier_pool.wait(order_id, zone, front=True)
 
 
 # ----------------- FSM -----------------
@@ -151,6 +343,47 @@ class AdminStates(StatesGroup):
     waiting_courier_name = State()
 
 
+# ----------------- Оплата -----------------
+# Выше хендлеров с фильтрами по состоянию: оплата может прийти посреди нового заказа
+@router.pre_checkout_query()
+async def pre_checkout(query: PreCheckoutQuery):
+    error = payments.check(
+        query.invoice_payload, query.from_user.id, query.currency, query.total_amount
+    )
+    await query.answer(ok=error is None, error_message=error)
+
+
+@router.message(F.successful_payment)
+async def payment_done(message: Message):
+    payment = message.successful_payment
+    order_id = payments.paid(
+        payment.invoice_payload,
+        payment.total_amount,
+        payment.telegram_payment_charge_id,
+        payment.provider_payment_charge_id,
+    )
+    if order_id is None:
+        logger.error("Оплата с неизвестным payload %r", payment.invoice_payload)
+        return
+    event_log.record(order_id, "payment", "paid", message.from_user.id)
+    await message.answer(f"Оплата заказа #{order_id} получена ✅")
+
+
+async def _send_invoice(message: Message, order_id: int, cart: list, provider_token: str) -> None:
+    try:
+        await message.bot.send_invoice(
+            chat_id=message.chat.id,
+            title=f"Заказ #{order_id}",
+            description="Оплатите картой сейчас или наличными курьеру при получении.",
+            payload=payments.open(order_id, message.chat.id, cart_total(cart)),
+            provider_token=provider_token,
+            currency=PAYMENTS_CURRENCY,
+            prices=payments.prices(cart),
+        )
+    except Exception:
+        logger.warning("Не удалось отправить счёт по заказу %s", order_id, exc_info=True)
+
+
 # ----------------- Клиентские команды -----------------
 @router.message(CommandStart(), F.chat.type == "private")
 async def cmd_start(message: Message, state: FSMContext):
@@ -174,139 +407,241 @@ async def cmd_help(message: Message):
 
 
 @router.message(Command("menu"))
-async def cmd_menu(message: Message, state: FSMContext):
+async def cmd_menu(message: Message, state: FSMContext, tenant: str | None = None):
     await state.set_state(OrderStates.choosing_category)
-    await state.update_data(cart=[])
-    await message.answer("Выберите категорию:", reply_markup=categories_kb())
+    await state.update_data(cart=[], branch=tenant or DEFAULT_BRANCH)
+    # бот бренда работает только со своей кухней — выбирать нечего
+    if not tenant and len(branch_keys()) > 1:
+        await message.answer("Выберите кухню:", reply_markup=branches_kb())
+        return
+    await message.answer("Выберите категорию:", reply_markup=categories_kb(tenant))
 
 
 @router.message(Command("cart"))
 async def cmd_cart(message: Message, state: FSMContext):
     cart = (await state.get_data()).get("cart", [])
     await message.answer(
-        f"🧺 <b>Корзина</b>\n\n{format_cart(cart)}", reply_markup=cart_kb(cart)
+        f"🧺 <b>Корзина</b>\n\n{cart_text(cart)}", reply_markup=cart_kb(cart)
     )
 
 
 # ----------------- Каталог и корзина -----------------
+def _drop_pending_edit(message: Message) -> None:
+    """
+    Перед тем как перерисовать сообщение — отменяем его отложенную перерисовку
+    (список блюд после add_dish, карточка заказа после /active), иначе она
+    позже затрёт новый экран устаревшими данными.
+    """
+    _edits.cancel((message.chat.id, message.message_id))
+
+
 @router.callback_query(F.data == "make_order")
-async def make_order(callback: CallbackQuery, state: FSMContext):
+async def make_order(callback: CallbackQuery, state: FSMContext, tenant: str | None = None):
+    _drop_pending_edit(callback.message)
     await state.set_state(OrderStates.choosing_category)
-    await state.update_data(cart=[])
+    await state.update_data(cart=[], branch=tenant or DEFAULT_BRANCH)
+    if not tenant and len(branch_keys()) > 1:
+        await callback.message.edit_text("Выберите кухню:", reply_markup=branches_kb())
+    else:
+        await callback.message.edit_text(
+            "Выберите категорию:", reply_markup=categories_kb(tenant)
+        )
+    await callback.answer()
+
+
+@router.callback_query(BranchCb.filter(), OrderStates.choosing_category)
+async def choose_branch(callback: CallbackQuery, state: FSMContext, callback_data: BranchCb):
+    _drop_pending_edit(callback.message)
+    # меню у кухонь разное — корзину начинаем заново
+    branch = resolve_key(callback_data.branch)
+    await state.update_data(cart=[], branch=branch)
     await callback.message.edit_text(
-        "Выберите категорию:", reply_markup=categories_kb()
+        "Выберите категорию:", reply_markup=categories_kb(branch)
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("cat:"), OrderStates.choosing_category)
-async def show_list(callback: CallbackQuery, state: FSMContext):
-    try:
-        _, category_key = _safe_split(callback.data, 2)
-    except ValueError:
-        await callback.answer("Некорректные данные", show_alert=True)
-        return
-
+async def _show_dishes(callback: CallbackQuery, state: FSMContext, category_key: str, page: int) -> None:
+    _drop_pending_edit(callback.message)
     data = await state.get_data()
     cart = data.get("cart", [])
+    branch = data.get("branch")
 
-    qty_sum = sum(i.get("qty", 1) for i in cart)
-    total = cart_total(cart)
-    cart_lines = (
-        "\n".join(
-            f"• {i['name']} ×{i.get('qty', 1)} — {i['price'] * i.get('qty', 1)}₽"
-            for i in cart
+    try:
+        await callback.message.edit_text(
+            category_header(category_key, cart),
+            reply_markup=list_dishes_kb(category_key, page=page, branch=branch),
         )
-        if cart
-        else "Корзина пуста."
-    )
-    header = (
-        f"Категория: <b>{CATEGORY_TITLES.get(category_key, category_key)}</b>\n"
-        f"В корзине: {qty_sum} поз. • {total}₽\n"
-        f"<b>Вы выбрали:</b>\n{cart_lines}\n\n"
-        f"Выберите блюдо:"
-    )
-
-    await callback.message.edit_text(
-        header, reply_markup=list_dishes_kb(category_key, page=0)
-    )
+    except TelegramBadRequest as e:
+        # листание за край списка даёт ту же страницу
+        if "message is not modified" not in str(e):
+            raise
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("dish:"), OrderStates.choosing_category)
-async def add_dish(callback: CallbackQuery, state: FSMContext):
-    try:
-        _, category_key, dish_id_str, page_str = _safe_split(callback.data, 4)
-        dish_id = int(dish_id_str)
-    except Exception:
-        await callback.answer("Некорректные данные блюда", show_alert=True)
-        return
+@router.callback_query(CategoryCb.filter(), OrderStates.choosing_category)
+async def show_list(callback: CallbackQuery, state: FSMContext, callback_data: CategoryCb):
+    await _show_dishes(callback, state, callback_data.cat, page=0)
 
-    dish = next((d for d in MENU.get(category_key, []) if d["id"] == dish_id), None)
-    if not dish:
-        await callback.answer("Блюдо не найдено", show_alert=True)
-        return
 
-    data = await state.get_data()
-    cart = data.get("cart", [])
+@router.callback_query(PageCb.filter(), OrderStates.choosing_category)
+async def turn_page(callback: CallbackQuery, state: FSMContext, callback_data: PageCb):
+    await _show_dishes(callback, state, callback_data.cat, page=callback_data.page)
+
+
+@router.callback_query(F.data == "noop")
+async def noop(callback: CallbackQuery):
+    await callback.answer()
+
+
+def _add_to_cart(cart: list, dish: dict, qty: int = 1) -> list:
     for item in cart:
         if item["name"] == dish["name"]:
-            item["qty"] += 1
+            item["qty"] += qty
             break
     else:
-        cart.append({"name": dish["name"], "price": dish["price"], "qty": 1})
+        cart.append({"name": dish["name"], "price": dish["price"], "qty": qty})
+    return cart
+
+
+@router.callback_query(DishCb.filter(), OrderStates.choosing_category)
+async def add_dish(
+    callback: CallbackQuery, state: FSMContext, callback_data: DishCb, merged_taps: int = 0
+):
+    """
+    +N к блюду в корзине.
+    Корзина обновляется сразу, клиент сразу получает тост,
+    а правка сообщения откладывается и склеивается с соседними нажатиями.
+    """
+    # merged_taps > 0 — это пачка нажатий, склеенная антифлудом (тосты уже отправлены)
+    taps = merged_taps or 1
+    category_key, dish_id = callback_data.cat, callback_data.dish
 
+    data = await state.get_data()
+    branch = data.get("branch")
+    dish = find_dish(branch, category_key, dish_id)
+    if not dish:
+        await callback.answer("Блюдо закончилось или не найдено", show_alert=True)
+        return
+
+    cart = _add_to_cart(data.get("cart", []), dish, taps)
     await state.update_data(cart=cart)
+    if not merged_taps:
+        await callback.answer(f"{dish['name']} добавлено ✅")
 
-    qty_sum = sum(i.get("qty", 1) for i in cart)
-    total = cart_total(cart)
-    cart_lines = "\n".join(
-        f"• {i['name']} ×{i.get('qty', 1)} — {i['price'] * i.get('qty', 1)}₽"
-        for i in cart
-    )
+    page = callback_data.page
+    message = callback.message
 
-    header = (
-        f"Категория: <b>{CATEGORY_TITLES.get(category_key, category_key)}</b>\n"
-        f"В корзине: {qty_sum} поз. • {total}₽\n"
-        f"<b>Вы выбрали:</b>\n{cart_lines}\n\n"
-        f"Выберите блюдо:"
-    )
+    async def render() -> None:
+        # Рисуем по актуальной корзине на момент правки, а не на момент нажатия
+        current = (await state.get_data()).get("cart", [])
+        try:
+            await message.edit_text(
+                category_header(category_key, current),
+                reply_markup=list_dishes_kb(category_key, page=page, branch=branch),
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
 
-    page = int(page_str) if page_str.lstrip("-").isdigit() else 0
-    await callback.message.edit_text(
-        header, reply_markup=list_dishes_kb(category_key, page=page)
+    _edits.schedule((message.chat.id, message.message_id), render)
+
+
+@router.inline_query()
+async def inline_search(query: InlineQuery, state: FSMContext, tenant: str | None = None):
+    """
+    Поиск блюда прямо из поля ввода: @bot борщ.
+    id результата — те же данные, что у кнопки блюда, их разбирает inline_chosen.
+    """
+    # у inline-запроса нет чата, aiogram берёт состояние по пользователю — это и есть личка с ботом
+    branch = (await state.get_data()).get("branch") or tenant
+    results = []
+    for category_key, dish_id in search_dishes(branch, query.query):
+        dish = find_dish(branch, category_key, dish_id)
+        if not dish:
+            continue
+        results.append(
+            InlineQueryResultArticle(
+                id=DishCb(cat=category_key, dish=dish_id, page=0).pack(),
+                title=dish["name"],
+                description=f"{dish['price']}₽ • {CATEGORY_TITLES.get(category_key, category_key)}",
+                input_message_content=InputTextMessageContent(
+                    message_text=f"🍽 {dish['name']} — {dish['price']}₽"
+                ),
+            )
+        )
+    await query.answer(results, cache_time=30, is_personal=True)
+
+
+@router.chosen_inline_result()
+async def inline_chosen(result: ChosenInlineResult, state: FSMContext, tenant: str | None = None):
+    """
+    Выбранный в поиске результат сразу кладём в корзину.
+    Требует включённого inline feedback у бота (/setinlinefeedback в BotFather).
+    """
+    try:
+        callback_data = DishCb.unpack(result.result_id)
+    except (TypeError, ValueError):
+        return
+
+    current = await state.get_state()
+    if current not in (None, OrderStates.choosing_category.state):
+        await result.bot.send_message(
+            result.from_user.id, "Сначала завершите оформление текущего заказа."
+        )
+        return
+
+    data = await state.get_data()
+    branch = resolve_key(data.get("branch") or tenant)
+    dish = find_dish(branch, callback_data.cat, callback_data.dish)
+    if not dish:
+        await result.bot.send_message(result.from_user.id, "Блюдо закончилось или не найдено")
+        return
+
+    cart = _add_to_cart(data.get("cart", []) if current else [], dish)
+    await state.set_state(OrderStates.choosing_category)
+    await state.update_data(cart=cart, branch=branch)
+    await result.bot.send_message(
+        result.from_user.id,
+        f"{dish['name']} добавлено ✅\n\n🧺 <b>Корзина</b>\n\n{cart_text(cart)}",
+        reply_markup=cart_kb(cart),
     )
-    await callback.answer(f"{dish['name']} добавлено ✅")
 
 
 @router.callback_query(F.data == "show_cart", OrderStates.choosing_category)
 async def show_cart(callback: CallbackQuery, state: FSMContext):
+    _drop_pending_edit(callback.message)
     cart = (await state.get_data()).get("cart", [])
     await callback.message.edit_text(
-        f"🧺 <b>Корзина</b>\n\n{format_cart(cart)}", reply_markup=cart_kb(cart)
+        f"🧺 <b>Корзина</b>\n\n{cart_text(cart)}", reply_markup=cart_kb(cart)
     )
     await callback.answer()
 
 
 @router.callback_query(F.data == "clear_cart", OrderStates.choosing_category)
 async def clear_cart(callback: CallbackQuery, state: FSMContext):
+    _drop_pending_edit(callback.message)
     await state.update_data(cart=[])
+    branch = (await state.get_data()).get("branch")
     await callback.message.edit_text(
-        "🧺 Корзина очищена.\n\nВыберите категорию:", reply_markup=categories_kb()
+        "🧺 Корзина очищена.\n\nВыберите категорию:", reply_markup=categories_kb(branch)
     )
     await callback.answer("Корзина очищена")
 
 
 @router.callback_query(F.data == "back_to_categories", OrderStates.choosing_category)
 async def back_to_categories(callback: CallbackQuery, state: FSMContext):
+    _drop_pending_edit(callback.message)
+    branch = (await state.get_data()).get("branch")
     await callback.message.edit_text(
-        "Выберите категорию:", reply_markup=categories_kb()
+        "Выберите категорию:", reply_markup=categories_kb(branch)
     )
     await callback.answer()
 
 
 @router.callback_query(F.data == "back_to_start")
 async def back_to_start(callback: CallbackQuery, state: FSMContext):
+    _drop_pending_edit(callback.message)
     await state.clear()
     await state.set_state(OrderStates.choosing_category)
     await callback.message.edit_text(
@@ -323,11 +658,28 @@ async def checkout(callback: CallbackQuery, state: FSMContext):
     - не подгружаем клиента из БД,
     - всегда заново спрашиваем имя/телефон/адрес.
     """
-    cart = (await state.get_data()).get("cart", [])
+    data = await state.get_data()
+    cart = data.get("cart", [])
     if not cart:
         await callback.answer("Корзина пуста ❌", show_alert=True)
         return
 
+    # Пока корзину собирали, блюдо могли убрать в стоп-лист или поменять цену
+    cart, changes = revalidate_cart(data.get("branch"), cart)
+    if changes:
+        await state.update_data(cart=cart)
+        await callback.message.answer(cart_changes_text(changes, cart))
+        if not cart:
+            await callback.answer("Корзина пуста ❌", show_alert=True)
+            return
+
+    # Допуск: не начинаем оформление, если кухня закрыта или перегружена
+    admitted, reason = capacity.admit(data.get("branch"))
+    if not admitted:
+        await callback.answer(reason, show_alert=True)
+        return
+
+    _drop_pending_edit(callback.message)
     await callback.message.edit_text("Введите ваше имя:")
     await state.set_state(OrderStates.waiting_for_name)
     await callback.answer()
@@ -363,37 +715,29 @@ async def enter_phone(message: Message, state: FSMContext):
     # НЕ проверяем формат, просто сохраняем как есть
     await state.update_data(phone=phone)
 
-    await message.answer("Введите адрес доставки:")
+    await message.answer("Введите адрес доставки (или отправьте геолокацию 📎):")
     await state.set_state(OrderStates.waiting_for_address)
 
 
-@router.message(OrderStates.waiting_for_address)
-async def enter_address(message: Message, state: FSMContext):
-    address = (message.text or "").strip()
-    if not address:
-        await message.answer("Адрес не может быть пустым. Введите снова:")
-        return
-
-    await state.update_data(address=address)
-
+async def _ask_comment(message: Message, state: FSMContext) -> None:
     # После адреса спрашиваем про комментарий
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(
-                    text="🍽 Комментарий к еде", callback_data="comment:food"
+                    text="🍽 Комментарий к еде", callback_data=CommentCb(topic="food").pack()
                 )
             ],
             [
                 InlineKeyboardButton(
                     text="🚚 Комментарий к доставке",
-                    callback_data="comment:delivery",
+                    callback_data=CommentCb(topic="delivery").pack(),
                 )
             ],
             [
                 InlineKeyboardButton(
                     text="Без комментария",
-                    callback_data="comment:skip",
+                    callback_data=CommentCb(topic="skip").pack(),
                 )
             ],
         ]
@@ -406,18 +750,51 @@ async def enter_address(message: Message, state: FSMContext):
     await state.set_state(OrderStates.waiting_for_comment_choice)
 
 
-@router.callback_query(F.data.startswith("comment:"), OrderStates.waiting_for_comment_choice)
-async def comment_choice(callback: CallbackQuery, state: FSMContext):
-    try:
-        _, topic = _safe_split(callback.data, 2)
-    except Exception:
-        await callback.answer("Некорректные данные", show_alert=True)
+@router.message(OrderStates.waiting_for_address, F.location)
+async def enter_location(message: Message, state: FSMContext):
+    lat, lon = message.location.latitude, message.location.longitude
+    zone, checked = find_zone_by_location(lat, lon)
+    if checked and not zone:
+        await message.answer(
+            "К сожалению, эта точка вне зоны доставки 😔\n"
+            "Введите адрес текстом, если ошиблись с геолокацией:"
+        )
         return
 
+    await state.update_data(address=f"📍 {lat:.5f}, {lon:.5f}", zone=zone)
+    await _ask_comment(message, state)
+
+
+@router.message(OrderStates.waiting_for_address)
+async def enter_address(message: Message, state: FSMContext):
+    address = (message.text or "").strip()
+    if not address:
+        await message.answer("Адрес не может быть пустым. Введите снова:")
+        return
+
+    # Проверяем зону по справочнику улиц сразу, а не после оформления
+    zone, checked = find_zone(address)
+    if checked and not zone:
+        await message.answer(
+            "Не нашли эту улицу в зоне доставки 😔\n"
+            "Проверьте название улицы или отправьте геолокацию 📎:"
+        )
+        return
+
+    await state.update_data(address=address, zone=zone)
+    await _ask_comment(message, state)
+
+
+@router.callback_query(CommentCb.filter(), OrderStates.waiting_for_comment_choice)
+async def comment_choice(
+    callback: CallbackQuery, state: FSMContext, callback_data: CommentCb, tenant: str | None = None
+):
+    topic = callback_data.topic
+
     if topic == "skip":
         # Без комментария — оформляем заказ сразу
         await callback.answer("Оформляем заказ без комментария")
-        await finalize_order(callback.message, state)
+        await finalize_order(callback.message, state, callback.from_user, tenant)
         return
 
     # Сохраняем тему комментария и просим текст
@@ -433,19 +810,20 @@ async def comment_choice(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(OrderStates.waiting_for_comment_text)
-async def comment_text(message: Message, state: FSMContext):
+async def comment_text(message: Message, state: FSMContext, tenant: str | None = None):
     text = (message.text or "").strip()
     if not text:
         await message.answer("Комментарий не может быть пустым. Напишите хотя бы пару слов 🙂")
         return
 
     await state.update_data(comment_text=text)
-    await finalize_order(message, state)
+    await finalize_order(message, state, message.from_user, tenant)
 
 
-async def finalize_order(message: Message, state: FSMContext):
+async def finalize_order(message: Message, state: FSMContext, user: User, tenant: str | None = None):
     """
-    Общий финальный шаг:
+    Общий финальный шаг (user — клиент: при «Без комментария» message —
+    сообщение бота, и его from_user — сам бот):
     - берём имя, телефон, адрес, корзину, комментарий (если есть),
     - создаём заказ,
     - отправляем сообщения клиенту и в админ-группу.
@@ -459,25 +837,49 @@ async def finalize_order(message: Message, state: FSMContext):
     comment_topic = data.get("comment_topic")
     comment_text = data.get("comment_text")
 
+    # Кухня: по зоне доставки, если она там есть, иначе — та, чьё меню смотрели.
+    # Заказ в боте бренда остаётся у этого бренда.
+    branch = tenant or route_order(data.get("branch"), data.get("zone"), cart)
+    admin_group_id = admin_group_for(branch)
+
     if not cart:
         await message.answer("Корзина пуста ❌")
         await state.clear()
         return
 
+    # Меню могло измениться, пока клиент вводил данные: заказ с новой суммой
+    # подтверждает сам клиент — снова показываем выбор комментария
+    cart, changes = revalidate_cart(branch, cart)
+    if changes:
+        await state.update_data(cart=cart)
+        await message.answer(cart_changes_text(changes, cart))
+        if not cart:
+            await message.answer("Корзина пуста ❌")
+            await state.clear()
+            return
+        await _ask_comment(message, state)
+        return
+
     try:
-        order_id = create_order(
-            user_id=message.from_user.id,
-            user_name=message.from_user.full_name,
-            user_username=message.from_user.username,
+        order_id = await asyncio.to_thread(
+            create_order,
+            user_id=user.id,
+            user_name=user.full_name,
+            user_username=user.username,
             phone=phone,
             address=address,
             items=cart,
             total=cart_total(cart),
             status="new",
+            branch=branch,
+            zone=data.get("zone"),
         )
         # технично мы всё ещё сохраняем клиента в БД,
         # но не используем эту "память" в диалогах
-        save_client(message.from_user.id, name, phone, address)
+        await asyncio.to_thread(save_client, user.id, name, phone, address, tenant)
+        event_log.record(order_id, "status", "new", user.id)
+        capacity.on_created(order_id, branch)
+        estimator.on_created(order_id, branch)
     except DBError:
         logger.exception("Не удалось создать заказ")
         await message.answer(
@@ -488,7 +890,7 @@ async def finalize_order(message: Message, state: FSMContext):
 
     # Сообщение для клиента
     user_msg = await message.answer(
-        _user_order_text(
+        user_order_text(
             name,
             phone,
             address,
@@ -497,9 +899,15 @@ async def finalize_order(message: Message, state: FSMContext):
             courier=None,
             comment_text=comment_text,
             comment_topic=comment_topic,
+            eta_text=estimator.describe(order_id),
         )
     )
-    set_user_message_id(order_id, user_msg.message_id)
+    await asyncio.to_thread(set_user_message_id, order_id, user_msg.message_id)
+
+    # токен провайдера свой у каждого бота: чужой Telegram не примет
+    provider_token = payments.provider_token(tenant)
+    if provider_token:
+        await _send_invoice(message, order_id, cart, provider_token)
 
     # Подсказка по этапам заказа
     try:
@@ -508,35 +916,36 @@ async def finalize_order(message: Message, state: FSMContext):
         logger.warning("Не удалось отправить легенду статусов для заказа %s", order_id)
 
     # Сообщение в админскую группу
-    if ADMIN_GROUP_ID:
+    if admin_group_id:
         try:
             admin_payload = {
                 "id": order_id,
                 "items": cart,
                 "total": cart_total(cart),
-                "user_id": message.from_user.id,
-                "user_username": message.from_user.username,
-                "user_name": message.from_user.full_name,
+                "user_id": user.id,
+                "user_username": user.username,
+                "user_name": user.full_name,
                 "phone": phone,
                 "address": address,
                 "courier": None,
                 "status": "new",
+                "zone": data.get("zone"),
             }
             if comment_text:
                 admin_payload["comment"] = comment_text
                 admin_payload["comment_topic"] = comment_topic
 
             admin_msg = await message.bot.send_message(
-                chat_id=ADMIN_GROUP_ID,
-                text=_admin_order_text(admin_payload),
+                chat_id=admin_group_id,
+                text=admin_order_text(admin_payload),
                 reply_markup=admin_order_kb(
                     order_id, "new", has_courier=False
                 ),
             )
-            set_group_message_id(order_id, admin_msg.message_id)
+            await asyncio.to_thread(set_group_message_id, order_id, admin_msg.message_id)
         except Exception:
             logger.exception(
-                "Не удалось отправить сообщение в группу %s", ADMIN_GROUP_ID
+                "Не удалось отправить сообщение в группу %s", admin_group_id
             )
 
     await state.clear()
@@ -556,7 +965,7 @@ async def cmd_find(message: Message):
 
     order_id = int(parts[1])
     try:
-        order = get_order(order_id)
+        order = await asyncio.to_thread(get_order, order_id)
     except DBError:
         logger.exception("Не удалось получить заказ %s", order_id)
         order = None
@@ -565,189 +974,377 @@ async def cmd_find(message: Message):
         return
 
     await message.answer(
-        _admin_order_text(order),
-        reply_markup=admin_order_kb(
-            order_id, order["status"], has_courier=bool(order.get("courier"))
-        ),
+        admin_order_text(order),
+        reply_markup=_admin_kb(order),
     )
 
 
-# ----------------- Админская часть -----------------
-@router.callback_query(
-    F.data.startswith("order:"), F.message.chat.type.in_({"group", "supergroup"})
-)
-async def admin_actions(callback: CallbackQuery, state: FSMContext):
-    if not is_admin_user(callback.from_user.id):
-        await callback.answer("Недостаточно прав", show_alert=True)
+@router.message(Command("couriers"))
+async def cmd_couriers(message: Message):
+    """
+    Перечитывает таблицу couriers и показывает текущую загрузку.
+    """
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
         return
 
-    data = callback.data or ""
-    parts = data.split(":")
+    try:
+        await asyncio.to_thread(reload_pool)
+    except DBError:
+        logger.exception("Не удалось загрузить курьеров")
+        await message.answer("Не удалось загрузить курьеров ❌")
+        return
 
-    # ожидаемые варианты:
-    # order:set:<order_id>:<status>
-    # order:setcourier:<order_id>
-    # order:refresh:<order_id>
-    if len(parts) < 3 or parts[0] != "order":
-        await callback.answer("Некорректные данные кнопки", show_alert=True)
+    couriers = courier_pool.couriers()
+    if not couriers:
+        await message.answer("Курьеров в справочнике нет.")
         return
+    lines = [
+        f"• {c['name']} ({c['zone'] or 'любая зона'}) — {c['load']} в работе"
+        for c in couriers
+    ]
+    await message.answer("🚚 <b>Курьеры</b>\n" + "\n".join(lines))
 
-    action = parts[1]
 
-    # ------ изменение статуса ------
-    if action == "set":
-        if len(parts) < 4:
-            await callback.answer("Некорректные данные заказа", show_alert=True)
-            return
+# ----------------- Стоп-лист и цены -----------------
+async def _change_dish(message: Message, usage: str, tenant: str | None = None, **changes) -> None:
+    """
+    /dish_off first 2 [филиал], /dish_on first 2 [филиал], /price first 2 250 [филиал]
+    Правка сохраняется в settings; подписка на ключ сразу подменяет снимок каталога.
+    """
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
 
-        try:
-            order_id = int(parts[2])
-            new_status = parts[3]
-        except Exception:
-            await callback.answer("Некорректные данные заказа", show_alert=True)
+    parts = (message.text or "").split()[1:]
+    if "price" in changes:
+        if len(parts) < 3 or not parts[2].isdigit():
+            await message.answer(usage)
+            return
+        changes["price"] = int(parts.pop(2))
+        if changes["price"] <= 0:
+            await message.answer("Цена должна быть больше нуля ❌")
             return
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer(usage)
+        return
+
+    category_key, dish_id = parts[0], int(parts[1])
+    branch = resolve_key(parts[2] if len(parts) > 2 else tenant)
+    dish = find_base_dish(branch, category_key, dish_id)
+    if not dish:
+        await message.answer("Блюдо не найдено ❌")
+        return
+
+    # правку сливает с текущими БД: две команды подряд не затрут друг друга
+    try:
+        await settings.update(
+            MENU_OVERRIDES_KEY,
+            lambda version: set_menu_override(branch, dish_key(category_key, dish_id), changes, version),
+        )
+    except DBError:
+        logger.exception("Не удалось сохранить правку меню")
+        await message.answer("Не удалось сохранить изменения ❌")
+        return
+
+    if "price" in changes:
+        await message.answer(f"💰 {dish['name']}: новая цена {changes['price']}₽")
+    elif changes.get("available") is False:
+        await message.answer(f"⛔ {dish['name']} скрыто из меню")
+    else:
+        await message.answer(f"✅ {dish['name']} снова в меню")
+
+
+@router.message(Command("dish_off"))
+async def cmd_dish_off(message: Message, tenant: str | None = None):
+    await _change_dish(message, "Использование: /dish_off <категория> <id> [филиал]", tenant, available=False)
+
+
+@router.message(Command("dish_on"))
+async def cmd_dish_on(message: Message, tenant: str | None = None):
+    await _change_dish(message, "Использование: /dish_on <категория> <id> [филиал]", tenant, available=True)
+
+
+@router.message(Command("price"))
+async def cmd_price(message: Message, tenant: str | None = None):
+    await _change_dish(message, "Использование: /price <категория> <id> <цена> [филиал]", tenant, price=0)
+
 
+@router.message(Command("stoplist"))
+async def cmd_stoplist(message: Message):
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
+
+    lines = []
+    for branch, dishes in get_overrides().items():
+        for key, override in dishes.items():
+            category_key, _, dish_id = key.partition(":")
+            dish = find_base_dish(branch, category_key, int(dish_id)) if dish_id.isdigit() else None
+            name = dish["name"] if dish else key
+            if override.get("available") is False:
+                lines.append(f"⛔ [{branch}] {name} ({key})")
+            if "price" in override:
+                lines.append(f"💰 [{branch}] {name} ({key}) — {override['price']}₽")
+    await message.answer("\n".join(lines) if lines else "Стоп-лист пуст, цены из меню.")
+
+
+# ----------------- Рассылки -----------------
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    """
+    /broadcast <текст> или ответом на сообщение — разослать всем клиентам.
+    """
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
+    if broadcast.running:
+        await message.answer("Рассылка уже идёт.\n\n" + broadcast.progress())
+        return
+
+    if message.reply_to_message and message.reply_to_message.html_text:
+        text = message.reply_to_message.html_text
+    else:
+        # текст может начинаться с новой строки: "/broadcast\nТекст"
+        parts = (message.html_text or "").split(maxsplit=1)
+        text = parts[1].strip() if len(parts) > 1 else ""
+    if not text:
+        await message.answer("Использование: /broadcast <текст> или ответ на сообщение")
+        return
+
+    try:
+        job_id = await broadcast.start(message.bot, text)
+    except DBError:
+        logger.exception("Не удалось начать рассылку")
+        await message.answer("Не удалось начать рассылку ❌")
+        return
+    await message.answer(f"📣 Рассылка {job_id} запущена. Прогресс: /broadcast_status")
+
+
+@router.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: Message):
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
+    await message.answer(broadcast.progress())
+
+
+@router.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: Message):
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
+    await broadcast.stop()
+    await message.answer("⏸ " + broadcast.progress() + "\nПродолжить: /broadcast_resume")
+
+
+@router.message(Command("broadcast_resume"))
+async def cmd_broadcast_resume(message: Message):
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
+    if broadcast.running or not await broadcast.resume(message.bot):
+        await message.answer("Нет приостановленной рассылки.")
+        return
+    await message.answer("▶️ Рассылка продолжена.")
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """
+    /profile on [сек] — трассировать все апдейты и снимать профиль цикла
+    (по умолчанию 60 с, потом выключится само); /profile off — итог сразу.
+    """
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
+    args = (message.text or "").split()[1:]
+    mode = args[0].lower() if args else ""
+
+    if mode == "on":
         try:
-            order = get_order(order_id)
-        except DBError:
-            logger.exception("Не удалось загрузить заказ %s", order_id)
-            await callback.answer("Ошибка загрузки заказа", show_alert=True)
+            seconds = max(1, min(int(args[1]), 600)) if len(args) > 1 else 60
+        except ValueError:
+            await message.answer("Использование: /profile on [сек] | /profile off")
             return
+        tracer.start_profiling(seconds)
+        await message.answer(
+            f"🔬 Профилирование включено на {seconds} с: трассируются все апдейты.\n"
+            "Итог: /profile off"
+        )
+        return
 
-        if not order:
-            await callback.answer("Заказ не найден", show_alert=True)
+    if mode == "off":
+        if not tracer.profiler.running:
+            await message.answer("Профилирование не запущено.")
             return
+        report = tracer.stop_profiling()
+        lines = [f"{self_pct:4.1f}% / {total_pct:4.1f}%  {escape(label)}" for label, self_pct, total_pct in report]
+        await message.answer(
+            f"🔬 Профиль цикла ({tracer.profiler.samples} сэмплов), self / total:\n"
+            + "<code>" + "\n".join(lines or ["нет данных"]) + "</code>"
+        )
+        return
 
-        # обновляем статус в БД
-        try:
-            update_status(order_id, new_status)
-            order = get_order(order_id)
-        except DBError:
-            logger.exception("Не удалось обновить статус заказа %s", order_id)
-            await callback.answer("Ошибка обновления статуса", show_alert=True)
-            return
+    await message.answer("Использование: /profile on [сек] | /profile off")
 
-        # обновляем сообщение в админ-группе
+
+# ----------------- Админская часть -----------------
+async def _order_set(callback: CallbackQuery, state: FSMContext, cb: OrderCb) -> None:
+    """Изменение статуса заказа."""
+    order_id = cb.order
+    new_status = STATUS_BY_CODE.get(cb.arg)
+    if new_status is None:
+        await callback.answer("Некорректные данные заказа", show_alert=True)
+        return
+
+    try:
+        order = await asyncio.to_thread(get_order, order_id)
+    except DBError:
+        logger.exception("Не удалось загрузить заказ %s", order_id)
+        await callback.answer("Ошибка загрузки заказа", show_alert=True)
+        return
+
+    if not order:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+
+    # обновляем статус в БД
+    try:
+        await asyncio.to_thread(update_status, order_id, new_status, actor_id=callback.from_user.id)
+        _on_status_changed(order, new_status, callback.from_user.id)
+        await _dispatch_couriers(callback.bot, current_order_ids=(order_id,))
+        order = await asyncio.to_thread(get_order, order_id)
+    except DBError:
+        logger.exception("Не удалось обновить статус заказа %s", order_id)
+        await callback.answer("Ошибка обновления статуса", show_alert=True)
+        return
+
+    # обновляем сообщение в админ-группе
+    _drop_pending_edit(callback.message)
+    try:
+        await callback.message.edit_text(
+            admin_order_text(order),
+            reply_markup=_admin_kb(order),
+        )
+    except Exception:
+        logger.exception(
+            "Не удалось обновить сообщение в админ-группе для заказа %s", order_id
+        )
+
+    # --------- ОТПРАВКА СООБЩЕНИЯ КЛИЕНТУ ---------
+    message_id = await _notify_customer(callback.bot, order)
+    if message_id is not None:
+        # по желанию обновляем последний user_message_id
         try:
-            await callback.message.edit_text(
-                _admin_order_text(order),
-                reply_markup=admin_order_kb(
-                    order_id,
-                    order["status"],
-                    has_courier=bool(order.get("courier")),
-                ),
-            )
+            await asyncio.to_thread(set_user_message_id, order_id, message_id)
         except Exception:
-            logger.exception(
-                "Не удалось обновить сообщение в админ-группе для заказа %s", order_id
-            )
+            pass
 
-        # --------- ОТПРАВКА СООБЩЕНИЯ КЛИЕНТУ ---------
-        user_markup = (
-            post_order_kb(order_id)
-            if order["status"] in ("delivered", "canceled")
-            else None
-        )
+    await callback.answer("Статус обновлён")
+
+
+async def _order_ask_courier(callback: CallbackQuery, state: FSMContext, cb: OrderCb) -> None:
+    """Назначение курьера вручную: ждём имя следующим сообщением."""
+    await state.update_data(order_id_for_courier=cb.order)
+    await state.set_state(AdminStates.waiting_courier_name)
+    await callback.answer()
+    await callback.message.reply(
+        "Введите имя/позывной курьера одним сообщением:"
+    )
+
+
+async def _order_assign(callback: CallbackQuery, state: FSMContext, cb: OrderCb) -> None:
+    """Назначение предложенного курьера."""
+    order_id = cb.order
+    if not cb.arg.isdigit():
+        await callback.answer("Некорректные данные заказа", show_alert=True)
+        return
 
-        user_text = _user_order_text(
-            order["user_name"],
-            order["phone"],
-            order["address"],
-            order["items"],
-            status=order["status"],
-            courier=order.get("courier"),
+    courier_id = int(cb.arg)
+    courier = courier_pool.get(courier_id)
+    if courier is None:
+        await callback.answer("Курьер не найден", show_alert=True)
+        return
+
+    try:
+        await _assign_courier(
+            callback.bot,
+            order_id,
+            courier["name"],
+            courier_id,
+            card_chat_id=callback.message.chat.id,
+            actor_id=callback.from_user.id,
         )
+    except DBError:
+        logger.exception("Не удалось назначить курьера для заказа %s", order_id)
+        await callback.answer("Ошибка сохранения курьера", show_alert=True)
+        return
+
+    await callback.answer(f"Курьер назначен: {courier['name']}")
 
-        try:
-            msg = await callback.bot.send_message(
-                chat_id=order["user_id"],
-                text=user_text,
-                reply_markup=user_markup,
-            )
-            # по желанию обновляем последний user_message_id
-            try:
-                set_user_message_id(order_id, msg.message_id)
-            except Exception:
-                pass
-
-        except TelegramForbiddenError as e:
-            if "bots can't send messages to bots" in str(e):
-                logger.info(
-                    "Клиент %s является ботом, Telegram не разрешает отправлять ему сообщения",
-                    order["user_id"],
-                )
-            else:
-                logger.warning(
-                    "Не удалось отправить сообщение клиенту для заказа %s: %s",
-                    order_id,
-                    e,
-                )
-        except Exception as e:
-            logger.warning(
-                "Не удалось отправить сообщение клиенту для заказа %s: %s",
-                order_id,
-                e,
-            )
 
-        await callback.answer("Статус обновлён")
+async def _order_refresh(callback: CallbackQuery, state: FSMContext, cb: OrderCb) -> None:
+    """Принудительное обновление карточки."""
+    order_id = cb.order
+    try:
+        order = await asyncio.to_thread(get_order, order_id)
+    except DBError:
+        logger.exception("Не удалось загрузить заказ %s при refresh", order_id)
+        await callback.answer("Ошибка загрузки заказа", show_alert=True)
         return
 
-    # ------ назначение курьера ------
-    if action == "setcourier":
-        try:
-            order_id = int(parts[2])
-        except Exception:
-            await callback.answer("Некорректные данные заказа", show_alert=True)
-            return
+    if not order:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
 
-        await state.update_data(order_id_for_courier=order_id)
-        await state.set_state(AdminStates.waiting_courier_name)
-        await callback.answer()
-        await callback.message.reply(
-            "Введите имя/позывной курьера одним сообщением:"
+    _drop_pending_edit(callback.message)
+    try:
+        await callback.message.edit_text(
+            admin_order_text(order),
+            reply_markup=_admin_kb(order),
         )
+    except Exception:
+        logger.exception(
+            "Не удалось обновить карточку заказа %s при refresh", order_id
+        )
+        await callback.answer("Ошибка обновления сообщения", show_alert=True)
         return
 
-    # ------ принудительное обновление карточки ------
-    if action == "refresh":
-        try:
-            order_id = int(parts[2])
-        except Exception:
-            await callback.answer("Некорректные данные заказа", show_alert=True)
-            return
+    await callback.answer("Обновлено")
 
-        try:
-            order = get_order(order_id)
-        except DBError:
-            logger.exception("Не удалось загрузить заказ %s при refresh", order_id)
-            await callback.answer("Ошибка загрузки заказа", show_alert=True)
-            return
 
-        if not order:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
+_ORDER_ACTIONS = {
+    ORDER_SET: _order_set,
+    ORDER_COURIER: _order_ask_courier,
+    ORDER_ASSIGN: _order_assign,
+    ORDER_REFRESH: _order_refresh,
+}
 
-        try:
-            await callback.message.edit_text(
-                _admin_order_text(order),
-                reply_markup=admin_order_kb(
-                    order_id,
-                    order["status"],
-                    has_courier=bool(order.get("courier")),
-                ),
-            )
-        except Exception:
-            logger.exception(
-                "Не удалось обновить карточку заказа %s при refresh", order_id
-            )
-            await callback.answer("Ошибка обновления сообщения", show_alert=True)
-            return
 
-        await callback.answer("Обновлено")
+async def _dispatch_order_action(callback: CallbackQuery, state: FSMContext, cb: OrderCb | None) -> None:
+    if not is_admin_user(callback.from_user.id):
+        await callback.answer("Недостаточно прав", show_alert=True)
+        return
+
+    handler = _ORDER_ACTIONS.get(cb.action) if cb else None
+    if handler is None:
+        await callback.answer("Некорректные данные кнопки", show_alert=True)
         return
+    await handler(callback, state, cb)
+
+
+@router.callback_query(OrderCb.filter(), F.message.chat.type.in_({"group", "supergroup"}))
+async def admin_actions(callback: CallbackQuery, state: FSMContext, callback_data: OrderCb):
+    await _dispatch_order_action(callback, state, callback_data)
+
 
-    # если попало что-то непонятное
-    await callback.answer("Некорректные данные кнопки", show_alert=True)
+@router.callback_query(
+    F.data.startswith("order:"), F.message.chat.type.in_({"group", "supergroup"})
+)
+async def admin_actions_legacy(callback: CallbackQuery, state: FSMContext):
+    # карточки, отправленные до перехода на OrderCb, всё ещё висят в группе
+    await _dispatch_order_action(callback, state, parse_legacy_order(callback.data))
 
 
 @router.message(
@@ -769,44 +1366,233 @@ async def set_courier_name(message: Message, state: FSMContext):
         await message.reply("Имя курьера не может быть пустым. Повторите:")
         return
 
+    known = courier_pool.find_by_name(courier)
     try:
-        set_courier(order_id, courier)
-        order = get_order(order_id)
+        await _assign_courier(
+            message.bot,
+            order_id,
+            courier,
+            known["id"] if known else None,
+            card_chat_id=message.chat.id,
+            actor_id=message.from_user.id,
+        )
     except DBError:
         logger.exception("Не удалось назначить курьера для заказа %s", order_id)
         await message.reply("Ошибка сохранения курьера. Попробуйте ещё раз")
         return
 
-    try:
-        await message.bot.edit_message_text(
-            chat_id=message.chat.id,
-            message_id=order["group_message_id"],
-            text=_admin_order_text(order),
-            reply_markup=admin_order_kb(
-                order_id, order["status"], has_courier=True
-            ),
+    await state.clear()
+    await message.reply(f"Курьер назначен: {courier}")
+
+
+# ----------------- Массовые действия -----------------
+class _BulkList:
+    """Состояние одного сообщения /active: заказы списка и отметки (общие для всех админов)."""
+
+    __slots__ = ("orders", "selected")
+
+    def __init__(self, orders: list):
+        self.orders = orders
+        self.selected: set[int] = set()
+
+    def reload(self, orders: list) -> None:
+        self.orders = orders
+        self.selected &= {o["id"] for o in orders}
+
+    def view(self) -> tuple[str, InlineKeyboardMarkup]:
+        return (
+            active_list_text(self.orders, self.selected, BULK_LIST_LIMIT),
+            bulk_kb(self.orders, self.selected, BULK_LIST_LIMIT),
         )
-    except Exception:
-        pass
 
+
+# (chat_id, message_id) -> _BulkList; держим только последние списки
+_bulk_lists: dict[tuple[int, int], _BulkList] = {}
+_BULK_KEEP = 50
+
+
+def _remember_bulk(message: Message, bulk: _BulkList) -> None:
+    key = (message.chat.id, message.message_id)
+    _bulk_lists.pop(key, None)
+    _bulk_lists[key] = bulk  # в конец: словарь хранит порядок использования
+    while len(_bulk_lists) > _BULK_KEEP:
+        _bulk_lists.pop(next(iter(_bulk_lists)))
+
+
+async def _active_orders(tenant: str | None) -> list:
+    orders = await asyncio.to_thread(get_active_orders)
+    if tenant:
+        orders = [o for o in orders if o.get("branch") == tenant]
+    return orders
+
+
+@router.message(Command("active"), F.chat.type.in_({"group", "supergroup"}))
+async def cmd_active(message: Message, tenant: str | None = None):
+    """Список активных заказов с отметками для массовой смены статуса."""
+    if not is_admin_user(message.from_user.id):
+        await message.answer("Недостаточно прав ❌")
+        return
     try:
-        await message.bot.edit_message_text(
-            chat_id=order["user_id"],
-            message_id=order["user_message_id"],
-            text=_user_order_text(
-                order["user_name"],
-                order["phone"],
-                order["address"],
-                order["items"],
-                status=order["status"],
-                courier=order.get("courier"),
-            ),
+        bulk = _BulkList(await _active_orders(tenant))
+    except DBError:
+        logger.exception("Не удалось загрузить активные заказы")
+        await message.answer("Ошибка загрузки заказов ❌")
+        return
+    text, markup = bulk.view()
+    sent = await message.answer(text, reply_markup=markup)
+    _remember_bulk(sent, bulk)
+
+
+async def _redraw_bulk(callback: CallbackQuery, bulk: _BulkList) -> None:
+    text, markup = bulk.view()
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+
+
+def _bulk_toggle(bulk: _BulkList, cb: BulkCb) -> None:
+    bulk.selected ^= {cb.order}
+
+
+def _bulk_pick(bulk: _BulkList, cb: BulkCb) -> None:
+    status = STATUS_BY_CODE.get(cb.arg)
+    bulk.selected |= {o["id"] for o in bulk.orders if o["status"] == status}
+
+
+def _bulk_clear(bulk: _BulkList, cb: BulkCb) -> None:
+    bulk.selected.clear()
+
+
+def _bulk_refresh(bulk: _BulkList, cb: BulkCb) -> None:
+    # список уже перечитан в bulk_actions
+    pass
+
+
+# Действия с отметками: меняют выбор и перерисовывают список (BULK_APPLY — отдельно)
+_BULK_SELECT = {
+    BULK_TOGGLE: _bulk_toggle,
+    BULK_PICK: _bulk_pick,
+    BULK_CLEAR: _bulk_clear,
+    BULK_REFRESH: _bulk_refresh,
+}
+
+
+@router.callback_query(BulkCb.filter(), F.message.chat.type.in_({"group", "supergroup"}))
+async def bulk_actions(callback: CallbackQuery, callback_data: BulkCb, tenant: str | None = None):
+    if not is_admin_user(callback.from_user.id):
+        await callback.answer("Недостаточно прав", show_alert=True)
+        return
+
+    action = callback_data.action
+    select = _BULK_SELECT.get(action)
+    if select is None and action != BULK_APPLY:
+        await callback.answer("Некорректные данные кнопки", show_alert=True)
+        return
+
+    bulk = _bulk_lists.get((callback.message.chat.id, callback.message.message_id))
+    if bulk is None or action == BULK_REFRESH:
+        # список старше перезапуска бота (или просят обновить) — читаем заново
+        try:
+            orders = await _active_orders(tenant)
+        except DBError:
+            logger.exception("Не удалось загрузить активные заказы")
+            await callback.answer("Ошибка загрузки заказов", show_alert=True)
+            return
+        if bulk is None:
+            bulk = _BulkList(orders)
+            _remember_bulk(callback.message, bulk)
+            if action != BULK_REFRESH:
+                await _redraw_bulk(callback, bulk)
+                await callback.answer("Список обновлён, отметьте заказы заново", show_alert=True)
+                return
+        bulk.reload(orders)
+
+    if select is None:
+        await _bulk_apply(callback, bulk, STATUS_BY_CODE.get(callback_data.arg), tenant)
+        return
+    select(bulk, callback_data)
+    await _redraw_bulk(callback, bulk)
+    await callback.answer()
+
+
+async def _bulk_apply(callback: CallbackQuery, bulk: _BulkList, new_status: str | None, tenant: str | None) -> None:
+    """
+    Переводит отмеченные заказы в new_status пачкой: чтение и смена статуса —
+    по одному запросу на всю пачку, клиенты и карточки обновляются в фоне
+    через полосы с лимитом, а ответ админу приходит сразу.
+    """
+    if new_status is None:
+        await callback.answer("Некорректные данные кнопки", show_alert=True)
+        return
+    if not bulk.selected:
+        await callback.answer("Ничего не отмечено", show_alert=True)
+        return
+
+    actor_id = callback.from_user.id
+    order_ids = sorted(bulk.selected)
+    try:
+        before = {o["id"]: o for o in await asyncio.to_thread(get_orders, order_ids)}
+        changed = await asyncio.to_thread(
+            set_orders_status, sorted(before), new_status, statuses_before(new_status), actor_id=actor_id
         )
-        await message.bot.send_message(
-            order["user_id"], f"Назначен курьер: {courier} 🚚"
+        for order_id in changed:
+            _on_status_changed(before[order_id], new_status, actor_id)
+        await _dispatch_couriers(callback.bot, current_order_ids=set(changed))
+        # перечитываем: автоназначение могло добавить курьеров
+        orders = await asyncio.to_thread(get_orders, changed)
+        bulk.selected.clear()
+        bulk.reload(await _active_orders(tenant))
+    except DBError:
+        logger.exception("Не удалось сменить статус заказов %s", order_ids)
+        await callback.answer("Ошибка обновления статусов", show_alert=True)
+        return
+
+    metrics.inc("bulk.batches")
+    metrics.inc("bulk.orders", len(changed))
+    # статусы в БД уже сменились: карточки и клиенты — до ответов админу,
+    # которые могут упасть (RetryAfter и т.п.)
+    for order in orders:
+        _schedule_card(callback.bot, order)
+    if orders:
+        lifecycle.spawn(_notify_customers(callback.bot, orders))
+
+    skipped = len(before) - len(changed)
+    await callback.answer(
+        f"Обновлено: {len(changed)}" + (f", пропущено: {skipped} (статус уже другой)" if skipped else "")
+    )
+    await _redraw_bulk(callback, bulk)
+
+
+def _schedule_card(bot, order: dict) -> None:
+    """Правка карточки заказа: склеивается с соседними правками и идёт через полосу карточек."""
+    if not order.get("group_message_id"):
+        return
+    bot = bot_for(order.get("branch"), bot)
+    chat_id = admin_group_for(order.get("branch"))
+
+    async def render() -> None:
+        await _card_lane.send(
+            lambda: bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=order["group_message_id"],
+                text=admin_order_text(order),
+                reply_markup=_admin_kb(order),
+            )
         )
-    except Exception:
-        pass
 
-    await state.clear()
-    await message.reply(f"Курьер назначен: {courier}")
+    _edits.schedule((chat_id, order["group_message_id"]), render)
+
+
+async def _notify_customers(bot, orders: list) -> None:
+    """Сообщения клиентам пачки — через полосу уведомлений; id сообщений — одним запросом."""
+    rows = []
+    for order in orders:
+        message_id = await _notify_customer(bot_for(order.get("branch"), bot), order, lane=_notify_lane)
+        if message_id is not None:
+            rows.append({"order_id": order["id"], "user_message_id": message_id})
+    try:
+        await asyncio.to_thread(set_user_message_ids, rows)
+    except DBError:
+        logger.warning("Не удалось сохранить user_message_id для %s заказов", len(rows))
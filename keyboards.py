@@ -1,26 +1,88 @@
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from data import CATEGORY_TITLES, MENU
+
+from branches import (
+    branch_categories,
+    branch_keys,
+    catalog_version,
+    get_branch,
+    get_menu,
+    resolve_key,
+)
+from callbacks import (
+    ORDER_ASSIGN,
+    ORDER_COURIER,
+    ORDER_REFRESH,
+    BULK_APPLY,
+    BULK_CLEAR,
+    BULK_PICK,
+    BULK_REFRESH,
+    BULK_TOGGLE,
+    STATUS_CODES,
+    BranchCb,
+    BulkCb,
+    CategoryCb,
+    DishCb,
+    PageCb,
+    order_action,
+    order_set,
+)
+from render import STATUS_ICONS
+from tracing import traced
 
 # -------- Клиент: старт и категории --------
+@traced("kb.start_kb")
 def start_kb() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="Сделать заказ", callback_data="make_order")
     return kb.as_markup()
 
-def categories_kb() -> InlineKeyboardMarkup:
+@traced("kb.branches_kb")
+def branches_kb() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for key in branch_keys():
+        kb.button(text=get_branch(key)["title"], callback_data=BranchCb(branch=key).pack())
+    kb.button(text="⬅️ Назад", callback_data="back_to_start")
+    kb.adjust(1)
+    return kb.as_markup()
+
+# Клавиатуры каталога строятся один раз на филиал/страницу/версию каталога
+# и переиспользуются; правка меню поднимает версию — и кэш сам становится неактуальным
+@traced("kb.categories_kb")
+def categories_kb(branch: Optional[str] = None) -> InlineKeyboardMarkup:
+    return _categories_kb(resolve_key(branch), catalog_version())
+
+@lru_cache(maxsize=64)
+def _categories_kb(branch: str, version: int) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
-    for key, title in CATEGORY_TITLES.items():
-        kb.button(text=title, callback_data=f"cat:{key}")
+    for key, title in branch_categories(branch).items():
+        kb.button(text=title, callback_data=CategoryCb(cat=key).pack())
+    kb.button(text="🔍 Найти блюдо", switch_inline_query_current_chat="")
     kb.button(text="⬅️ Назад", callback_data="back_to_start")
     kb.adjust(1)
     return kb.as_markup()
 
 # -------- Список блюд (1 колонка, 5 на страницу) --------
-def list_dishes_kb(category_key: str, page: int, page_size: int = 5) -> InlineKeyboardMarkup:
-    dishes_all = MENU.get(category_key, [])
+@traced("kb.list_dishes_kb")
+def list_dishes_kb(
+    category_key: str, page: int, page_size: int = 5, branch: Optional[str] = None
+) -> InlineKeyboardMarkup:
+    branch = resolve_key(branch)
+    dishes_all = get_menu(branch).get(category_key, [])
     total_pages = max(1, (len(dishes_all) + page_size - 1) // page_size)
     page = max(0, min(page, total_pages - 1))
+    return _list_dishes_kb(branch, catalog_version(), category_key, page, page_size)
+
+@lru_cache(maxsize=1024)
+def _list_dishes_kb(
+    branch: str, version: int, category_key: str, page: int, page_size: int
+) -> InlineKeyboardMarkup:
+    dishes_all = get_menu(branch).get(category_key, [])
+    total_pages = max(1, (len(dishes_all) + page_size - 1) // page_size)
 
     start = page * page_size
     dishes = dishes_all[start:start + page_size]
@@ -29,14 +91,14 @@ def list_dishes_kb(category_key: str, page: int, page_size: int = 5) -> InlineKe
     for d in dishes:
         kb.button(
             text=f"{d['name']} — {d['price']}₽",
-            callback_data=f"dish:{category_key}:{d['id']}:{page}"  # нажал — сразу +1 в корзину
+            callback_data=DishCb(cat=category_key, dish=d["id"], page=page).pack(),  # нажал — сразу +1 в корзину
         )
     kb.adjust(1)
 
     kb.row(
-        InlineKeyboardButton(text="◀️", callback_data=f"page:{category_key}:{page-1}"),
+        InlineKeyboardButton(text="◀️", callback_data=PageCb(cat=category_key, page=page - 1).pack()),
         InlineKeyboardButton(text=f"{page+1}/{total_pages}", callback_data="noop"),
-        InlineKeyboardButton(text="▶️", callback_data=f"page:{category_key}:{page+1}")
+        InlineKeyboardButton(text="▶️", callback_data=PageCb(cat=category_key, page=page + 1).pack())
     )
     kb.row(
         InlineKeyboardButton(text="🛒 Открыть корзину", callback_data="show_cart"),
@@ -45,6 +107,7 @@ def list_dishes_kb(category_key: str, page: int, page_size: int = 5) -> InlineKe
     return kb.as_markup()
 
 # -------- Корзина: только действия (без +/-) --------
+@traced("kb.cart_kb")
 def cart_kb(_cart=None) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.row(
@@ -55,6 +118,7 @@ def cart_kb(_cart=None) -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+@traced("kb.post_order_kb")
 def post_order_kb(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -88,14 +152,76 @@ _NEXT_BY_STATUS = {
     "canceled": [],
 }
 
-def admin_order_kb(order_id: int, status: str, has_courier: bool) -> InlineKeyboardMarkup:
+def next_statuses(status: str) -> list:
+    """Куда можно перевести заказ из статуса `status`."""
+    return _NEXT_BY_STATUS.get(status, [])
+
+
+def statuses_before(status: str) -> list:
+    """Из каких статусов можно перейти в `status`."""
+    return [s for s, nxt in _NEXT_BY_STATUS.items() if status in nxt]
+
+
+@traced("kb.admin_order_kb")
+def admin_order_kb(
+    order_id: int, status: str, has_courier: bool, suggested_courier: Optional[dict] = None
+) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     for s in _NEXT_BY_STATUS.get(status, []):
-        kb.button(text=_STATUS_TITLES_RU[s], callback_data=f"order:set:{order_id}:{s}")
+        kb.button(text=_STATUS_TITLES_RU[s], callback_data=order_set(order_id, s))
     if status in ("ready", "handoff", "onway") and not has_courier:
-        kb.button(text="🚚 Назначить курьера", callback_data=f"order:setcourier:{order_id}")
+        if suggested_courier:
+            kb.button(
+                text=f"🚚 {suggested_courier['name']}",
+                callback_data=order_action(ORDER_ASSIGN, order_id, str(suggested_courier["id"])),
+            )
+        kb.button(text="🚚 Назначить курьера", callback_data=order_action(ORDER_COURIER, order_id))
     if status not in ("delivered", "canceled"):
-        kb.button(text="❌ Отменить", callback_data=f"order:set:{order_id}:canceled")
-    kb.button(text="🔁 Обновить", callback_data=f"order:refresh:{order_id}")
+        kb.button(text="❌ Отменить", callback_data=order_set(order_id, "canceled"))
+    kb.button(text="🔁 Обновить", callback_data=order_action(ORDER_REFRESH, order_id))
     kb.adjust(2)
     return kb.as_markup()
+
+
+@traced("kb.bulk_kb")
+def bulk_kb(orders: list, selected: set, limit: int) -> InlineKeyboardMarkup:
+    """
+    Список активных заказов с отметками: кнопки первых `limit` заказов,
+    ряд «отметить все в статусе» и ряд переходов, общих для всех отмеченных
+    (оба — по всему списку, включая не поместившиеся заказы), и сервисные кнопки.
+    """
+    kb = InlineKeyboardBuilder()
+    for o in orders[:limit]:
+        mark = "☑️" if o["id"] in selected else "⬜️"
+        kb.button(
+            text=f"{mark} #{o['id']} {STATUS_ICONS.get(o['status'], '')} {o.get('total') or 0}₽",
+            callback_data=BulkCb(action=BULK_TOGGLE, order=o["id"]).pack(),
+        )
+    kb.adjust(2)
+
+    counts = Counter(o["status"] for o in orders)
+    kb.row(
+        *(
+            InlineKeyboardButton(
+                text=f"☑️ {STATUS_ICONS.get(s, s)} {n}",
+                callback_data=BulkCb(action=BULK_PICK, arg=STATUS_CODES[s]).pack(),
+            )
+            for s, n in counts.items()
+        ),
+        width=4,
+    )
+
+    picked = [o["status"] for o in orders if o["id"] in selected]
+    common = set.intersection(*(set(next_statuses(s)) for s in picked)) if picked else set()
+    for s in (s for s in _STATUS_TITLES_RU if s in common):
+        kb.row(
+            InlineKeyboardButton(
+                text=f"→ {_STATUS_TITLES_RU[s]} ({len(picked)})",
+                callback_data=BulkCb(action=BULK_APPLY, arg=STATUS_CODES[s]).pack(),
+            )
+        )
+    kb.row(
+        InlineKeyboardButton(text="✖️ Снять отметки", callback_data=BulkCb(action=BULK_CLEAR).pack()),
+        InlineKeyboardButton(text="🔁 Обновить", callback_data=BulkCb(action=BULK_REFRESH).pack()),
+    )
+    return kb.as_markup()
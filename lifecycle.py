@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import metrics
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DrainHook = Callable[[], Awaitable[None]]
+
+
+class Lifecycle:
+    """
+    Учёт всего, что нужно доделать перед остановкой процесса.
+
+    - middleware() считает апдейты в обработке и в режиме остановки
+      перестаёт пускать новые (кроме оплат). Режим остановки включает drain(),
+      когда polling уже остановлен и новых апдейтов быть не должно;
+    - spawn() запускает фоновую задачу (отложенная отправка, склейка нажатий),
+      которую остановка обязательно дождётся;
+    - on_drain() регистрирует хук: сбросить буферы, отправить отложенные правки и т.п.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._in_flight = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._hooks: List[DrainHook] = []
+
+    # ----- учёт работы -----
+    def middleware(self) -> BaseMiddleware:
+        return _InFlightMiddleware(self)
+
+    def spawn(self, coro: Awaitable[Any]) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def on_drain(self, hook: DrainHook) -> None:
+        self._hooks.append(hook)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def busy(self) -> bool:
+        return self._in_flight > 0 or bool(self._tasks)
+
+    # ----- остановка -----
+    def begin_drain(self) -> None:
+        if not self.draining:
+            logger.info("Режим остановки: новые апдейты больше не принимаются")
+        self.draining = True
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Дожидается начатых обработчиков и фоновых задач, затем вызывает хуки.
+        Всё вместе укладывается в `timeout` секунд.
+        """
+        deadline = time.monotonic() + timeout
+        # апдейты, которые polling успел получить, уже запущены задачами —
+        # даём им войти в middleware до того, как он перестанет пускать
+        await asyncio.sleep(0)
+        self.begin_drain()
+
+        while self.busy and time.monotonic() < deadline:
+            if self._tasks:
+                await asyncio.wait(
+                    set(self._tasks),
+                    timeout=min(0.1, max(0.0, deadline - time.monotonic())),
+                )
+            else:
+                await asyncio.sleep(0.05)
+
+        for hook in self._hooks:
+            remaining = deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(hook(), timeout=max(remaining, 0.5))
+            except Exception:
+                logger.exception("Хук остановки %r завершился ошибкой", hook)
+
+        # хуки могли породить новые отправки — даём им оставшееся время
+        if self._tasks:
+            await asyncio.wait(
+                set(self._tasks), timeout=max(0.0, deadline - time.monotonic())
+            )
+
+        if self.busy:
+            logger.warning(
+                "Остановка по таймауту: в обработке %s апдейт(ов), %s фоновых задач",
+                self._in_flight,
+                len(self._tasks),
+            )
+        else:
+            logger.info("Все начатые обработчики и отправки завершены")
+
+
+def _is_payment(event: TelegramObject) -> bool:
+    """
+    Оплата: деньги уже списаны (successful_payment) или Telegram ждёт
+    подтверждения (pre_checkout_query) — такие апдейты обрабатываем и при остановке.
+    """
+    if not isinstance(event, Update):
+        return False
+    return event.pre_checkout_query is not None or (
+        event.message is not None and event.message.successful_payment is not None
+    )
+
+
+class _InFlightMiddleware(BaseMiddleware):
+    def __init__(self, lifecycle: Lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        lc = self.lifecycle
+        if lc.draining and not _is_payment(event):
+            metrics.inc("lifecycle.rejected")
+            return None
+
+        lc._in_flight += 1
+        metrics.set_gauge("updates.in_flight", lc._in_flight)
+        try:
+            return await handler(event, data)
+        finally:
+            lc._in_flight -= 1
+            metrics.set_gauge("updates.in_flight", lc._in_flight)
+
+
+# Общий на процесс экземпляр
+lifecycle = Lifecycle()
@@ -0,0 +1,393 @@
+"""
+Нагрузочный прогон настоящих хендлеров без сети.
+
+Бот работает на fake_telegram.FakeTelegram, база — fake_supabase.FakeSupabase
+(SQLite в памяти). Каждый виртуальный клиент проходит весь путь:
+/start -> меню -> N нажатий на блюда -> оформление -> комментарий,
+после чего «админ» в группе проводит заказ по всем статусам до доставки —
+по одному (кнопками карточки) или, с --bulk, пачками из списка /active.
+Адреса у клиентов разные: улицы в разной записи (с городом, квартирой,
+опечаткой, началом названия) и геолокация — зону каждого заказа сверяем
+со справочником, который прогон кладёт во временный ZONES_FILE.
+Оплату играет fake_payments.FakePayments: треть клиентов платит картой сразу
+(часть — сначала с неверной суммой), у трети деньги списываются уже во время
+остановки бота, остальные платят наличными и после доставки пробуют
+оплатить устаревший счёт.
+В конце — пропускная способность, задержки апдейтов и проверка,
+что в базе ровно то, что должно было получиться.
+
+Запуск:
+  python load_test.py --users 200 --concurrency 50 --taps 3 \\
+      --tg-latency 0.02 0.08 --db-latency 0.005 0.02 --tg-errors 0.01 --db-errors 0.01
+
+Антифлуд и лимиты полос уведомлений по умолчанию ослаблены (THROTTLE_RATE,
+NOTIFY_RATE, CARD_EDIT_RATE=1000): клиенты здесь нажимают быстрее людей.
+С --prod-limits остаются боевые значения из config (или из окружения),
+а клиенты и админы действуют не чаще, чем пропускает антифлуд;
+апдейтов в секунду тогда меньше — это темп живых людей, а не предел бота.
+Статусы в этом режиме проводят несколько админов (если ADMIN_IDS не задан),
+с --bulk прогон заметно короче.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Справочник зон для прогона: улица или геохеш-ячейка -> зона
+_ZONES = (
+    ("street", "Ленина", "center"),
+    ("street", "Пушкина", "center"),
+    ("street", "Гагарина", "north"),
+    ("street", "Мира", "north"),
+    ("street", "8 Марта", "south"),
+    ("geohash", "ucfv0", "center"),
+)
+# (адрес, зона) — та же улица в разной записи
+_ADDRESSES = (
+    ("ул. Ленина, {house}", "center"),
+    ("г. Москва, ул. Пушкина {house}, кв {flat}", "center"),
+    ("Гагарина {house}", "north"),
+    ("проспект Мира, д. {house}, подъезд 2", "north"),
+    ("8 Марта {house}", "south"),
+    ("ул. Гагрина, {house}", "north"),  # опечатка
+    ("Пушк {house}", "center"),        # начало названия
+)
+# точка внутри ячейки ucfv0
+_LOCATION = (55.7558, 37.6173, "center")
+
+# До импорта config: своя админ-группа, справочник зон, частый сброс буферов
+# и, если не просили боевых лимитов, без антифлуда
+PROD_LIMITS = "--prod-limits" in sys.argv
+os.environ.setdefault("ADMIN_GROUP_ID", "-100100")
+if not PROD_LIMITS:
+    os.environ.setdefault("THROTTLE_RATE", "1000")
+    os.environ.setdefault("THROTTLE_BURST", "1000")
+    os.environ.setdefault("NOTIFY_RATE", "1000")
+    os.environ.setdefault("CARD_EDIT_RATE", "1000")
+os.environ.setdefault("EVENTS_FLUSH_INTERVAL", "0.5")
+os.environ.setdefault("PAYMENTS_PROVIDER_TOKEN", "123:TEST:load-test")
+_temp_zones: Optional[str] = None
+if "ZONES_FILE" not in os.environ:
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", delete=False) as _zones_file:
+        _zones_file.write("kind,key,zone\n" + "".join(f"{k},{key},{z}\n" for k, key, z in _ZONES))
+    os.environ["ZONES_FILE"] = _temp_zones = _zones_file.name
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import db  # noqa: E402
+import metrics  # noqa: E402
+from branches import branch_categories, get_menu  # noqa: E402
+from callbacks import (  # noqa: E402
+    BULK_APPLY,
+    BULK_PICK,
+    STATUS_CODES,
+    BulkCb,
+    CategoryCb,
+    CommentCb,
+    DishCb,
+    order_set,
+)
+from config import ADMIN_GROUP_ID, ADMIN_IDS, THROTTLE_RATE  # noqa: E402
+from data import DEFAULT_BRANCH  # noqa: E402
+from events import event_log  # noqa: E402
+from fake_payments import FakePayments  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from handlers import router  # noqa: E402
+from lifecycle import lifecycle  # noqa: E402
+from payments import payments  # noqa: E402
+from tenants import TenantMiddleware  # noqa: E402
+from tracing import TracedStorage, tracer  # noqa: E402
+from watchdog import watchdog  # noqa: E402
+
+# пустой ADMIN_IDS — админ любой; с боевым антифлудом статусы проводят несколько человек
+ADMINS = sorted(ADMIN_IDS) or list(range(777, 787 if PROD_LIMITS else 778))
+ADMIN_ID = ADMINS[0]
+_STATUS_PATH = ("preparing", "ready", "handoff", "onway", "delivered")
+_ids = itertools.count(1)
+
+
+class Driver:
+    def __init__(self, bot: Bot, dp: Dispatcher, pace: float = 0.0):
+        self.bot = bot
+        self.dp = dp
+        # пауза между действиями одного пользователя (0 — без пауз)
+        self.pace = pace
+        self._turns: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.failures: Counter = Counter()
+
+    async def _wait_turn(self, uid: int) -> None:
+        if not self.pace:
+            return
+        now = time.monotonic()
+        turn = max(now, self._turns.get(uid, 0.0))
+        self._turns[uid] = turn + self.pace
+        if turn > now:
+            await asyncio.sleep(turn - now)
+
+    # ----- сборка апдейтов -----
+    def _user(self, uid: int) -> Dict[str, Any]:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}
+
+    def _message(self, chat_id: int, uid: int, text: str) -> Dict[str, Any]:
+        return {
+            "message_id": next(_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": self._user(uid),
+            "text": text,
+        }
+
+    async def _feed(self, kind: str, payload: Dict[str, Any]) -> None:
+        update = Update.model_validate({"update_id": next(_ids), kind: payload}, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as exc:
+            self.failures[type(exc).__name__] += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    async def send(self, uid: int, text: str, chat_id: int | None = None) -> None:
+        await self._wait_turn(uid)
+        await self._feed("message", self._message(chat_id or uid, uid, text))
+
+    async def send_location(self, uid: int, lat: float, lon: float) -> None:
+        await self._wait_turn(uid)
+        message = self._message(uid, uid, "")
+        del message["text"]
+        message["location"] = {"latitude": lat, "longitude": lon}
+        await self._feed("message", message)
+
+    async def tap(self, uid: int, data: str, chat_id: int | None = None, message_id: int | None = None) -> None:
+        await self._wait_turn(uid)
+        chat_id = chat_id or uid
+        message = self._message(chat_id, self.bot.id, "…")
+        if message_id:
+            message["message_id"] = message_id
+        message["from"] = {"id": self.bot.id, "is_bot": True, "first_name": "FakeBot"}
+        await self._feed(
+            "callback_query",
+            {"id": str(next(_ids)), "from": self._user(uid), "chat_instance": str(chat_id),
+             "message": message, "data": data},
+        )
+
+    # ----- сценарии -----
+    async def customer(self, uid: int, taps: int, rnd: random.Random) -> Tuple[int, Optional[str]]:
+        """Проходит оформление; возвращает ожидаемые сумму и зону заказа."""
+        menu = get_menu(DEFAULT_BRANCH)
+        category = rnd.choice(list(branch_categories(DEFAULT_BRANCH)))
+        await self.send(uid, "/start")
+        await self.tap(uid, "make_order")
+        await self.tap(uid, CategoryCb(cat=category).pack())
+        total = 0
+        for _ in range(taps):
+            dish = rnd.choice(menu[category])
+            total += dish["price"]
+            await self.tap(uid, DishCb(cat=category, dish=dish["id"], page=0).pack())
+        await self.tap(uid, "checkout")
+        await self.send(uid, f"Клиент {uid}")
+        await self.send(uid, f"+7900{uid:07d}")
+        if rnd.random() < 0.15:
+            lat, lon, zone = _LOCATION
+            await self.send_location(uid, lat, lon)
+        else:
+            address, zone = rnd.choice(_ADDRESSES)
+            await self.send(uid, address.format(house=rnd.randint(1, 120), flat=rnd.randint(1, 300)))
+        await self.tap(uid, CommentCb(topic="delivery").pack())
+        await self.send(uid, "позвонить за 5 минут")
+        return total, zone
+
+    async def admin(self, order_id: int) -> None:
+        admin_id = ADMINS[order_id % len(ADMINS)]
+        for status in _STATUS_PATH:
+            await self.tap(admin_id, order_set(order_id, status), chat_id=ADMIN_GROUP_ID)
+
+    async def admin_bulk(self, store: FakeSupabase) -> int:
+        """Проводит все заказы пачками через /active; возвращает число пачек."""
+        batches = 0
+        for previous, status in zip(("new",) + _STATUS_PATH, _STATUS_PATH):
+            while store.query("select count(*) as n from orders where status = ?", previous)[0]["n"]:
+                await self.send(ADMIN_ID, "/active", chat_id=ADMIN_GROUP_ID)
+                list_id = self.bot.session.last_message_id(ADMIN_GROUP_ID)
+                for action, code in ((BULK_PICK, STATUS_CODES[previous]), (BULK_APPLY, STATUS_CODES[status])):
+                    await self.tap(ADMIN_ID, BulkCb(action=action, arg=code).pack(),
+                                   chat_id=ADMIN_GROUP_ID, message_id=list_id)
+                batches += 1
+        return batches
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+
+async def run(args: argparse.Namespace) -> int:
+    rnd = random.Random(args.seed)
+    store = FakeSupabase(latency=tuple(args.db_latency), error_rate=args.db_errors, seed=args.seed)
+    db.set_client(store)
+    telegram = FakeTelegram(latency=tuple(args.tg_latency), error_rate=args.tg_errors, seed=args.seed)
+    telegram.middleware(tracer.request_middleware())
+    bot = Bot(token="123456:FAKE", session=telegram)
+
+    dp = Dispatcher(storage=TracedStorage(MemoryStorage()))
+    dp.update.outer_middleware(lifecycle.middleware())
+    dp.update.outer_middleware(tracer.middleware())
+    dp.update.outer_middleware(TenantMiddleware())
+    dp.update.outer_middleware(watchdog.middleware())
+    dp.include_router(router)
+    event_log.start()
+    watchdog.start()
+    tracer.start()
+    payments.start()
+
+    # с боевым антифлудом действуем чуть медленнее, чем он пропускает
+    driver = Driver(bot, dp, pace=1.1 / THROTTLE_RATE if args.prod_limits else 0.0)
+    cashier = FakePayments(bot, dp)
+    gate = asyncio.Semaphore(args.concurrency)
+    expected: Dict[int, int] = {}
+    zones: Dict[int, Optional[str]] = {}
+    users = [10_000 + i for i in range(args.users)]
+
+    async def one(uid: int) -> None:
+        async with gate:
+            expected[uid], zones[uid] = await driver.customer(uid, args.taps, random.Random(rnd.random()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(uid) for uid in users))
+    customers_done = time.perf_counter()
+
+    orders = {row["user_id"]: row["id"] for row in store.query("select id, user_id from orders")}
+
+    # ----- оплата: сразу / списание во время остановки / наличными -----
+    problems: List[str] = []
+    paid: set = set()
+    pay_on_drain: List[Dict[str, Any]] = []
+    stale: List[Dict[str, Any]] = []
+
+    async def payment_step(step: Any) -> Any:
+        try:
+            return await step
+        except Exception as exc:
+            driver.failures[type(exc).__name__] += 1
+            return "исключение в хендлере"
+
+    for uid in users:
+        invoices = cashier.invoices(uid)
+        if not invoices:
+            continue
+        invoice = invoices[-1]
+        if uid % 3 == 0:
+            if uid % 2 == 0:
+                wrong = await payment_step(cashier.pre_checkout(invoice, amount=cashier._amount(invoice) + 100))
+                if wrong is None:
+                    problems.append(f"оплата клиента {uid} с неверной суммой прошла")
+            if await payment_step(cashier.pay(invoice)) is None:
+                paid.add(uid)
+        elif uid % 3 == 1:
+            if await payment_step(cashier.pre_checkout(invoice)) is None:
+                pay_on_drain.append(invoice)
+        else:
+            stale.append(invoice)
+
+    async def process(order_id: int) -> None:
+        async with gate:
+            await driver.admin(order_id)
+
+    if args.bulk:
+        batches = await driver.admin_bulk(store)
+    else:
+        await asyncio.gather(*(process(order_id) for order_id in orders.values()))
+    finished = time.perf_counter()
+
+    # при остановке платёжные апдейты должны доходить до хендлеров
+    lifecycle.begin_drain()
+    for invoice in pay_on_drain:
+        await payment_step(cashier.successful_payment(invoice))
+        paid.add(int(invoice["chat_id"]))
+    for invoice in stale:
+        # заказ доставлен и оплачен наличными — счёт закрыт
+        if await payment_step(cashier.pre_checkout(invoice)) is None:
+            problems.append(f"устаревший счёт клиента {invoice['chat_id']} принят к оплате")
+    await lifecycle.drain(10)
+
+    # ----- проверки -----
+    missing = set(users) - set(orders)
+    if missing:
+        problems.append(f"нет заказа у {len(missing)} клиентов")
+    for row in store.query("select user_id, total, status, zone from orders"):
+        if row["total"] != expected.get(row["user_id"]):
+            problems.append(f"сумма заказа клиента {row['user_id']}: {row['total']} вместо {expected.get(row['user_id'])}")
+        if row["zone"] != zones.get(row["user_id"]):
+            problems.append(f"зона заказа клиента {row['user_id']}: {row['zone']} вместо {zones.get(row['user_id'])}")
+        if row["status"] != "delivered":
+            problems.append(f"заказ клиента {row['user_id']} в статусе {row['status']}")
+    events = store.query("select count(*) as n from order_events")[0]["n"]
+    expected_events = len(orders) * (len(_STATUS_PATH) + 1)
+    if events < expected_events:
+        problems.append(f"событий в журнале {events}, ожидалось не меньше {expected_events}")
+    limited = metrics.snapshot()["counters"].get("throttle.limited", 0)
+    if args.prod_limits and limited:
+        problems.append(f"антифлуд придержал {limited} апдейтов при темпе не выше лимита")
+    marked = {row["user_id"] for row in store.query("select user_id from orders where paid_at is not null")}
+    if marked != paid:
+        problems.append(f"оплачено {len(paid)} заказов, отмечено в базе {len(marked)}, расходятся {len(marked ^ paid)}")
+
+    # ----- отчёт -----
+    updates = len(driver.latencies)
+    print(f"клиентов {args.users}, заказов {len(orders)}, апдейтов {updates}, "
+          f"лимиты {'боевые' if args.prod_limits else 'ослаблены'}")
+    print(f"оформление  {customers_done - started:7.2f} с   статусы {finished - customers_done:7.2f} с   "
+          f"≈ {updates / (finished - started):.0f} апдейтов/с")
+    print(f"задержка апдейта  p50 {_percentile(driver.latencies, 0.5):.1f} мс   "
+          f"p95 {_percentile(driver.latencies, 0.95):.1f} мс   p99 {_percentile(driver.latencies, 0.99):.1f} мс")
+    print(f"Bot API: {sum(telegram.counts.values())} вызовов, ошибок подмешано {telegram.injected_errors}: "
+          + ", ".join(f"{k}={v}" for k, v in telegram.counts.most_common()))
+    print(f"оплата: картой {len(paid)} (из них при остановке {len(pay_on_drain)}), "
+          f"попыток оплатить закрытый счёт {len(stale)}")
+    if args.bulk:
+        print(f"статусы пачками: {batches} пачек на {len(orders)} заказов")
+    print(f"БД: {store.requests} запросов, ошибок подмешано {store.injected_errors}")
+    if driver.failures:
+        print("исключения в хендлерах:", dict(driver.failures))
+    counters = metrics.snapshot()["counters"]
+    print("метрики:", {k: v for k, v in sorted(counters.items()) if k.startswith(("db.", "throttle.", "events.", "loop.", "trace.", "bulk.", "outbound.", "payments."))})
+
+    for problem in problems[:20]:
+        print("✗", problem)
+    if not problems:
+        print("✓ все заказы созданы, суммы сходятся, все доставлены, оплаты отмечены")
+    return 1 if problems else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--taps", type=int, default=3)
+    parser.add_argument("--tg-latency", type=float, nargs=2, default=[0.0, 0.0], metavar=("MIN", "MAX"))
+    parser.add_argument("--db-latency", type=float, nargs=2, default=[0.0, 0.0], metavar=("MIN", "MAX"))
+    parser.add_argument("--tg-errors", type=float, default=0.0)
+    parser.add_argument("--db-errors", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bulk", action="store_true", help="статусы пачками через /active")
+    parser.add_argument("--prod-limits", action="store_true",
+                        help="боевые антифлуд и лимиты полос, клиенты в темпе людей")
+    try:
+        code = asyncio.run(run(parser.parse_args()))
+    finally:
+        if _temp_zones:
+            os.unlink(_temp_zones)
+    raise SystemExit(code)
+
+
+if __name__ == "__main__":
+    main()
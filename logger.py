@@ -1,34 +1,144 @@
+import atexit
+import copy
+import gzip
+import hashlib
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import re
+import shutil
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from typing import Optional
 
+from config import BOT_TOKEN, LOG_FILE, LOG_HASH_KEY, LOG_RETENTION_DAYS
+
 _LOGGER_CONFIGURED = False
+_FORMAT = "%(asctime)s %(levelname)s [%(name)s]: %(message)s"
+
+# ----- Маскировка персональных данных и секретов -----
+# Ключ хэша id пользователей: без ключа короткий Telegram id перебирается за минуты
+_HASH_KEY = hashlib.sha256((LOG_HASH_KEY or BOT_TOKEN or "").encode()).digest()
+
+_USER_ID = re.compile(
+    r"(?P<pre>\b(?:user_id|chat_id|from_user|user)\b[\s=:>]+"
+    r"|tg://user\?id="
+    r"|\b[Кк]лиент[а-я]*\s+"
+    r"|\b[Пп]ользовател[а-я]*\s+)"
+    r"(?P<id>\d{5,})"
+)
+_SECRETS = (
+    # токен бота: 123456789:AA…
+    (re.compile(r"(?<!\d)\d{6,12}:[A-Za-z0-9_-]{30,}"), "<bot-token>"),
+    # токен платёжного провайдера: 123:TEST:… / 123:LIVE:…
+    (re.compile(r"\b\d+:(?:TEST|LIVE):[\w-]+"), "<provider-token>"),
+    # ключи Supabase: JWT и новые sb_secret_… / sb_publishable_…
+    (re.compile(r"\beyJ[\w-]{8,}\.[\w-]{8,}\.[\w-]+"), "<jwt>"),
+    (re.compile(r"\bsb_(?:secret|publishable)_[\w-]+"), "<supabase-key>"),
+    (re.compile(r"(?i)\b(apikey|access_token|token)=[^&\s\"']+"), r"\1=<redacted>"),
+    # адрес проекта Supabase
+    (re.compile(r"\b[a-z0-9]{20}\.supabase\.co\b"), "<project>.supabase.co"),
+    # телефоны: +7 900 123-45-67, 8(900)1234567, +998 90 123 45 67
+    (
+        re.compile(r"(?<![\w+])(?:\+\d{1,3}[\s(-]*\d{2,3}|8[\s(-]*\d{3})[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)"),
+        "<phone>",
+    ),
+)
+
+
+def _hash_user(match: "re.Match[str]") -> str:
+    digest = hashlib.blake2b(match["id"].encode(), digest_size=5, key=_HASH_KEY).hexdigest()
+    return f"{match['pre']}u:{digest}"
+
+
+def redact(text: str) -> str:
+    """Маскирует телефоны и секреты, заменяет id пользователей стабильным хэшем."""
+    text = _USER_ID.sub(_hash_user, text)
+    for pattern, replacement in _SECRETS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactingFormatter(logging.Formatter):
+    """
+    Маскирует сообщение и трейсбек, но не время и имя логгера.
+    Работает в потоке QueueListener, поэтому хендлеры бота за неё не платят.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        record = copy.copy(record)
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = redact(self.formatException(record.exc_info))
+        if record.stack_info:
+            record.stack_info = redact(record.stack_info)
+        return super().format(record)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    В потоке вызова — только подстановка аргументов в сообщение
+    (объекты могут измениться позже). Трейсбек, маскировка и запись
+    на диск — в потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# ----- Ротация -----
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
 
 
-def _configure_logging(log_file: Optional[str] = "bot.log") -> None:
+def _file_handler(log_file: str) -> logging.Handler:
+    """Новый файл каждую полночь, старые сжимаются и хранятся LOG_RETENTION_DAYS дней."""
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = TimedRotatingFileHandler(
+        log_file,
+        when="midnight",
+        backupCount=LOG_RETENTION_DAYS,
+        encoding="utf-8",
+    )
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def _configure_logging(log_file: Optional[str] = LOG_FILE) -> None:
     global _LOGGER_CONFIGURED
     if _LOGGER_CONFIGURED:
         return
 
-    # Базовая конфигурация: логируем и в файл, и в консоль
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s %(levelname)s [%(name)s]: %(message)s",
-    )
-
+    # Консоль и файл пишет отдельный поток; логгеры только кладут записи в очередь
+    formatter = RedactingFormatter(_FORMAT)
+    handlers = [logging.StreamHandler()]
     if log_file:
-        handler = RotatingFileHandler(
-            log_file,
-            maxBytes=1_000_000,   # ~1 МБ
-            backupCount=3,        # до 3 архивов
-            encoding="utf-8",
-        )
+        handlers.append(_file_handler(log_file))
+    for handler in handlers:
         handler.setLevel(logging.INFO)
-        formatter = logging.Formatter(
-            "%(asctime)s %(levelname)s [%(name)s]: %(message)s"
-        )
         handler.setFormatter(formatter)
-        logging.getLogger().addHandler(handler)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # при выходе дописываем всё, что осталось в очереди
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(_DeferredQueueHandler(log_queue))
 
     _LOGGER_CONFIGURED = True
 
@@ -36,7 +146,7 @@ def _configure_logging(log_file: Optional[str] = "bot.log") -> None:
 def get_logger(name: str) -> logging.Logger:
     """
     Возвращает настроенный логгер.
-    Первый вызов настраивает логирование (консоль + файл bot.log).
+    Первый вызов настраивает логирование (консоль + файл LOG_FILE через фоновый поток).
     """
     _configure_logging()
     return logging.getLogger(name)
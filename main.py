@@ -1,29 +1,117 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
+import signal
+from contextlib import suppress
+
+from aiogram import Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
+import db
+from broadcast import broadcast
+from branches import MENU_OVERRIDES_KEY, load_overrides
+from capacity import capacity
+from eta import estimator
+from couriers import reload_pool
+from events import event_log
+from config import DRAIN_TIMEOUT, check_required
 from handlers import router
+from settings import settings
+from lifecycle import lifecycle
+from payments import payments
+from tenants import TenantMiddleware, create_bots
+from tracing import TracedStorage, tracer
+from watchdog import watchdog
+
+
+async def _warm_up_db() -> None:
+    # Синхронный клиент — прогреваем в отдельном потоке, не блокируя цикл
+    try:
+        await asyncio.to_thread(db.warm_up)
+    except db.DBError:
+        logging.warning("Не удалось прогреть соединение с БД, подключимся при первом запросе")
+        return
+
+    # Все настройки одним запросом; правки меню применяются через подписку
+    try:
+        await settings.load()
+    except db.DBError:
+        logging.warning("Не удалось загрузить настройки, используем значения по умолчанию")
+
+    # Активные заказы — одним запросом для контроля загрузки и пула курьеров
+    try:
+        active_orders = await asyncio.to_thread(db.get_active_orders)
+    except db.DBError:
+        logging.warning("Не удалось загрузить активные заказы, счётчики загрузки начнутся с нуля")
+        return
+    capacity.seed(active_orders)
+    estimator.seed(active_orders)
+    payments.seed(active_orders)
+
+    try:
+        await asyncio.to_thread(reload_pool, active_orders)
+    except db.DBError:
+        logging.warning("Не удалось загрузить курьеров, подсказки по назначению отключены")
+
+
+def _install_signal_handlers(dp: Dispatcher) -> None:
+    """
+    SIGTERM/SIGINT: сначала останавливаем polling — новые апдейты больше
+    не забираются, а уже полученные доходят до хендлеров (их offset Telegram
+    уже подтвердил, отказ в обработке потерял бы их). Незабранные апдейты
+    Telegram отдаст после перезапуска. Доделывание начатого — в main()
+    после выхода из start_polling.
+    """
+    loop = asyncio.get_running_loop()
+
+    def _on_signal(sig: signal.Signals) -> None:
+        logging.warning("Получен сигнал %s, останавливаем polling", sig.name)
+        asyncio.ensure_future(dp.stop_polling())
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # На Windows сигналы в цикле не поддерживаются
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, _on_signal, sig)
 
 
 async def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    check_required()
 
-
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher(storage=MemoryStorage())
+    # Одна HTTP-сессия на всех ботов: общий пул соединений к api.telegram.org
+    session = AiohttpSession()
+    session.middleware(tracer.request_middleware())
+    bots = create_bots(session)
+    dp = Dispatcher(storage=TracedStorage(MemoryStorage()))
+    dp.update.outer_middleware(lifecycle.middleware())
+    dp.update.outer_middleware(tracer.middleware())
+    dp.update.outer_middleware(TenantMiddleware())
+    dp.update.outer_middleware(watchdog.middleware())
     dp.include_router(router)
 
-    logging.info("Бот запускается…")
-
+    logging.info("Бот запускается… (ботов: %s)", len(bots))
+    _install_signal_handlers(dp)
+    settings.on_change(MENU_OVERRIDES_KEY, load_overrides)
+    event_log.start()
+    settings.start()
+    payments.start()
+    watchdog.start()
+    tracer.start()
 
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        # Сброс вебхука и прогрев БД — параллельно. Апдейты, пришедшие во время
+        # перезапуска (в том числе оплаты), не выбрасываем — их заберёт polling
+        await asyncio.gather(
+            *(bot.delete_webhook() for bot in bots),
+            _warm_up_db(),
+        )
+        # незавершённая рассылка продолжается с сохранённого места
+        await broadcast.resume(bots[0])
+        # Сессию закрываем сами: после polling ещё нужно доотправить сообщения
+        await dp.start_polling(*bots, handle_signals=False, close_bot_session=False)
     finally:
-        await bot.session.close()
+        await lifecycle.drain(DRAIN_TIMEOUT)
+        await session.close()
         logging.info("Бот остановлен.")
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+import threading
+from typing import Dict, Union
+
+Number = Union[int, float]
+
+# Простейший реестр метрик в памяти процесса.
+# Счётчики только растут, gauge хранит последнее значение.
+_lock = threading.Lock()
+_counters: Dict[str, Number] = {}
+_gauges: Dict[str, Number] = {}
+
+
+def inc(name: str, value: Number = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: Number) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> Dict[str, Dict[str, Number]]:
+    """
+    Копия всех метрик — для логов, /stats и отладки.
+    """
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges)}
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+import metrics
+from callbacks import DishCb
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+# Префиксы callback_data, повторные нажатия которых можно склеить в одно
+MERGEABLE_PREFIXES = (DishCb.__prefix__ + DishCb.__separator__,)
+
+
+class _Bucket:
+    """Состояние одного пользователя: токены, время обновления и склеенные нажатия."""
+
+    __slots__ = ("tokens", "updated", "pending", "flush_task", "hinted")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        # когда последний раз просили подождать с сообщениями (чтобы не флудить в ответ)
+        self.hinted = 0.0
+        # callback_data -> [кол-во нажатий, последний event, последний data]
+        self.pending: Dict[str, list] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Антифлуд на уровне роутера: token bucket на каждого пользователя.
+
+    - в пределах лимита апдейт проходит как обычно;
+    - лишние нажатия на блюдо не теряются: отвечаем тостом сразу,
+      а когда появится токен — вызываем хендлер один раз с merged_taps=N
+      (одно увеличение количества и одна правка сообщения);
+    - остальные лишние callback'и получают короткий ответ;
+    - лишнее сообщение не обрабатывается, но клиент получает просьбу подождать
+      и отправить его ещё раз — иначе сценарий (адрес, телефон) ждал бы ответа вечно.
+      Просьба сама ограничена: не чаще раза за время полного восстановления ведра.
+
+    Таблица состояний сама чистится: пользователи без активности дольше `ttl`
+    (к этому моменту их ведро всё равно полное) удаляются.
+    """
+
+    def __init__(self, rate: float, burst: int, ttl: float = 60.0):
+        self.rate = max(rate, 0.1)
+        self.burst = max(burst, 1)
+        self.ttl = max(ttl, self.burst / self.rate)
+        self._buckets: Dict[int, _Bucket] = {}
+        self._last_sweep = time.monotonic()
+
+    def _bucket(self, user_id: int, now: float) -> _Bucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+            return bucket
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        return bucket
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.ttl:
+            return
+        self._last_sweep = now
+        stale = [
+            uid for uid, b in self._buckets.items()
+            if not b.pending and now - b.updated > self.ttl
+        ]
+        for uid in stale:
+            del self._buckets[uid]
+        metrics.set_gauge("throttle.users", len(self._buckets))
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._sweep(now)
+        bucket = self._bucket(user.id, now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return await handler(event, data)
+
+        # деньги уже списаны — такое сообщение не отбрасываем никогда
+        if isinstance(event, Message) and event.successful_payment:
+            return await handler(event, data)
+
+        metrics.inc("throttle.limited")
+
+        if isinstance(event, CallbackQuery):
+            cb_data = event.data or ""
+            if cb_data.startswith(MERGEABLE_PREFIXES):
+                self._merge(bucket, handler, event, data)
+                await event.answer("Добавлено ✅")
+                return None
+            await event.answer("Слишком часто, подождите секунду ⏳")
+            return None
+
+        if isinstance(event, Message):
+            logger.debug("Флуд от пользователя %s, сообщение пропущено", user.id)
+            if now - bucket.hinted >= self.burst / self.rate:
+                bucket.hinted = now
+                await event.answer("Слишком часто ⏳ Подождите пару секунд и отправьте сообщение ещё раз.")
+        return None
+
+    def _merge(self, bucket: _Bucket, handler: Handler, event: CallbackQuery, data: Dict[str, Any]) -> None:
+        entry = bucket.pending.get(event.data)
+        if entry is None:
+            bucket.pending[event.data] = [1, event, data]
+        else:
+            entry[0] += 1
+            entry[1] = event
+            entry[2] = data
+        metrics.inc("throttle.merged")
+
+        if bucket.flush_task is None:
+            delay = (1 - bucket.tokens) / self.rate
+            bucket.flush_task = lifecycle.spawn(self._flush(bucket, handler, delay))
+
+    @staticmethod
+    async def _fresh(data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        data снят в момент нажатия, а за время задержки клиент мог уйти
+        в другой шаг сценария — фильтры по состоянию должны видеть текущее.
+        """
+        state = data.get("state")
+        if state is None:
+            return data
+        return {**data, "raw_state": await state.get_state()}
+
+    async def _flush(self, bucket: _Bucket, handler: Handler, delay: float) -> None:
+        await asyncio.sleep(max(delay, 0))
+        pending, bucket.pending = bucket.pending, {}
+        bucket.flush_task = None
+
+        now = time.monotonic()
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+
+        for count, event, data in pending.values():
+            # склеенная пачка стоит одного токена
+            bucket.tokens = max(0.0, bucket.tokens - 1)
+            try:
+                await handler(event, {**await self._fresh(data), "merged_taps": count})
+            except Exception:
+                logger.exception("Не удалось обработать склеенные нажатия %r", event.data)
@@ -0,0 +1,138 @@
+-- Изменения схемы Supabase по мере развития бота.
+-- Применяются по порядку в SQL-редакторе Supabase; каждый блок можно запускать повторно.
+
+-- Филиалы: ключ кухни, которой отдан заказ
+alter table orders add column if not exists branch text;
+
+-- Зона доставки, определённая по адресу или геолокации
+alter table orders add column if not exists zone text;
+
+-- Справочник курьеров и ссылка на курьера в заказе
+create table if not exists couriers (
+    id bigint generated by default as identity primary key,
+    name text not null,
+    zone text,
+    active boolean not null default true
+);
+alter table orders add column if not exists courier_id bigint references couriers (id);
+
+-- Журнал событий заказов: смены статуса, создание, назначение курьера
+create table if not exists order_events (
+    id bigint generated by default as identity primary key,
+    order_id bigint not null references orders (id),
+    kind text not null,
+    value text,
+    actor_id bigint,
+    created_at timestamp not null default timezone('utc', now())
+);
+create index if not exists order_events_order_id_idx on order_events (order_id, id);
+
+-- Смена статуса и запись события в одной транзакции (один HTTP-запрос из бота)
+create or replace function set_order_status(p_order_id bigint, p_status text, p_actor_id bigint default null)
+returns void
+language sql
+as $$
+    update orders
+       set status = p_status, updated_at = timezone('utc', now())
+     where id = p_order_id;
+    insert into order_events (order_id, kind, value, actor_id)
+    values (p_order_id, 'status', p_status, p_actor_id);
+$$;
+
+-- Оплата через Telegram Payments
+alter table orders add column if not exists paid_at timestamp;
+alter table orders add column if not exists paid_amount bigint;
+alter table orders add column if not exists telegram_charge_id text;
+alter table orders add column if not exists provider_charge_id text;
+
+-- Отметка пачки оплат одним запросом; повторный вызов с теми же данными безопасен
+create or replace function mark_orders_paid(p_rows jsonb)
+returns void
+language sql
+as $$
+    update orders o
+       set paid_at = r.paid_at,
+           paid_amount = r.amount,
+           telegram_charge_id = r.telegram_charge_id,
+           provider_charge_id = r.provider_charge_id,
+           updated_at = timezone('utc', now())
+      from jsonb_to_recordset(p_rows)
+           as r(order_id bigint, amount bigint, telegram_charge_id text, provider_charge_id text, paid_at timestamp)
+     where o.id = r.order_id;
+$$;
+
+-- Массовая смена статуса из списка /active: один запрос на пачку заказов.
+-- Меняются только заказы, которые сейчас в одном из p_from; возвращаются их id
+create or replace function set_orders_status(
+    p_order_ids bigint[], p_status text, p_from text[], p_actor_id bigint default null
+)
+returns setof bigint
+language sql
+as $$
+    with changed as (
+        update orders
+           set status = p_status, updated_at = timezone('utc', now())
+         where id = any(p_order_ids) and status = any(p_from)
+     returning id
+    ), logged as (
+        insert into order_events (order_id, kind, value, actor_id)
+        select id, 'status', p_status, p_actor_id from changed
+    )
+    select id from changed order by id;
+$$;
+
+-- Последние сообщения клиентам для пачки заказов
+create or replace function set_user_message_ids(p_rows jsonb)
+returns void
+language sql
+as $$
+    update orders o
+       set user_message_id = r.user_message_id
+      from jsonb_to_recordset(p_rows) as r(order_id bigint, user_message_id bigint)
+     where o.id = r.order_id;
+$$;
+
+-- Прогресс рассылок — отдельно от settings: чекпоинт раз в страницу не меняет settings_version.
+-- Строка живёт, пока рассылка не завершена
+create table if not exists broadcasts (
+    id text primary key,
+    state text not null
+);
+-- перенос незавершённой рассылки из старых ключей settings и их удаление
+insert into broadcasts (id, state)
+select a.value, b.value
+  from settings a
+  join settings b on b.key = 'broadcast:' || a.value
+ where a.key = 'broadcast_active' and (b.value::jsonb ->> 'done')::boolean is not true
+on conflict (id) do nothing;
+delete from settings where key = 'broadcast_active' or key like 'broadcast:%';
+
+-- Бот, через который клиент заказывал (филиал из BOT_TOKENS; null — бот BOT_TOKEN).
+-- Рассылка идёт каждому клиенту от его бота
+alter table clients add column if not exists tenant text;
+create index if not exists clients_tenant_user_id_idx on clients (tenant, user_id);
+
+-- Правка одного блюда в settings.menu_overrides: слияние с текущим значением
+-- в одной транзакции вместо «прочитал — изменил — записал» в боте
+create or replace function set_menu_override(p_branch text, p_dish text, p_changes jsonb, p_version text)
+returns text
+language plpgsql
+as $$
+declare
+    v_value jsonb;
+begin
+    insert into settings (key, value) values ('menu_overrides', '{}')
+    on conflict (key) do nothing;
+    select coalesce(nullif(value, '')::jsonb, '{}') into v_value
+      from settings where key = 'menu_overrides' for update;
+    v_value := jsonb_set(
+        v_value || jsonb_build_object(p_branch, coalesce(v_value -> p_branch, '{}')),
+        array[p_branch, p_dish],
+        coalesce(v_value -> p_branch -> p_dish, '{}') || p_changes
+    );
+    update settings set value = v_value::text where key = 'menu_overrides';
+    insert into settings (key, value) values ('settings_version', p_version)
+    on conflict (key) do update set value = excluded.value;
+    return v_value::text;
+end;
+$$;
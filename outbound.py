@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class OutboundLane:
+    """
+    Отдельная «полоса» исходящих сообщений со своим лимитом скорости.
+
+    send() ждёт свободный слот (равномерно, `rate` сообщений в секунду),
+    при TelegramRetryAfter выжидает указанное время и повторяет.
+    Полоса с low_priority=True дополнительно уступает обработке апдейтов:
+    пока бот занят заказами, очередное сообщение ждёт (но не дольше max_yield).
+    """
+
+    def __init__(self, name: str, rate: float, *, low_priority: bool = False, max_yield: float = 2.0):
+        self.name = name
+        self.interval = 1.0 / max(rate, 0.1)
+        self.low_priority = low_priority
+        self.max_yield = max_yield
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _acquire(self) -> None:
+        async with self._lock:
+            if self.low_priority:
+                waited = 0.0
+                while lifecycle.in_flight and waited < self.max_yield:
+                    await asyncio.sleep(0.05)
+                    waited += 0.05
+            now = time.monotonic()
+            delay = self._next_slot - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = max(now, self._next_slot) + self.interval
+
+    async def send(self, call: Callable[[], Awaitable[Any]], retries: int = 3) -> Any:
+        """
+        Выполняет вызов Bot API в пределах лимита полосы.
+        Исключения (кроме RetryAfter) пробрасываются вызывающему.
+        """
+        attempt = 0
+        while True:
+            await self._acquire()
+            try:
+                result = await call()
+            except TelegramRetryAfter as e:
+                attempt += 1
+                metrics.inc(f"outbound.{self.name}.retry_after")
+                if attempt > retries:
+                    raise
+                logger.warning("Полоса %s: Telegram просит подождать %s с", self.name, e.retry_after)
+                async with self._lock:
+                    self._next_slot = time.monotonic() + e.retry_after
+                continue
+            metrics.inc(f"outbound.{self.name}.sent")
+            return result
@@ -0,0 +1,152 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aiogram.types import LabeledPrice
+
+import metrics
+from config import PAYMENTS_CURRENCY, PAYMENTS_FLUSH_INTERVAL, PAYMENTS_PROVIDER_TOKEN, PAYMENTS_PROVIDER_TOKENS
+from db import DBError, mark_orders_paid
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_PAYLOAD_PREFIX = "pay:"
+
+
+class PaymentDesk:
+    """
+    Оплата заказов через Telegram Payments.
+
+    - после оформления клиент получает счёт, open() запоминает, что и на какую
+      сумму ждём от этого клиента;
+    - pre_checkout_query нужно подтвердить за 10 секунд — check() сверяет
+      данные с памятью, без запросов к БД;
+    - успешные оплаты копятся в буфере и одним RPC-запросом отмечаются
+      в orders раз в PAYMENTS_FLUSH_INTERVAL — paid() / flush().
+
+    Методы check() и paid() принимают простые значения из апдейта,
+    поэтому их можно гонять без Telegram.
+    """
+
+    def __init__(self):
+        # order_id -> (user_id, сумма в минимальных единицах валюты)
+        self._open: Dict[int, Tuple[int, int]] = {}
+        self._buffer: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(PAYMENTS_PROVIDER_TOKEN or PAYMENTS_PROVIDER_TOKENS)
+
+    @staticmethod
+    def provider_token(tenant: Optional[str]) -> Optional[str]:
+        """Токен провайдера для бота филиала tenant (None — бот BOT_TOKEN)."""
+        if tenant:
+            return PAYMENTS_PROVIDER_TOKENS.get(tenant)
+        return PAYMENTS_PROVIDER_TOKEN
+
+    @staticmethod
+    def payload(order_id: int) -> str:
+        return f"{_PAYLOAD_PREFIX}{order_id}"
+
+    @staticmethod
+    def order_id(payload: str) -> Optional[int]:
+        if not payload or not payload.startswith(_PAYLOAD_PREFIX):
+            return None
+        value = payload[len(_PAYLOAD_PREFIX):]
+        return int(value) if value.isdigit() else None
+
+    @staticmethod
+    def prices(cart: Iterable[Dict[str, Any]]) -> List[LabeledPrice]:
+        # цены в меню — в рублях, Telegram ждёт копейки
+        return [
+            LabeledPrice(
+                label=f"{item['name']} ×{item.get('qty', 1)}",
+                amount=int(item["price"]) * int(item.get("qty", 1)) * 100,
+            )
+            for item in cart
+        ]
+
+    # ----- ожидаемые оплаты -----
+    def seed(self, active_orders: Iterable[Dict[str, Any]]) -> None:
+        """Неоплаченные активные заказы после перезапуска (счета у клиентов остались)."""
+        self._open = {
+            o["id"]: (o["user_id"], int(o["total"]) * 100)
+            for o in active_orders
+            if not o.get("paid_at") and o.get("total") and o.get("user_id")
+        }
+
+    def open(self, order_id: int, user_id: int, total: int) -> str:
+        self._open[order_id] = (user_id, total * 100)
+        return self.payload(order_id)
+
+    def on_status(self, order_id: int, status: str) -> None:
+        # отменённый заказ оплатить уже нельзя, доставленный — уже оплачен наличными
+        if status in ("canceled", "delivered"):
+            self._open.pop(order_id, None)
+
+    def check(self, payload: str, user_id: int, currency: str, amount: int) -> Optional[str]:
+        """
+        None — можно списывать, иначе текст ошибки для клиента.
+        """
+        expected = self._open.get(self.order_id(payload))
+        if expected is None:
+            return "Счёт устарел: заказ отменён или уже оплачен."
+        if expected[0] != user_id or currency != PAYMENTS_CURRENCY or amount != expected[1]:
+            metrics.inc("payments.rejected")
+            return "Сумма заказа изменилась, оформите заказ заново."
+        return None
+
+    def paid(self, payload: str, amount: int, telegram_charge_id: str, provider_charge_id: str) -> Optional[int]:
+        order_id = self.order_id(payload)
+        if order_id is None:
+            return None
+        self._open.pop(order_id, None)
+        self._buffer.append(
+            {
+                "order_id": order_id,
+                "amount": amount,
+                "telegram_charge_id": telegram_charge_id,
+                "provider_charge_id": provider_charge_id,
+                "paid_at": datetime.utcnow().isoformat(),
+            }
+        )
+        metrics.inc("payments.paid")
+        metrics.set_gauge("payments.buffered", len(self._buffer))
+        return order_id
+
+    # ----- сверка с БД -----
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        batch = self._buffer[:]
+        try:
+            await asyncio.to_thread(mark_orders_paid, batch)
+        except DBError:
+            # оплата уже прошла в Telegram — не теряем, повторим
+            logger.warning("Не удалось отметить оплату %s заказов, повторим позже", len(batch))
+            return
+        del self._buffer[:len(batch)]
+        metrics.set_gauge("payments.buffered", len(self._buffer))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(PAYMENTS_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+            lifecycle.on_drain(self.stop)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+# Общая на процесс касса
+payments = PaymentDesk()
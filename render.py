@@ -0,0 +1,204 @@
+"""
+Тексты сообщений о заказе.
+
+Шаблоны разбираются один раз при импорте (str.format, привязанный к строке),
+строки блюд кэшируются по содержимому корзины: повторная отрисовка той же
+корзины — нажатие, обновление карточки — не форматирует позиции заново.
+Всё, что ввёл пользователь (имя, телефон, адрес, комментарий, курьер),
+экранируется: сообщения уходят с parse_mode=HTML.
+"""
+from datetime import timezone
+from functools import lru_cache
+from html import escape
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from data import CATEGORY_TITLES
+from events import event_log
+from tracing import traced
+from utils import progress_text
+
+STATUS_ICONS = {
+    "new": "🆕", "preparing": "🧑‍🍳", "ready": "✅",
+    "handoff": "📦", "onway": "🚚", "delivered": "🏁", "canceled": "❌",
+}
+STATUS_TITLES_RU = {
+    "new": "Заказ принят",
+    "preparing": "Ваш заказ готовят",
+    "ready": "Ваш заказ готов",
+    "handoff": "Передаём курьеру",
+    "onway": "Курьер везёт ваш заказ",
+    "delivered": "Заказ доставлен",
+    "canceled": "Заказ отменён",
+}
+_COMMENT_LABELS = {"food": "еде", "delivery": "доставке"}
+
+_USER_ORDER = (
+    "✅ <b>Заказ оформлен!</b>\n\n"
+    "<b>Имя:</b> {name}\n"
+    "<b>Телефон:</b> {phone}\n"
+    "<b>Адрес:</b> {address}{courier}{comment}\n\n"
+    "<b>Ваши блюда:</b>\n{items}\n\n"
+    "<b>Итого:</b> {total}₽\n\n"
+    "<b>Статус:</b> {status} {icon}\n\n"
+    "{progress}{eta}"
+).format
+_ADMIN_ORDER = (
+    "{icon} <b>Заказ #{id}</b>\n"
+    "{items}\n\n"
+    "<b>Сумма:</b> {total}₽\n"
+    "<b>Клиент:</b> <a href='tg://user?id={user_id}'>{user_name}</a> @{username}\n"
+    "<b>Телефон:</b> {phone}\n"
+    "<b>Адрес:</b> {address}{zone}{courier}{comment}{paid}\n"
+    "<b>Статус:</b> {status}{history}"
+).format
+_CATEGORY_HEADER = (
+    "Категория: <b>{title}</b>\n"
+    "В корзине: {qty} поз. • {total}₽\n"
+    "<b>Вы выбрали:</b>\n{items}\n\n"
+    "Выберите блюдо:"
+).format
+_ITEM = "• {} ×{} — {}₽".format
+
+Items = Tuple[Tuple[str, int, int], ...]
+
+
+def _e(value: Any) -> str:
+    return escape(str(value), quote=False) if value is not None else ""
+
+
+def _cart_key(cart: Optional[Iterable[Dict[str, Any]]]) -> Items:
+    """Версия корзины — её содержимое: (название, цена, количество) по позициям."""
+    return tuple(
+        (i.get("name", "—"), int(i.get("price", 0) or 0), int(i.get("qty", 1) or 1))
+        for i in cart or ()
+    )
+
+
+@lru_cache(maxsize=2048)
+def _items(key: Items) -> Tuple[str, int, int]:
+    """(строки позиций, кол-во штук, сумма)."""
+    lines = "\n".join(_ITEM(escape(name, quote=False), qty, price * qty) for name, price, qty in key)
+    return lines, sum(q for _, _, q in key), sum(p * q for _, p, q in key)
+
+
+def comment_label(topic: Optional[str]) -> str:
+    return _COMMENT_LABELS.get(topic, "заказу")
+
+
+@traced("render.cart_text")
+def cart_text(cart: list) -> str:
+    lines, _, total = _items(_cart_key(cart))
+    if not lines:
+        return "Корзина пуста."
+    return f"{lines}\n\n<b>Итого:</b> {total}₽"
+
+
+def cart_changes_text(changes: Iterable[Tuple[str, int, Optional[int]]], cart: list) -> str:
+    """Что изменилось в корзине после сверки с меню (branches.revalidate_cart)."""
+    lines = [
+        f"• {_e(name)} — больше нет в меню" if new is None else f"• {_e(name)}: {old}₽ → {new}₽"
+        for name, old, new in changes
+    ]
+    return "⚠️ Пока вы оформляли заказ, меню изменилось:\n" + "\n".join(lines) + "\n\n" + cart_text(cart)
+
+
+@traced("render.category_header")
+def category_header(category_key: str, cart: list) -> str:
+    lines, qty, total = _items(_cart_key(cart))
+    return _CATEGORY_HEADER(
+        title=CATEGORY_TITLES.get(category_key, category_key),
+        qty=qty,
+        total=total,
+        items=lines or "Корзина пуста.",
+    )
+
+
+@traced("render.user_order_text")
+def user_order_text(
+    name: str,
+    phone: str,
+    address: str,
+    cart: list,
+    status: str,
+    courier: str | None,
+    comment_text: str | None = None,
+    comment_topic: str | None = None,
+    eta_text: str | None = None,
+) -> str:
+    lines, _, total = _items(_cart_key(cart))
+    comment = (
+        f"\n<b>Комментарий к {comment_label(comment_topic)}:</b> {_e(comment_text)}"
+        if comment_text
+        else ""
+    )
+    return _USER_ORDER(
+        name=_e(name),
+        phone=_e(phone),
+        address=_e(address),
+        courier=f"\n<b>Курьер:</b> {_e(courier)}" if courier else "",
+        comment=comment,
+        items=lines,
+        total=total,
+        status=STATUS_TITLES_RU.get(status, status),
+        icon=STATUS_ICONS.get(status, ""),
+        progress=progress_text(status),
+        eta=f"\n\n⏱ {eta_text}" if eta_text else "",
+    )
+
+
+def history_line(order_id: int) -> str:
+    """
+    Хронология статусов из кольцевого буфера журнала (без запроса к БД).
+    """
+    steps = [
+        f"{at.replace(tzinfo=timezone.utc).astimezone():%H:%M} {STATUS_ICONS.get(value, value)}"
+        for kind, value, at, _ in event_log.recent(order_id)
+        if kind == "status"
+    ]
+    return f"\n🕒 {' → '.join(steps)}" if steps else ""
+
+
+@traced("render.admin_order_text")
+def admin_order_text(order: Dict[str, Any]) -> str:
+    lines, _, _ = _items(_cart_key(order["items"]))
+    status = order["status"]
+    comment = order.get("comment")
+    return _ADMIN_ORDER(
+        icon=STATUS_ICONS.get(status, ""),
+        id=order["id"],
+        items=lines,
+        total=order["total"],
+        user_id=order["user_id"],
+        user_name=_e(order["user_name"] or "user"),
+        username=_e(order.get("user_username") or "-"),
+        phone=_e(order.get("phone")),
+        address=_e(order.get("address")),
+        zone=f"\n<b>Зона:</b> {_e(order['zone'])}" if order.get("zone") else "",
+        courier=f"\n<b>Курьер:</b> {_e(order['courier'])}" if order.get("courier") else "",
+        comment=(
+            f"\n<b>Комментарий клиента к {comment_label(order.get('comment_topic'))}:</b> {_e(comment)}"
+            if comment
+            else ""
+        ),
+        paid="\n<b>Оплата:</b> картой ✅" if order.get("paid_at") else "",
+        status=STATUS_TITLES_RU.get(status, status),
+        history=history_line(order["id"]),
+    )
+
+
+@traced("render.active_list_text")
+def active_list_text(orders: list, selected: set, shown: int) -> str:
+    """Шапка списка /active: сколько заказов в каждом статусе и сколько отмечено."""
+    if not orders:
+        return "Активных заказов нет 🎉"
+    counts: Dict[str, int] = {}
+    for o in orders:
+        counts[o["status"]] = counts.get(o["status"], 0) + 1
+    lines = "\n".join(
+        f"{STATUS_ICONS.get(s, s)} {STATUS_TITLES_RU.get(s, s)}: {n}" for s, n in counts.items()
+    )
+    hidden = f" (кнопками показаны первые {shown})" if len(orders) > shown else ""
+    return (
+        f"<b>Активные заказы: {len(orders)}</b>{hidden}\n{lines}\n\n"
+        f"Отмечено: {len(selected)}. Отметьте заказы и выберите новый статус."
+    )
@@ -0,0 +1,116 @@
+"""
+Поиск блюд по названию для inline-режима (@bot борщ).
+
+Индекс — префиксное дерево по словам названий, строится один раз на филиал
+и версию каталога. Запрос ищется по префиксу каждого слова ("бор" -> "борщ"),
+а если точных совпадений нет — со словами на расстоянии одной опечатки.
+Ответы кэшируются по нормализованной строке запроса.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from branches import catalog_version, get_menu, resolve_key
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+
+# (категория, id блюда)
+DishRef = Tuple[str, int]
+
+
+def normalize(text: str) -> Tuple[str, ...]:
+    return tuple(_WORD_RE.findall((text or "").lower().replace("ё", "е")))
+
+
+class _Node:
+    __slots__ = ("children", "refs", "subtree")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.refs: Set[DishRef] = set()      # блюда со словом, заканчивающимся здесь
+        self.subtree: Set[DishRef] = set()   # все блюда в поддереве (ответ на префикс)
+
+
+class DishIndex:
+    def __init__(self):
+        self._root = _Node()
+        self._order: Dict[DishRef, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def add(self, ref: DishRef, name: str) -> None:
+        self._order.setdefault(ref, len(self._order))
+        for word in normalize(name):
+            node = self._root
+            for ch in word:
+                node = node.children.setdefault(ch, _Node())
+                node.subtree.add(ref)
+            node.refs.add(ref)
+
+    def search(self, query: str, limit: int = 20) -> List[DishRef]:
+        """
+        Блюда, в названии которых для каждого слова запроса есть слово
+        с таким префиксом (или с одной опечаткой). Порядок — как в меню.
+        """
+        words = normalize(query)
+        if not words:
+            return []
+        found: Optional[Set[DishRef]] = None
+        for word in words:
+            refs = self._prefix(word) or self._fuzzy(word)
+            found = refs if found is None else found & refs
+            if not found:
+                return []
+        return sorted(found, key=self._order.__getitem__)[:limit]
+
+    def _prefix(self, word: str) -> Set[DishRef]:
+        node = self._root
+        for ch in word:
+            node = node.children.get(ch)
+            if node is None:
+                return set()
+        return node.subtree
+
+    def _fuzzy(self, word: str) -> Set[DishRef]:
+        """Слова на расстоянии Левенштейна не больше 1 (для коротких слов не ищем)."""
+        found: Set[DishRef] = set()
+        if len(word) < 4:
+            return found
+        first_row = list(range(len(word) + 1))
+        for ch, child in self._root.children.items():
+            self._fuzzy_walk(child, ch, word, first_row, found)
+        return found
+
+    def _fuzzy_walk(self, node: _Node, ch: str, word: str, prev_row: List[int], found: Set[DishRef]) -> None:
+        row = [prev_row[0] + 1]
+        for i in range(1, len(word) + 1):
+            row.append(min(
+                row[i - 1] + 1,
+                prev_row[i] + 1,
+                prev_row[i - 1] + (word[i - 1] != ch),
+            ))
+        if row[-1] <= 1:
+            # опечатка в уже набранной части — дальше слово можно дописывать
+            found |= node.subtree if len(word) > 4 else node.refs
+        if min(row) <= 1:
+            for next_ch, child in node.children.items():
+                self._fuzzy_walk(child, next_ch, word, row, found)
+
+
+@lru_cache(maxsize=16)
+def _index(branch: str, version: int) -> DishIndex:
+    index = DishIndex()
+    for cat, dishes in get_menu(branch).items():
+        for dish in dishes:
+            index.add((cat, dish["id"]), dish["name"])
+    return index
+
+
+@lru_cache(maxsize=1024)
+def _search(branch: str, version: int, words: Tuple[str, ...], limit: int) -> Tuple[DishRef, ...]:
+    return tuple(_index(branch, version).search(" ".join(words), limit))
+
+
+def search_dishes(branch: Optional[str], query: str, limit: int = 20) -> Tuple[DishRef, ...]:
+    return _search(resolve_key(branch), catalog_version(), normalize(query), limit)
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from config import SETTINGS_REFRESH_INTERVAL
+from db import DBError, get_all_settings, get_setting, set_setting
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Служебный ключ: меняется при каждой записи через этот модуль
+VERSION_KEY = "settings_version"
+
+Listener = Callable[[Optional[str]], None]
+
+
+class SettingsCache:
+    """
+    Таблица settings целиком в памяти.
+
+    - load() читает все ключи одним запросом (при старте);
+      обработчики изменений всегда вызываются в потоке event loop;
+    - get() — чтение из словаря, без обращения к БД;
+    - set() пишет в БД, обновляет словарь и меняет settings_version;
+    - update() — правка, которую БД применяет к текущему значению сама
+      (без гонки «прочитал — изменил — записал» между админами и процессами);
+    - фоновая задача раз в SETTINGS_REFRESH_INTERVAL читает только settings_version
+      и перечитывает всё, если версия сменилась (запись из другого процесса);
+    - on_change() подписывает на изменение конкретного ключа.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Optional[str]] = {}
+        self._listeners: Dict[str, List[Listener]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loaded = False
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def on_change(self, key: str, listener: Listener) -> None:
+        self._listeners.setdefault(key, []).append(listener)
+
+    def _replace(self, values: Dict[str, Optional[str]]) -> None:
+        old, self._values = self._values, values
+        for key, listeners in self._listeners.items():
+            if old.get(key) != values.get(key):
+                for listener in listeners:
+                    try:
+                        listener(values.get(key))
+                    except Exception:
+                        logger.exception("Ошибка обработчика изменения настройки %s", key)
+
+    async def load(self) -> None:
+        values = await asyncio.to_thread(get_all_settings)
+        self._replace(values)
+        self._loaded = True
+        metrics.inc("settings.reloads")
+
+    async def set(self, key: str, value: str) -> None:
+        version = str(time.time_ns())
+        await asyncio.to_thread(set_setting, key, value)
+        await asyncio.to_thread(set_setting, VERSION_KEY, version)
+        self._replace({**self._values, key: value, VERSION_KEY: version})
+
+    async def update(self, key: str, write: Callable[[str], Optional[str]]) -> Optional[str]:
+        """
+        write(version) — функция db, которая одной транзакцией правит ключ
+        и записывает settings_version; возвращает новое значение ключа.
+        """
+        version = str(time.time_ns())
+        value = await asyncio.to_thread(write, version)
+        self._replace({**self._values, key: value, VERSION_KEY: version})
+        return value
+
+    async def refresh(self) -> None:
+        if not self._loaded:
+            await self.load()
+            return
+        version = await asyncio.to_thread(get_setting, VERSION_KEY)
+        if version != self._values.get(VERSION_KEY):
+            await self.load()
+            logger.info("Настройки перечитаны (версия %s)", version)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(SETTINGS_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except DBError:
+                logger.warning("Не удалось проверить версию настроек, используем кэш")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            lifecycle.on_drain(self.stop)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Общий на процесс кэш настроек
+settings = SettingsCache()
@@ -0,0 +1,184 @@
+"""
+Симуляция парка курьеров для couriers.CourierPool — без БД и Telegram.
+
+Случайный поток событий: заказ готов (ждёт курьера), доставлен или отменён,
+курьер ушёл со смены и вернулся. После каждого события пул сверяется
+с перебором «в лоб»:
+  - best() отдаёт курьера с минимальной загрузкой (сначала в зоне заказа);
+  - загрузка курьера равна числу его заказов и не больше max_load;
+  - ждёт курьера ровно тот набор заказов, что и в модели;
+  - ожидающие заказы получают курьеров в порядке готовности.
+В конце — время одного события на разных размерах парка.
+
+Запуск: python sim_couriers.py [--couriers 200] [--events 20000] [--seed 1]
+"""
+import argparse
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+from couriers import CourierPool
+
+_ZONES = ("center", "north", "south", None)
+
+
+class Fleet:
+    """Модель «в лоб» рядом с пулом: кто свободен, у кого какие заказы, кто ждёт."""
+
+    def __init__(self, size: int, max_load: int, rnd: random.Random):
+        self.rnd = rnd
+        self.pool = CourierPool(max_load)
+        self.max_load = self.pool.max_load
+        self.zone: Dict[int, Optional[str]] = {}
+        self.available: Dict[int, bool] = {}
+        self.orders: Dict[int, Set[int]] = {}
+        self.order_zone: Dict[int, Optional[str]] = {}
+        self.waiting: List[int] = []
+        self.problems: List[str] = []
+        self._next_order = 1
+        self.pool.load(
+            [{"id": cid, "name": f"Курьер {cid}", "zone": rnd.choice(_ZONES)} for cid in range(1, size + 1)]
+        )
+        for courier in self.pool.couriers():
+            self.zone[courier["id"]] = courier["zone"]
+            self.available[courier["id"]] = True
+            self.orders[courier["id"]] = set()
+
+    # ----- модель -----
+    def _eligible(self, zone: Optional[str]) -> List[int]:
+        free = [c for c, ok in self.available.items() if ok and len(self.orders[c]) < self.max_load]
+        in_zone = [c for c in free if zone and self.zone[c] == zone]
+        return in_zone or free
+
+    def _courier_of(self, order_id: int) -> Optional[int]:
+        return next((c for c, orders in self.orders.items() if order_id in orders), None)
+
+    def _match(self) -> None:
+        expected = []
+        for order_id in list(self.waiting):
+            if not self._eligible(self.order_zone[order_id]):
+                break
+            expected.append(order_id)
+            self.waiting.remove(order_id)
+            # загрузку модели обновляем по выбору пула, проверив, что он минимальный
+            candidates = self._eligible(self.order_zone[order_id])
+            best = min(len(self.orders[c]) for c in candidates)
+            matched = self._pending.pop(0) if self._pending else None
+            if matched is None or matched[0] != order_id:
+                self.problems.append(f"заказ {order_id}: ожидался следующим, пул выдал {matched}")
+                return
+            courier_id = matched[1]["id"]
+            if courier_id not in candidates or len(self.orders[courier_id]) != best:
+                self.problems.append(
+                    f"заказ {order_id}: курьер {courier_id} с загрузкой {len(self.orders[courier_id])}, "
+                    f"минимум {best}"
+                )
+            self.orders[courier_id].add(order_id)
+        if self._pending:
+            self.problems.append(f"пул назначил лишнее: {[o for o, _ in self._pending]}")
+
+    # ----- события -----
+    def ready(self) -> None:
+        order_id, self._next_order = self._next_order, self._next_order + 1
+        zone = self.rnd.choice(_ZONES)
+        self.order_zone[order_id] = zone
+        self.pool.wait(order_id, zone)
+        self.waiting.append(order_id)
+        self._dispatch()
+
+    def finish(self) -> None:
+        active = [o for orders in self.orders.values() for o in orders] + self.waiting
+        if not active:
+            return
+        order_id = self.rnd.choice(active)
+        self.pool.on_status(order_id, self.rnd.choice(("delivered", "canceled")))
+        courier_id = self._courier_of(order_id)
+        if courier_id is not None:
+            self.orders[courier_id].discard(order_id)
+        else:
+            self.waiting.remove(order_id)
+        self._dispatch()
+
+    def shift(self) -> None:
+        courier_id = self.rnd.choice(list(self.available))
+        self.available[courier_id] = not self.available[courier_id]
+        self.pool.set_available(courier_id, self.available[courier_id])
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        self._pending = [(o, c) for o, _, c in self.pool.match_waiting()]
+        self._match()
+
+    def check(self) -> None:
+        for courier in self.pool.couriers():
+            expected = len(self.orders[courier["id"]])
+            if courier["load"] != expected or courier["load"] > self.max_load:
+                self.problems.append(f"курьер {courier['id']}: загрузка {courier['load']}, ожидалось {expected}")
+        if self.pool.waiting() != len(self.waiting):
+            self.problems.append(f"ждут курьера {self.pool.waiting()}, ожидалось {len(self.waiting)}")
+        for zone in _ZONES:
+            best = self.pool.best(zone)
+            candidates = self._eligible(zone)
+            if (best is None) != (not candidates):
+                self.problems.append(f"best({zone}) = {best and best['id']}, свободных {len(candidates)}")
+            elif best is not None and len(self.orders[best["id"]]) != min(len(self.orders[c]) for c in candidates):
+                self.problems.append(f"best({zone}) = {best['id']} не наименее загруженный")
+
+
+def simulate(couriers: int, events: int, max_load: int, seed: int) -> List[str]:
+    fleet = Fleet(couriers, max_load, random.Random(seed))
+    for _ in range(events):
+        roll = fleet.rnd.random()
+        if roll < 0.5:
+            fleet.ready()
+        elif roll < 0.95:
+            fleet.finish()
+        else:
+            fleet.shift()
+        fleet.check()
+        if fleet.problems:
+            break
+    return fleet.problems
+
+
+def bench(couriers: int, events: int, max_load: int, seed: int) -> float:
+    """Микросекунд на событие (только пул, без модели)."""
+    rnd = random.Random(seed)
+    pool = CourierPool(max_load)
+    pool.load([{"id": c, "name": str(c), "zone": rnd.choice(_ZONES)} for c in range(1, couriers + 1)])
+    active: List[int] = []
+    started = time.perf_counter()
+    for order_id in range(1, events + 1):
+        if active and rnd.random() < 0.5:
+            pool.on_status(active.pop(rnd.randrange(len(active))), "delivered")
+        else:
+            pool.wait(order_id, rnd.choice(_ZONES))
+            active.append(order_id)
+        pool.match_waiting()
+    return (time.perf_counter() - started) / events * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--couriers", type=int, default=200)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--max-load", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # маленький парк — чаще все заняты и заказы ждут в очереди
+    problems = []
+    for size in (3, args.couriers):
+        problems = simulate(size, args.events // (10 if size > 50 else 1), args.max_load, args.seed)
+        print(f"парк {size:>5}: {'✗ ' + problems[0] if problems else '✓ совпадает с моделью'}")
+        if problems:
+            break
+
+    for size in (10, 100, 1000, 10000):
+        print(f"парк {size:>5}: {bench(size, args.events, args.max_load, args.seed):6.2f} мкс/событие")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Несколько ботов (брендов) в одном процессе.
+
+Каждый бот из BOT_TOKENS закреплён за своим филиалом: его меню, админ-группа
+и заказы. Всё остальное общее — одна HTTP-сессия (пул соединений),
+клиент БД, кэши каталога, метрики. Состояния FSM не смешиваются сами:
+ключ хранилища aiogram включает id бота.
+
+Без BOT_TOKENS работает как раньше: один бот BOT_TOKEN со всеми филиалами.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.types import TelegramObject
+
+from branches import branch_keys
+from config import BOT_TOKEN, BOT_TOKENS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_tenant_by_bot: Dict[int, str] = {}   # bot.id -> филиал
+_bot_by_tenant: Dict[str, Bot] = {}
+
+
+def create_bots(session: BaseSession) -> List[Bot]:
+    default = DefaultBotProperties(parse_mode="HTML")
+    if not BOT_TOKENS:
+        return [Bot(token=BOT_TOKEN, session=session, default=default)]
+
+    known = set(branch_keys())
+    bots = []
+    for key, token in BOT_TOKENS.items():
+        if key not in known:
+            logger.error("Бот для неизвестного филиала %s пропущен", key)
+            continue
+        bot = Bot(token=token, session=session, default=default)
+        _tenant_by_bot[bot.id] = key
+        _bot_by_tenant[key] = bot
+        bots.append(bot)
+    if not bots:
+        raise ValueError("В BOT_TOKENS нет ни одного бота для известных филиалов")
+    return bots
+
+
+def tenant_of(bot: Bot) -> Optional[str]:
+    return _tenant_by_bot.get(bot.id)
+
+
+def tenant_keys() -> List[str]:
+    """Филиалы со своим ботом; пусто в режиме одного бота."""
+    return list(_bot_by_tenant)
+
+
+def bot_for(branch: Optional[str], fallback: Bot) -> Bot:
+    """
+    Бот, который обслуживает филиал: фоновые действия (автоназначение курьера)
+    могут касаться заказа другого бренда, и писать туда нужно от его бота.
+    """
+    return _bot_by_tenant.get(branch, fallback) if branch else fallback
+
+
+class TenantMiddleware(BaseMiddleware):
+    """
+    Кладёт в данные апдейта tenant — филиал бота, получившего апдейт
+    (None в режиме одного бота). Хендлеры берут его аргументом tenant.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        data["tenant"] = tenant_of(data["bot"])
+        return await handler(event, data)
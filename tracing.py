@@ -0,0 +1,475 @@
+"""
+Трассировка апдейтов и профилирование по запросу.
+
+На каждый апдейт заводится трасса; внутри неё спаны:
+  update            — весь апдейт целиком (корень);
+  handler <имя>     — сам хендлер, без middleware;
+  fsm.<операция>    — чтение/запись состояния FSM;
+  db <действие>     — каждый вызов db._execute (с повторами);
+  tg <метод>        — каждый вызов Bot API (middleware сессии aiogram);
+  kb.* / render.*   — сборка клавиатур и текстов.
+
+Сэмплирование хвостовое: решение принимается в конце апдейта — сохраняются
+все медленные (TRACE_SLOW_MS) и упавшие апдейты плюс доля TRACE_SAMPLE_RATE
+остальных. Сохранённые трассы пачкой уходят в OTLP/HTTP-коллектор
+(TRACE_OTLP_ENDPOINT) или строками JSON в TRACE_FILE.
+
+Без активной трассы span()/traced() сводятся к чтению одной contextvar.
+Команда /profile on включает трассировку всех апдейтов и сэмплирующий
+профайлер потока цикла на заданное время.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.types import TelegramObject, Update
+
+import metrics
+from config import (
+    TRACE_FILE,
+    TRACE_FLUSH_INTERVAL,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_MS,
+    TRACING,
+)
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_SERVICE_NAME = "rahat-bot"
+# Кадры из этих каталогов профайлер считает библиотечными
+_LIB_DIRS = tuple({os.path.dirname(os.__file__), os.path.dirname(asyncio.__file__)})
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "attrs", "error")
+
+    def __init__(self, attrs: Dict[str, Any]):
+        self.trace_id = _new_id(16)
+        self.spans: List[Dict[str, Any]] = []
+        self.attrs = attrs
+        self.error = False
+
+
+_trace: ContextVar[Optional[_Trace]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("trace_parent", default=None)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "span_id", "parent", "start", "token")
+
+    def __init__(self, trace: _Trace, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> "_Span":
+        self.span_id = _new_id(8)
+        self.parent = _parent.get()
+        self.token = _parent.set(self.span_id)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        end = time.time_ns()
+        _parent.reset(self.token)
+        if exc_type is not None:
+            self.trace.error = True
+        # list.append атомарен — спаны из asyncio.to_thread пишутся в ту же трассу
+        self.trace.spans.append(
+            {
+                "name": self.name,
+                "span_id": self.span_id,
+                "parent": self.parent,
+                "start": self.start,
+                "end": end,
+                "attrs": self.attrs,
+                "error": exc_type is not None,
+            }
+        )
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any):
+    """with span("db get order"): ... — спан в текущей трассе (если она есть)."""
+    trace = _trace.get()
+    return _NOOP if trace is None else _Span(trace, name, attrs)
+
+
+def traced(name: str):
+    """Декоратор для синхронных функций: вызов становится спаном."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with _Span(trace, name, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ----- экспорт -----
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(traces: List[_Trace]) -> Dict[str, Any]:
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            attrs = {**trace.attrs, **s["attrs"]} if s["parent"] is None else s["attrs"]
+            item = {
+                "traceId": trace.trace_id,
+                "spanId": s["span_id"],
+                "name": s["name"],
+                "kind": 2 if s["parent"] is None else 1,
+                "startTimeUnixNano": str(s["start"]),
+                "endTimeUnixNano": str(s["end"]),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items()],
+                "status": {"code": 2 if s["error"] else 1},
+            }
+            if s["parent"]:
+                item["parentSpanId"] = s["parent"]
+            spans.append(item)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": _SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def _to_json(trace: _Trace) -> str:
+    root = min(s["start"] for s in trace.spans)
+    return json.dumps(
+        {
+            "trace_id": trace.trace_id,
+            **trace.attrs,
+            "error": trace.error,
+            "spans": [
+                {
+                    "name": s["name"],
+                    "id": s["span_id"],
+                    "parent": s["parent"],
+                    "at_ms": round((s["start"] - root) / 1e6, 2),
+                    "duration_ms": round((s["end"] - s["start"]) / 1e6, 2),
+                    **({"attrs": s["attrs"]} if s["attrs"] else {}),
+                    **({"error": True} if s["error"] else {}),
+                }
+                for s in sorted(trace.spans, key=lambda s: s["start"])
+            ],
+        },
+        ensure_ascii=False,
+        default=str,
+    )
+
+
+def _append_lines(path: str, lines: List[str]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+class SamplingProfiler:
+    """
+    Раз в `interval` снимает стек потока цикла и считает кадры нашего кода:
+    «self» — самый глубокий кадр (где реально тратится время),
+    «total» — все кадры стека. Ожидание в select() считается как <idle>.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._self: Counter = Counter()
+        self._total: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int) -> None:
+        if self.running:
+            return
+        self._target = thread_id
+        self.samples = 0
+        self._self.clear()
+        self._total.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None and frame.f_code.co_filename.endswith("selectors.py"):
+                # цикл ждёт событий в select()
+                self.samples += 1
+                self._self["<idle>"] += 1
+                continue
+            own: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                if not code.co_filename.startswith(_LIB_DIRS) and "site-packages" not in code.co_filename:
+                    own.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples += 1
+            self._self[own[0] if own else "<idle>"] += 1
+            for label in set(own):
+                self._total[label] += 1
+
+    def stop(self, top: int = 10) -> List[Tuple[str, float, float]]:
+        """[(функция, % self, % total)] по убыванию self."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        total = max(self.samples, 1)
+        return [
+            (label, 100 * count / total, 100 * self._total.get(label, count) / total)
+            for label, count in self._self.most_common(top)
+        ]
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = TRACING
+        self.sample_rate = TRACE_SAMPLE_RATE
+        self.slow_ms = TRACE_SLOW_MS
+        self.profiler = SamplingProfiler()
+        self._forced_until = 0.0
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+        self._queue: List[_Trace] = []
+        self._task: Optional[asyncio.Task] = None
+        self._http = None
+
+    @property
+    def active(self) -> bool:
+        return self.enabled or time.monotonic() < self._forced_until
+
+    # ----- точки подключения -----
+    def middleware(self) -> BaseMiddleware:
+        """Внешний middleware апдейтов: корневой спан и решение о сохранении."""
+        return _UpdateTraceMiddleware(self)
+
+    def handler_middleware(self) -> BaseMiddleware:
+        """Внутренний middleware роутера: спан самого хендлера."""
+        return _HandlerSpanMiddleware()
+
+    def request_middleware(self) -> BaseRequestMiddleware:
+        """Middleware сессии Bot API: спан на каждый вызов Telegram."""
+        return _BotApiSpanMiddleware()
+
+    # ----- решение о сохранении -----
+    def _finish(self, trace: _Trace, duration_ms: float) -> None:
+        forced = time.monotonic() < self._forced_until
+        keep = (
+            forced
+            or trace.error
+            or duration_ms >= self.slow_ms
+            or random.random() < self.sample_rate
+        )
+        if not keep:
+            metrics.inc("trace.dropped")
+            return
+        metrics.inc("trace.kept")
+        self._queue.append(trace)
+
+    # ----- /profile -----
+    def start_profiling(self, seconds: float) -> None:
+        loop = asyncio.get_running_loop()
+        self._forced_until = time.monotonic() + seconds
+        self.profiler.start(threading.get_ident())
+        self._ensure_flushing()
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+        self._stop_handle = loop.call_later(seconds, self._auto_stop)
+
+    def stop_profiling(self) -> List[Tuple[str, float, float]]:
+        self._forced_until = 0.0
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        return self.profiler.stop()
+
+    def _auto_stop(self) -> None:
+        self._stop_handle = None
+        report = self.stop_profiling()
+        logger.info(
+            "Профилирование завершено (%s сэмплов):\n%s",
+            self.profiler.samples,
+            "\n".join(f"{self_pct:5.1f}% {total_pct:5.1f}%  {label}" for label, self_pct, total_pct in report),
+        )
+
+    # ----- выгрузка -----
+    async def flush(self) -> None:
+        if not self._queue:
+            return
+        batch, self._queue = self._queue, []
+        try:
+            if TRACE_OTLP_ENDPOINT:
+                await self._post_otlp(batch)
+            else:
+                await asyncio.to_thread(_append_lines, TRACE_FILE, [_to_json(t) for t in batch])
+            metrics.inc("trace.exported", len(batch))
+        except Exception as e:
+            # трассы — не данные заказов: при сбое коллектора просто теряем пачку
+            logger.warning("Не удалось выгрузить %s трасс: %r", len(batch), e)
+
+    async def _post_otlp(self, batch: List[_Trace]) -> None:
+        import aiohttp
+
+        if self._http is None:
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+        async with self._http.post(TRACE_OTLP_ENDPOINT, json=_to_otlp(batch)) as resp:
+            resp.raise_for_status()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            await self.flush()
+
+    def _ensure_flushing(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            lifecycle.on_drain(self.stop)
+
+    def start(self) -> None:
+        if self.enabled:
+            self._ensure_flushing()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.profiler.running:
+            self.stop_profiling()
+        await self.flush()
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+
+class _UpdateTraceMiddleware(BaseMiddleware):
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.tracer.active or not isinstance(event, Update):
+            return await handler(event, data)
+
+        trace = _Trace({"update_id": event.update_id, "update_type": event.event_type})
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            with _Span(trace, "update", {}):
+                return await handler(event, data)
+        finally:
+            _trace.reset(token)
+            duration_ms = (time.perf_counter() - started) * 1000
+            trace.attrs["duration_ms"] = round(duration_ms, 2)
+            self.tracer._finish(trace, duration_ms)
+
+
+class _HandlerSpanMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        trace = _trace.get()
+        if trace is None:
+            return await handler(event, data)
+        name = getattr(data.get("handler"), "callback", None)
+        name = getattr(name, "__name__", "handler")
+        trace.attrs["handler"] = name
+        with _Span(trace, f"handler {name}", {}):
+            return await handler(event, data)
+
+
+class _BotApiSpanMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        trace = _trace.get()
+        if trace is None:
+            return await make_request(bot, method)
+        with _Span(trace, f"tg {method.__api_method__}", {}):
+            return await make_request(bot, method)
+
+
+class TracedStorage(BaseStorage):
+    """Обёртка над хранилищем FSM: каждая операция — спан fsm.*."""
+
+    def __init__(self, inner: BaseStorage):
+        self.inner = inner
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        with span("fsm.set_state"):
+            return await self.inner.set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        with span("fsm.get_state"):
+            return await self.inner.get_state(key)
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        with span("fsm.set_data"):
+            return await self.inner.set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        with span("fsm.get_data"):
+            return await self.inner.get_data(key)
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+# Общий на процесс трассировщик
+tracer = Tracer()
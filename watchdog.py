@@ -0,0 +1,167 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import metrics
+from config import LOOP_LAG_THRESHOLD, LOOP_WATCHDOG_INTERVAL
+from lifecycle import lifecycle
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Сколько кадров стека класть в лог
+_STACK_DEPTH = 12
+# Модуль с хендлерами: самый глубокий кадр оттуда и есть «виновный» обработчик
+_HANDLERS_FILE = "handlers.py"
+# Кадры из этих каталогов — библиотечные, место блокировки ищем среди остальных
+_LIB_DIRS = tuple({os.path.dirname(os.__file__), os.path.dirname(asyncio.__file__)})
+
+
+class LoopWatchdog:
+    """
+    Сторож цикла событий: находит синхронный код, который его блокирует.
+
+    - корутина-пульс засыпает на `interval` и меряет, насколько позже проснулась —
+      это и есть задержка цикла (метрики loop.lag_ms / loop.lag_max_ms);
+    - отдельный поток следит за пульсом; если цикл молчит дольше `threshold`,
+      он прямо во время блокировки снимает стек потока цикла
+      и запоминает, какой апдейт в этот момент обрабатывался;
+    - когда цикл оживает, пульс пишет в лог длительность, update_id,
+      обработчик и стек, и увеличивает loop.stalls.
+
+    Поток просыпается раз в `interval` и только сравнивает время,
+    стек снимается лишь при настоящей блокировке — держать включённым можно всегда.
+    """
+
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = time.monotonic()
+        self._max_lag = 0.0
+        self._captured_beat: Optional[float] = None
+        self._capture: Optional[Dict[str, Any]] = None
+        # задача -> (update_id, тип апдейта)
+        self._updates: Dict[asyncio.Task, Tuple[int, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ----- учёт апдейтов -----
+    def middleware(self) -> BaseMiddleware:
+        return _UpdateTracker(self)
+
+    # ----- пульс (в цикле) -----
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self._max_lag = max(self._max_lag, lag)
+            metrics.set_gauge("loop.lag_ms", round(lag * 1000, 1))
+            metrics.set_gauge("loop.lag_max_ms", round(self._max_lag * 1000, 1))
+            if lag >= self.threshold:
+                self._report(lag, started)
+
+    def _report(self, lag: float, beat: float) -> None:
+        capture = self._capture if self._captured_beat == beat else None
+        self._capture = None
+        metrics.inc("loop.stalls")
+        if capture is None:
+            # поток не успел снять стек (блокировка чуть выше порога)
+            logger.warning("loop stall lag_ms=%.0f update_id=- handler=-", lag * 1000)
+            return
+        metrics.inc(f"loop.stalls.{capture['handler']}")
+        logger.warning(
+            "loop stall lag_ms=%.0f update_id=%s update=%s handler=%s at=%s\n%s",
+            lag * 1000,
+            capture["update_id"],
+            capture["update_type"],
+            capture["handler"],
+            capture["at"],
+            capture["stack"],
+        )
+
+    # ----- наблюдатель (отдельный поток) -----
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked >= self.threshold and self._captured_beat != beat:
+                self._captured_beat = beat
+                try:
+                    self._capture = self._snapshot()
+                except Exception:
+                    logger.exception("Не удалось снять стек заблокированного цикла")
+
+    def _snapshot(self) -> Optional[Dict[str, Any]]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)
+        own = [f for f in stack if not f.filename.startswith(_LIB_DIRS) and "site-packages" not in f.filename]
+        # самый глубокий кадр нашего кода — там и блокировка
+        culprit = own[-1] if own else stack[-1]
+        handler = next(
+            (f.name for f in reversed(own) if os.path.basename(f.filename) == _HANDLERS_FILE),
+            culprit.name,
+        )
+        task = asyncio.current_task(self._loop)
+        update_id, update_type = self._updates.get(task, ("-", "-"))
+        return {
+            "update_id": update_id,
+            "update_type": update_type,
+            "handler": handler,
+            "at": f"{os.path.basename(culprit.filename)}:{culprit.lineno}",
+            "stack": "".join(traceback.format_list(stack[-_STACK_DEPTH:])),
+        }
+
+    # ----- запуск -----
+    def start(self) -> None:
+        if self._task is not None or self.threshold <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        lifecycle.on_drain(self.stop)
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class _UpdateTracker(BaseMiddleware):
+    def __init__(self, watchdog: LoopWatchdog):
+        self.watchdog = watchdog
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        task = asyncio.current_task()
+        if task is None or not isinstance(event, Update):
+            return await handler(event, data)
+        self.watchdog._updates[task] = (event.update_id, event.event_type)
+        try:
+            return await handler(event, data)
+        finally:
+            self.watchdog._updates.pop(task, None)
+
+
+# Общий на процесс сторож
+watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD, interval=LOOP_WATCHDOG_INTERVAL)
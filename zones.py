@@ -0,0 +1,258 @@
+import csv
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import ZONES_FILE
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Слова-типы, которые не входят в название улицы
+_STREET_TYPES = frozenset({
+    "ул", "улица", "пр", "пр-т", "пр-кт", "проспект", "пер", "переулок",
+    "б-р", "бульвар", "пл", "площадь", "ш", "шоссе", "наб", "набережная",
+    "проезд", "мкр", "микрорайон",
+})
+# Населённый пункт: сам маркер и следующее за ним название в улицу не входят
+_LOCALITY_MARKERS = frozenset({
+    "г", "гор", "город", "пгт", "пос", "поселок", "с", "село", "д", "дер", "деревня",
+    "обл", "область", "р-н", "район", "край", "респ", "республика",
+})
+# Что идёт после названия улицы: дом, корпус, квартира и т.п.
+_STOP_WORDS = frozenset({"д", "дом", "к", "корп", "корпус", "кв", "квартира", "стр", "строение", "под", "подъезд", "эт", "этаж"})
+_TOKEN_RE = re.compile(r"[0-9a-zа-я-]+")
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def _street_part(address: str) -> List[str]:
+    """
+    Токены той части адреса, где улица: части через запятую с населённым
+    пунктом ("г. Москва", "Московская обл.") отбрасываются; если улица помечена
+    типом ("ул.", "пр-т"), всё до её части ("Москва, ул. ...") тоже.
+    """
+    parts = [_TOKEN_RE.findall(p) for p in address.lower().replace("ё", "е").split(",")]
+    parts = [p for p in parts if p and not (_is_locality(p) and not _has_street_type(p))]
+    for i, part in enumerate(parts):
+        if _has_street_type(part):
+            parts = parts[i:]
+            break
+    tokens = [t for p in parts for t in p]
+    # "г Москва ул Ленина 5" без запятых: пропускаем маркер и название после него
+    if len(tokens) > 2 and _is_locality(tokens[:1]):
+        tokens = tokens[2:]
+    return tokens
+
+
+def _is_locality(tokens: List[str]) -> bool:
+    # "д" в начале части — скорее «дом», чем «деревня»
+    return (tokens[0] in _LOCALITY_MARKERS and tokens[0] != "д") or (
+        tokens[-1] in _LOCALITY_MARKERS and tokens[-1] != "д"
+    )
+
+
+def _has_street_type(tokens: List[str]) -> bool:
+    return any(t in _STREET_TYPES for t in tokens)
+
+
+def normalize_street(address: str) -> str:
+    """
+    "ул. Ленина, д. 5, кв 3"       -> "ленина"
+    "8 Марта 12"                   -> "8 марта"
+    "г. Москва, ул. Ленина 5"      -> "ленина"
+    """
+    street: List[str] = []
+    for token in _street_part(address or ""):
+        if token in _STREET_TYPES:
+            continue
+        if token in _STOP_WORDS:
+            break
+        # номер дома: цифры после того, как название уже началось
+        if street and any(ch.isdigit() for ch in token) and any(t.isalpha() for t in street[-1]):
+            break
+        street.append(token)
+    return " ".join(street)
+
+
+def geohash(lat: float, lon: float, precision: int = 6) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars: List[str] = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+class _TrieNode:
+    __slots__ = ("children", "zone", "zones")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.zone: Optional[str] = None   # зона улицы, заканчивающейся в этом узле
+        self.zones: set = set()           # все зоны в поддереве (для поиска по префиксу)
+
+
+class ZoneIndex:
+    """
+    Справочник «улица -> зона» в виде префиксного дерева + сетка геохешей.
+
+    lookup() ищет точное совпадение, затем однозначный префикс
+    ("лен" -> "ленина"), затем название с одной опечаткой.
+    Всё это — проход по дереву длиной в название улицы, без перебора справочника.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._streets = 0
+        self._cells: Dict[str, str] = {}
+        self._cell_lengths: List[int] = []
+
+    def __len__(self) -> int:
+        return self._streets + len(self._cells)
+
+    @property
+    def has_streets(self) -> bool:
+        return self._streets > 0
+
+    @property
+    def has_cells(self) -> bool:
+        return bool(self._cells)
+
+    def add_street(self, street: str, zone: str) -> None:
+        key = normalize_street(street)
+        if not key:
+            return
+        node = self._root
+        node.zones.add(zone)
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+            node.zones.add(zone)
+        if node.zone is None:
+            self._streets += 1
+        node.zone = zone
+
+    def add_cell(self, cell: str, zone: str) -> None:
+        self._cells[cell.lower()] = zone
+        self._cell_lengths = sorted({len(c) for c in self._cells}, reverse=True)
+
+    def lookup(self, address: str) -> Optional[str]:
+        key = normalize_street(address)
+        if not key:
+            return None
+
+        node = self._root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                break
+        else:
+            if node.zone:
+                return node.zone
+            if len(node.zones) == 1 and len(key) >= 3:
+                return next(iter(node.zones))
+
+        return self._fuzzy(key)
+
+    def _fuzzy(self, key: str) -> Optional[str]:
+        """
+        Поиск по дереву с расстоянием Левенштейна не больше 1.
+        Возвращает зону, только если все подходящие улицы в одной зоне.
+        """
+        found: set = set()
+        first_row = list(range(len(key) + 1))
+        for ch, child in self._root.children.items():
+            self._fuzzy_walk(child, ch, key, first_row, found)
+            if len(found) > 1:
+                return None
+        return next(iter(found)) if len(found) == 1 else None
+
+    def _fuzzy_walk(self, node: _TrieNode, ch: str, key: str, prev_row: List[int], found: set) -> None:
+        row = [prev_row[0] + 1]
+        for i in range(1, len(key) + 1):
+            row.append(min(
+                row[i - 1] + 1,
+                prev_row[i] + 1,
+                prev_row[i - 1] + (key[i - 1] != ch),
+            ))
+        if row[-1] <= 1 and node.zone:
+            found.add(node.zone)
+        if min(row) <= 1:
+            for next_ch, child in node.children.items():
+                self._fuzzy_walk(child, next_ch, key, row, found)
+
+    def lookup_location(self, lat: float, lon: float) -> Optional[str]:
+        if not self._cell_lengths:
+            return None
+        code = geohash(lat, lon, self._cell_lengths[0])
+        for length in self._cell_lengths:
+            zone = self._cells.get(code[:length])
+            if zone:
+                return zone
+        return None
+
+
+def load_index(path: Optional[str]) -> ZoneIndex:
+    index = ZoneIndex()
+    if not path:
+        return index
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                kind, key, zone = row.get("kind"), row.get("key"), row.get("zone")
+                if not key or not zone:
+                    continue
+                if kind == "geohash":
+                    index.add_cell(key.strip(), zone.strip())
+                else:
+                    index.add_street(key, zone.strip())
+    except OSError:
+        logger.warning("Справочник зон %s не найден, адреса не проверяются", path)
+    return index
+
+
+_index: Optional[ZoneIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> ZoneIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index(ZONES_FILE)
+    return _index
+
+
+def find_zone(address: str) -> Tuple[Optional[str], bool]:
+    """
+    (зона, проверялся_ли_адрес). Нет улиц в справочнике — адрес не проверяем.
+    """
+    index = get_index()
+    if not index.has_streets:
+        return None, False
+    return index.lookup(address), True
+
+
+def find_zone_by_location(lat: float, lon: float) -> Tuple[Optional[str], bool]:
+    """(зона, проверялась_ли_точка). Нет геохеш-ячеек — точку не проверяем."""
+    index = get_index()
+    if not index.has_cells:
+        return None, False
+    return index.lookup_location(lat, lon), True